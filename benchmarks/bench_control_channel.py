@@ -0,0 +1,116 @@
+# Benchmark: control channel throughput and join-to-sync latency between local nodes
+# Throughput: one node queues a burst of control messages and we time how long
+# until every other node has received them, and how many frames that took.
+# Latency: a node offers its ticket doc, and we time from the offer arriving
+# to the receiving node having synced the doc's tickets.
+# Usage: python3 benchmarks/bench_control_channel.py [--nodes N] [--messages N] [--tickets N]
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import iroh
+import recurso
+import control_codec
+from blake3 import blake3
+
+async def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.001)
+    return True
+
+# on_join_offer(index) gives the join offer handler for each node, None syncs for real
+async def start_channels(nodes, topic, tickets, on_join_offer):
+    first_addr = await nodes[0].net().node_addr()
+    first_id = str(await nodes[0].net().node_id())
+    channels = []
+    for index, node in enumerate(nodes):
+        channel = recurso.ControlChannel(node, topic, tickets[index], on_join_offer(index))
+        if index:
+            await node.net().add_node_addr(first_addr)
+        await channel.start([first_id] if index else [])
+        channels.append(channel)
+    return channels
+
+async def bench_throughput(args):
+    nodes = [recurso.node] + [await iroh.Iroh.memory() for _ in range(args.nodes - 1)]
+    topic = blake3(b"bench_control_channel_throughput").digest()
+    channels = await start_channels(nodes, topic, ["doc"] * len(nodes), lambda index: lambda offer: None)
+    # Wait for everyone to hear everyone's initial offer
+    await wait_for(lambda: all(channel.messages_received >= 1 for channel in channels[1:]), args.timeout)
+    baseline = [channel.messages_received for channel in channels]
+
+    sender = channels[0]
+    frames_before = sender.frames_sent
+    start = time.perf_counter()
+    for i in range(args.messages):
+        sender.send(control_codec.JoinOffer("bench-node-{}".format(i), "docbench{}".format(i)))
+        # Let the flusher in now and then, the way real events trickle in
+        if i % 256 == 0:
+            await asyncio.sleep(0)
+    received = await wait_for(
+        lambda: all(channel.messages_received - base >= args.messages for channel, base in zip(channels[1:], baseline[1:])),
+        args.timeout,
+    )
+    elapsed = time.perf_counter() - start
+
+    print("Throughput: {} messages to {} peers".format(args.messages, len(nodes) - 1))
+    if not received:
+        print("  timed out after {}s".format(args.timeout))
+    print("  {:.2f}s, {:.0f} messages/sec".format(elapsed, args.messages / elapsed))
+    print("  {} frames, {:.1f} messages/frame".format(sender.frames_sent - frames_before, args.messages / max(sender.frames_sent - frames_before, 1)))
+    for channel in channels:
+        channel.stop()
+
+async def bench_join_to_sync(args):
+    # The offering node keeps a ticket doc full of published document tickets
+    offering_node = await iroh.Iroh.memory()
+    offering_author = await offering_node.authors().create()
+    tickets_doc = await offering_node.docs().create()
+    for i in range(args.tickets):
+        doc = await offering_node.docs().create()
+        ticket = await doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
+        await tickets_doc.set_bytes(offering_author, bytes(recurso.ticket_key(doc.id(), "-"), "utf-8"), bytes(str(ticket), "utf-8"))
+    read_only_ticket = await tickets_doc.share(iroh.ShareMode.READ, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
+
+    topic = blake3(b"bench_control_channel_join").digest()
+    # Only the recurso node syncs, the offering node ignores offers
+    ignore_offers = lambda offer: None
+    channels = await start_channels([offering_node, recurso.node], topic, [read_only_ticket, "doc"],
+                                    lambda index: None if index else ignore_offers)
+    receiver = channels[1]
+    synced = await wait_for(lambda: receiver.sync_latencies, args.timeout)
+    await recurso.sync_scheduler_queue.wait_idle()
+
+    print("Join to sync: {} tickets".format(args.tickets))
+    if not synced:
+        print("  timed out after {}s".format(args.timeout))
+    else:
+        print("  offer to tickets scanned: {:.1f} ms".format(receiver.sync_latencies[0] * 1e3))
+    print("  sync jobs: {}".format(recurso.sync_scheduler_queue.progress()))
+    for channel in channels:
+        channel.stop()
+
+async def main():
+    parser = argparse.ArgumentParser(description='Control channel benchmark')
+    parser.add_argument('--nodes', type=int, default=3, help='local nodes on the gossip topic')
+    parser.add_argument('--messages', type=int, default=10000, help='control messages to send for the throughput run')
+    parser.add_argument('--tickets', type=int, default=100, help='tickets in the offered ticket doc')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for each run')
+    args = parser.parse_args()
+
+    await recurso.setup_iroh_node()
+    await recurso.create_root_document()
+    await bench_throughput(args)
+    await bench_join_to_sync(args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+# Benchmark: files created per second on a local in-memory node
+# Each file is a FileDoc, a metadata doc, three tickets and a children entry
+# Usage: python3 benchmarks/bench_create_files.py [--files N] [--parallel N]
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import recurso
+
+async def create_file(index, blob_hash, size, children_doc_id, inode_map_doc_id, ticket_doc_id):
+    name = "file-{}.txt".format(index)
+    file_doc_id = await recurso.create_file_document(name, size, blob_hash, inode_map_doc_id, ticket_doc_id)
+    await recurso.set_by_key(children_doc_id, await recurso.encode_filename(name, "file"), bytes(file_doc_id, "utf-8"))
+
+async def main():
+    parser = argparse.ArgumentParser(description='File creation benchmark')
+    parser.add_argument('--files', type=int, default=500, help='number of files to create')
+    parser.add_argument('--parallel', type=int, default=1, help='files to create at once')
+    args = parser.parse_args()
+
+    await recurso.setup_iroh_node()
+    root_doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+    children_doc_id = await recurso.get_by_key(directory_doc_id, "children")
+    # Every file shares one small blob, we're measuring document writes
+    content = b"benchmark"
+    blob_hash, size = await recurso.add_blob_bytes(content), len(content)
+
+    semaphore = asyncio.Semaphore(args.parallel)
+
+    async def create_one(index):
+        async with semaphore:
+            await create_file(index, blob_hash, size, children_doc_id, inode_map_doc_id, ticket_doc_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[create_one(index) for index in range(args.files)])
+    elapsed = time.perf_counter() - start
+
+    print("Created {} files in {:.2f}s ({} at a time)".format(args.files, elapsed, args.parallel))
+    print("  {:.1f} files/sec".format(args.files / elapsed))
+    print("  {:.2f} ms/file".format(elapsed / args.files * 1e3))
+
+if __name__ == "__main__":
+    asyncio.run(main())
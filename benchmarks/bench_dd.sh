@@ -0,0 +1,23 @@
+#!/bin/sh
+# Write throughput into a mounted recurso filesystem with dd
+# Usage: benchmarks/bench_dd.sh /mnt/test [total MiB]
+set -e
+
+MOUNTPOINT="$1"
+TOTAL_MIB="${2:-256}"
+
+if [ -z "$MOUNTPOINT" ]; then
+    echo "Usage: $0 <mountpoint> [total MiB]"
+    exit 1
+fi
+
+for BS in 4k 1M; do
+    case "$BS" in
+        4k) COUNT=$((TOTAL_MIB * 256)) ;;
+        1M) COUNT=$TOTAL_MIB ;;
+    esac
+    echo "dd bs=$BS count=$COUNT"
+    # conv=fsync so the final flush (the blob commit) is part of the timing
+    dd if=/dev/zero of="$MOUNTPOINT/dd-bench-$BS" bs=$BS count=$COUNT conv=fsync 2>&1 | tail -n 1
+    rm -f "$MOUNTPOINT/dd-bench-$BS"
+done
@@ -0,0 +1,78 @@
+# Micro-benchmark: tickets per second through the ticket codec
+# Needs nothing but the standard library, the tickets are generated with the encoder
+# Usage: python3 benchmarks/bench_decode_ticket.py [--tickets N] [--addresses N] [--rounds N]
+import os
+import sys
+import time
+import random
+import argparse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import decode_ticket
+
+def random_base32(length):
+    return decode_ticket.encode_base32(os.urandom(length))
+
+def random_node_addr(addresses):
+    direct_addresses = tuple("192.168.{}.{}:{}".format(random.randrange(256), random.randrange(256), random.randrange(1, 65536))
+                             for _ in range(addresses))
+    return decode_ticket.NodeAddr(random_base32(decode_ticket.NODE_ID_LENGTH),
+                                  decode_ticket.AddrInfo("https://euw1-1.relay.iroh.network./", direct_addresses))
+
+def make_tickets(count, addresses):
+    tickets = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            ticket = decode_ticket.NodeTicket(decode_ticket.TicketType.NODE, random_node_addr(addresses))
+        elif kind == 1:
+            ticket = decode_ticket.BlobTicket(decode_ticket.TicketType.BLOB, random_node_addr(addresses),
+                                              decode_ticket.BlobFormat.RAW, random_base32(decode_ticket.HASH_LENGTH))
+        else:
+            ticket = decode_ticket.DocTicket(decode_ticket.TicketType.DOC, decode_ticket.Capability.WRITE,
+                                             random_base32(decode_ticket.SECRET_KEY_LENGTH), (random_node_addr(addresses),))
+        tickets.append(ticket)
+    return tickets
+
+def rate(fn, items, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(items)
+    return len(items) * rounds / (time.perf_counter() - start)
+
+def decode_uncached(strings):
+    for ticket_string in strings:
+        decode_ticket.TicketDecoder(ticket_string).decode()
+
+def decode_cached(strings):
+    for ticket_string in strings:
+        decode_ticket.decode_iroh_ticket(ticket_string)
+
+def encode(tickets):
+    for ticket in tickets:
+        decode_ticket.encode_iroh_ticket(ticket)
+
+def main():
+    parser = argparse.ArgumentParser(description='Ticket codec benchmark')
+    parser.add_argument('--tickets', type=int, default=3000, help='distinct tickets to generate')
+    parser.add_argument('--addresses', type=int, default=2, help='direct addresses per node')
+    parser.add_argument('--rounds', type=int, default=10, help='passes over the tickets per measurement')
+    args = parser.parse_args()
+
+    tickets = make_tickets(args.tickets, args.addresses)
+    strings = [decode_ticket.encode_iroh_ticket(ticket) for ticket in tickets]
+
+    print("{} tickets, {} direct addresses each, {} rounds".format(args.tickets, args.addresses, args.rounds))
+    print("  encode:           {:>12,.0f} tickets/sec".format(rate(encode, tickets, args.rounds)))
+    print("  decode, no cache: {:>12,.0f} tickets/sec".format(rate(decode_uncached, strings, args.rounds)))
+    decode_ticket.clear_decode_cache()
+    decode_cached(strings)
+    print("  decode, cached:   {:>12,.0f} tickets/sec".format(rate(decode_cached, strings, args.rounds)))
+    decode_ticket.clear_decode_cache()
+    print("  bulk decode:      {:>12,.0f} tickets/sec".format(rate(decode_ticket.decode_iroh_tickets, strings, args.rounds)))
+
+if __name__ == "__main__":
+    main()
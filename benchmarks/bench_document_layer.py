@@ -0,0 +1,173 @@
+# Micro-benchmarks for the recurso.py document layer, on a local in-memory node
+# Results are written as JSON, so runs from two commits can be compared with --compare
+# Usage: python3 benchmarks/bench_document_layer.py [--output results.json] [--compare baseline.json]
+#                                                   [--iterations N] [--children 1000,10000,100000]
+#                                                   [--blob-sizes 1024,65536,1048576,16777216] [--only NAME]
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import contextlib
+import subprocess
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import recurso
+
+# How many writes are in flight while filling children documents
+FILL_CONCURRENCY = 64
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def summarise(name, params, samples):
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(samples),
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "max_us": max(samples) * 1e6,
+    }
+
+async def measure(name, params, fn, iterations, warmup=1):
+    # Time iterations calls of fn() one after another
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    result = summarise(name, params, samples)
+    print("{:<40} {:>10.1f} us mean {:>10.1f} us p99".format(
+        name + "".join(" {}={}".format(k, v) for k, v in params.items()), result["mean_us"], result["p99_us"]),
+        file=sys.stderr)
+    return result
+
+async def fill_children_document(count):
+    # A children document with count file entries, written straight to the doc
+    # so the fill doesn't go through the entry count for every key
+    children_doc_id = await recurso.create_children_document(None)
+    doc = await recurso.open_document(children_doc_id)
+    for start in range(0, count, 10000):
+        batch = recurso.WriteBatch(FILL_CONCURRENCY)
+        for index in range(start, min(start + 10000, count)):
+            name = await recurso.encode_filename("file-{}".format(index), "file")
+            batch.set(doc, name, children_doc_id)
+        await batch.commit()
+    await recurso.set_by_key(children_doc_id, recurso.CHILD_COUNT_KEY.decode(), bytes(str(count), "utf-8"))
+    return doc
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=project_root, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    await recurso.setup_iroh_node()
+    root_doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+    metadata_doc_id = await recurso.get_by_key(directory_doc_id, "metadata")
+    empty_blob_hash = await recurso.add_blob_bytes(b"")
+
+    def wanted(name):
+        return not args.only or name in args.only
+
+    results = []
+    if wanted("get_by_key"):
+        results.append(await measure("get_by_key", {}, lambda: recurso.get_by_key(directory_doc_id, "metadata"), args.iterations))
+    if wanted("get_metadata"):
+        results.append(await measure("get_metadata", {}, lambda: recurso.get_metadata(metadata_doc_id), args.iterations))
+    if wanted("find_and_fetch_metadata_for_doc_id"):
+        results.append(await measure("find_and_fetch_metadata_for_doc_id", {},
+                                     lambda: recurso.find_and_fetch_metadata_for_doc_id(directory_doc_id), args.iterations))
+
+    if wanted("create_file_document"):
+        counter = iter(range(1 << 62))
+        results.append(await measure("create_file_document", {}, lambda: recurso.create_file_document(
+            "file-{}".format(next(counter)), 0, empty_blob_hash, inode_map_doc_id, ticket_doc_id), args.create_iterations))
+    if wanted("create_directory_document"):
+        counter = iter(range(1 << 62))
+        results.append(await measure("create_directory_document", {}, lambda: recurso.create_directory_document(
+            "dir-{}".format(next(counter)), inode_map_doc_id, ticket_doc_id), args.create_iterations))
+
+    if wanted("get_all_keys_by_prefix"):
+        for count in args.children:
+            print("Filling a children document with {} entries".format(count), file=sys.stderr)
+            doc = await fill_children_document(count)
+            # Listing big documents is slow, so fewer rounds for the biggest
+            iterations = max(3, min(args.iterations, 1000000 // count))
+            results.append(await measure("get_all_keys_by_prefix", {"entries": count},
+                                         lambda: recurso.get_all_keys_by_prefix(doc, "fs"), iterations))
+
+    if wanted("get_blob"):
+        for size in args.blob_sizes:
+            blob_hash = str(await recurso.add_blob_bytes(os.urandom(size)))
+            iterations = max(3, min(args.iterations, (256 << 20) // max(size, 1)))
+            results.append(await measure("get_blob", {"bytes": size}, lambda: recurso.get_blob(blob_hash), iterations))
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+def result_key(result):
+    return (result["name"], tuple(sorted(result["params"].items())))
+
+def compare(report, baseline):
+    # Mean latency against the baseline, slower than 1.00x is a regression
+    previous = {result_key(result): result for result in baseline["results"]}
+    print("Compared with {}".format(baseline.get("commit") or "baseline"), file=sys.stderr)
+    for result in report["results"]:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        label = result["name"] + "".join(" {}={}".format(k, v) for k, v in result["params"].items())
+        print("  {:<40} {:>10.1f} -> {:>10.1f} us  {:.2f}x".format(
+            label, before["mean_us"], result["mean_us"], result["mean_us"] / before["mean_us"]), file=sys.stderr)
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+async def main():
+    parser = argparse.ArgumentParser(description='Document layer micro-benchmarks')
+    parser.add_argument('--iterations', type=int, default=1000, help='calls to time for each read benchmark')
+    parser.add_argument('--create-iterations', type=int, default=200, help='documents to create for each create benchmark')
+    parser.add_argument('--children', type=int_list, default=[1000, 10000, 100000], help='children document sizes for get_all_keys_by_prefix')
+    parser.add_argument('--blob-sizes', type=int_list, default=[1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024], help='blob sizes for get_blob, in bytes')
+    parser.add_argument('--only', action='append', help='only run this benchmark, can be given more than once')
+    parser.add_argument('--output', type=str, default=None, help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results from an earlier run to compare against')
+    args = parser.parse_args()
+
+    # Keep per-op debug logging out of the timings
+    logging.basicConfig(level=logging.WARNING)
+    # The node prints as it starts up, keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = await run(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    asyncio.run(main())
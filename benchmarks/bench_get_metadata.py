@@ -0,0 +1,53 @@
+# Micro-benchmark: latency of a single get_metadata call
+# Compares the old one-get_exact-per-field loop against the single prefix query
+# Usage: python3 benchmarks/bench_get_metadata.py [--iterations N]
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import recurso
+
+# The pre-batching implementation, kept here as the baseline
+async def get_metadata_sequential(doc_id):
+    metadata_doc = await recurso.open_document(doc_id)
+    metadata = {}
+    for key in recurso.Metadata.__slots__:
+        entry = await metadata_doc.get_exact(recurso.author, key.encode(), False)
+        if entry:
+            value = await entry.content_bytes(metadata_doc)
+            metadata[key] = int(value.decode())
+    return metadata
+
+async def time_calls(fn, doc_id, iterations):
+    # Warm up the document handle cache so we only measure the reads
+    await fn(doc_id)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await fn(doc_id)
+    return (time.perf_counter() - start) / iterations
+
+async def main():
+    parser = argparse.ArgumentParser(description='get_metadata micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=1000, help='calls to time per implementation')
+    args = parser.parse_args()
+
+    await recurso.setup_iroh_node()
+    root_doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+    metadata_doc_id = await recurso.get_by_key(directory_doc_id, "metadata")
+
+    before = await time_calls(get_metadata_sequential, metadata_doc_id, args.iterations)
+    after = await time_calls(recurso.get_metadata, metadata_doc_id, args.iterations)
+
+    print("get_metadata latency over {} calls".format(args.iterations))
+    print("  sequential get_exact: {:.1f} us/call".format(before * 1e6))
+    print("  single query:         {:.1f} us/call".format(after * 1e6))
+    print("  speedup:              {:.2f}x".format(before / after))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+# Benchmark: memory and lookup speed of the inode table against a dict of strings
+# Needs nothing but the standard library, the inodes and doc IDs are random
+# Usage: python3 benchmarks/bench_inode_table.py [--inodes N] [--lookups N] [--updates N]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import decode_ticket
+import inode_table
+
+def dict_size(dictionary):
+    # The dict itself plus every key and value string it holds
+    return sys.getsizeof(dictionary) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in dictionary.items())
+
+def main():
+    parser = argparse.ArgumentParser(description='Inode table benchmark')
+    parser.add_argument('--inodes', type=int, default=1000000, help='inodes in the table')
+    parser.add_argument('--lookups', type=int, default=200000, help='lookups to time')
+    parser.add_argument('--updates', type=int, default=10000, help='inode map events to apply')
+    args = parser.parse_args()
+
+    print("Generating {} inodes".format(args.inodes))
+    pairs = [(random.getrandbits(64), decode_ticket.encode_base32(os.urandom(inode_table.DOC_ID_LENGTH)))
+             for _ in range(args.inodes)]
+    # What the inode map holds, decimal keys and doc ID strings
+    as_strings = [(str(inode), doc_id) for inode, doc_id in pairs]
+
+    dict_bytes = dict_size(dict(as_strings))
+    del as_strings
+
+    start = time.perf_counter()
+    table = inode_table.InodeTable()
+    table.bulk_load(pairs)
+    load_time = time.perf_counter() - start
+    table_bytes = table.memory_usage()
+
+    print("Memory for {} inodes".format(args.inodes))
+    print("  dict of strings: {:>8.1f} MB".format(dict_bytes / 1e6))
+    print("  inode table:     {:>8.1f} MB  (bulk load {:.2f}s)".format(table_bytes / 1e6, load_time))
+
+    keys = [random.choice(pairs)[0] for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for inode in keys:
+        table.get(inode)
+    elapsed = time.perf_counter() - start
+    print("  lookups:         {:>8.0f} /sec".format(args.lookups / elapsed))
+
+    start = time.perf_counter()
+    for _ in range(args.updates):
+        table.set(random.getrandbits(64), pairs[0][1])
+    table.merge()
+    elapsed = time.perf_counter() - start
+    print("  updates:         {:>8.0f} /sec (merged every {})".format(args.updates / elapsed, table.merge_threshold))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "inode-table.bin")
+        start = time.perf_counter()
+        table.save(path)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped = inode_table.InodeTable.load(path)
+        map_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for inode in keys:
+            mapped.get(inode)
+        elapsed = time.perf_counter() - start
+        print("  save: {:.3f}s, map: {:.4f}s, mapped lookups: {:.0f} /sec".format(save_time, map_time, args.lookups / elapsed))
+        del mapped
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Sequential read benchmark over large blobs
+# Reads each blob front to back in FUSE-sized chunks with get_blob_range and reports
+# throughput and peak RSS, so we can check neither grows with the size of the file.
+# Usage: python3 benchmarks/bench_sequential_read.py [--sizes-gib 1 2 4] [--chunk-size 131072] [--readahead-max 8388608]
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import recurso
+import readahead
+
+GIB = 1024 * 1024 * 1024
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def write_test_file(path, size):
+    # Random data is slow to generate, so repeat one random block
+    block = os.urandom(64 * 1024 * 1024)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(remaining, len(block))])
+            remaining -= len(block)
+
+async def add_test_blob(size, tmp_dir):
+    path = os.path.join(tmp_dir, "blob-{}".format(size))
+    write_test_file(path, size)
+    cb = recurso.AddCallback()
+    await recurso.node.blobs().add_from_path(path, False, recurso.iroh.SetTagOption.auto(), recurso.iroh.WrapOption.no_wrap(), cb)
+    os.remove(path)
+    return str(cb.hash)
+
+async def sequential_read(blob_hash, size, chunk_size, readahead_max=0):
+    start = time.perf_counter()
+    offset = 0
+    if readahead_max:
+        # Through the same readahead the FUSE read path uses
+        reader = readahead.Readahead(recurso.BlobReader(blob_hash, size), max_window=readahead_max)
+        while offset < size:
+            data = await reader.read(offset, chunk_size)
+            offset += len(data)
+        reader.close()
+        return time.perf_counter() - start
+    while offset < size:
+        data = await recurso.get_blob_range(blob_hash, offset, chunk_size)
+        offset += len(data)
+    return time.perf_counter() - start
+
+async def main():
+    parser = argparse.ArgumentParser(description='Sequential read benchmark')
+    parser.add_argument('--sizes-gib', type=float, nargs='+', default=[1, 2, 4], help='blob sizes to test, in GiB')
+    parser.add_argument('--chunk-size', type=int, default=128 * 1024, help='bytes per read, like a FUSE read request')
+    parser.add_argument('--readahead-max', type=int, default=0, help='read through readahead with this largest window, 0 reads directly')
+    parser.add_argument('--tmp-dir', type=str, default=None, help='where to stage the test files')
+    parser.add_argument('--data-dir', type=str, default=None, help='use an on-disk node here, so blobs are not held in RAM')
+    args = parser.parse_args()
+
+    await recurso.setup_iroh_node(data_dir=args.data_dir)
+
+    print("{:>10} {:>10} {:>12} {:>14}".format("size GiB", "seconds", "MiB/s", "peak RSS MiB"))
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        # Smallest first, since peak RSS only ever goes up
+        for size_gib in sorted(args.sizes_gib):
+            size = int(size_gib * GIB)
+            blob_hash = await add_test_blob(size, tmp_dir)
+            elapsed = await sequential_read(blob_hash, size, args.chunk_size, args.readahead_max)
+            print("{:>10.2f} {:>10.2f} {:>12.1f} {:>14.1f}".format(
+                size_gib, elapsed, size / elapsed / (1024 * 1024), peak_rss_mib()))
+            await recurso.delete_blob(recurso.iroh.Hash.from_string(blob_hash))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+# Benchmark: processing lag of the watch pipeline under a burst of remote inserts
+# By default replays synthetic insert events straight into the pipeline, which
+# needs nothing but the standard library. With --iroh, a second in-memory node
+# writes the inserts into a document this node watches, end to end.
+# Usage: python3 benchmarks/bench_watch_lag.py [--inserts N] [--keys N] [--handler-us N] [--iroh]
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import watch_pipeline
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def print_lags(lags, handled, inserts, elapsed):
+    print("  handled {} of {} inserts in {:.2f}s ({:.0f} inserts/sec)".format(handled, inserts, elapsed, inserts / elapsed))
+    print("  lag p50: {:.2f} ms".format(percentile(lags, 0.50) * 1e3))
+    print("  lag p99: {:.2f} ms".format(percentile(lags, 0.99) * 1e3))
+    print("  lag max: {:.2f} ms".format(max(lags, default=0.0) * 1e3))
+
+async def bench_synthetic(args):
+    pipeline = watch_pipeline.WatchPipeline(args.queue_size)
+    lags = []
+
+    async def handler(doc_id, written_at):
+        lags.append(time.perf_counter() - written_at)
+        # Stand-in for the work a real listener does per event
+        if args.handler_us:
+            deadline = time.perf_counter() + args.handler_us / 1e6
+            while time.perf_counter() < deadline:
+                pass
+
+    for doc in range(args.docs):
+        pipeline.watch(doc, handler)
+
+    start = time.perf_counter()
+    for i in range(args.inserts):
+        await pipeline.put(i % args.docs, (True, i % args.keys), time.perf_counter())
+        # Let the dispatcher in now and then, the way a real subscription would
+        if i % 64 == 0:
+            await asyncio.sleep(0)
+    await pipeline.drain()
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+
+    stats = pipeline.stats()
+    print("Synthetic: {} inserts over {} keys in {} docs".format(args.inserts, args.keys, args.docs))
+    print_lags(lags, len(lags), args.inserts, elapsed)
+    print("  coalesced: {}, producer blocked: {} times".format(stats["coalesced"], stats["blocked"]))
+
+async def bench_iroh(args):
+    import iroh
+    import recurso
+
+    await recurso.setup_iroh_node()
+    root_doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    # A second node plays the remote writer
+    writer = await iroh.Iroh.memory()
+    writer_author = await writer.authors().create()
+    writer_doc = await writer.docs().create()
+    ticket = await writer_doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
+    doc = await recurso.join_and_wait_for_sync(str(ticket))
+
+    lags = []
+    done = asyncio.Event()
+
+    async def listener(doc_id, entry):
+        content = await entry.content_bytes(doc)
+        lags.append(time.time() - float(content.decode()))
+        if len(lags) >= args.inserts - recurso.change_pipeline.coalesced:
+            done.set()
+
+    await recurso.watch_document_changes(doc.id(), listener, remote_only=True)
+
+    start = time.perf_counter()
+    for i in range(args.inserts):
+        await writer_doc.set_bytes(writer_author, bytes("key-{}".format(i % args.keys), "utf-8"), bytes(str(time.time()), "utf-8"))
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        print("Timed out after {}s".format(args.timeout))
+    elapsed = time.perf_counter() - start
+
+    stats = recurso.change_pipeline.stats()
+    print("Iroh: {} remote inserts over {} keys".format(args.inserts, args.keys))
+    print_lags(lags, len(lags), args.inserts, elapsed)
+    print("  coalesced: {}, producer blocked: {} times".format(stats["coalesced"], stats["blocked"]))
+
+async def main():
+    parser = argparse.ArgumentParser(description='Watch pipeline lag benchmark')
+    parser.add_argument('--inserts', type=int, default=100000, help='number of remote inserts to replay')
+    parser.add_argument('--keys', type=int, default=100000, help='distinct keys, fewer keys means more coalescing')
+    parser.add_argument('--docs', type=int, default=16, help='documents to spread synthetic inserts over')
+    parser.add_argument('--handler-us', type=int, default=0, help='busy-work per synthetic event, in microseconds')
+    parser.add_argument('--queue-size', type=int, default=watch_pipeline.MAX_PENDING_PER_DOC, help='pending events per document')
+    parser.add_argument('--iroh', action='store_true', help='write the inserts from a second iroh node')
+    parser.add_argument('--timeout', type=float, default=600, help='give up waiting for --iroh inserts after this long')
+    args = parser.parse_args()
+
+    if args.iroh:
+        await bench_iroh(args)
+    else:
+        await bench_synthetic(args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+# Bookkeeping for blobs fetched from other nodes, kept within a byte budget.
+# Only downloads are tracked: blobs we authored ourselves are never evicted.
+# Reads move a blob to the back of the LRU, and adding one past the budget
+# hands back the least recently read blobs that aren't pinned, for the caller
+# to drop from the store. Where each blob came from is remembered after it's
+# evicted, so a later read can fetch it again. A blob bigger than the whole
+# budget doesn't count against it: it's kept only while pinned, so readers can
+# finish with it, and is the first to go after that.
+from collections import OrderedDict
+
+class CachedBlob:
+    __slots__ = ("size", "source")
+
+    def __init__(self, size, source):
+        self.size = size
+        self.source = source
+
+class BlobCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # hash -> CachedBlob, least recently read first
+        self.entries = OrderedDict()
+        # hash -> source, for blobs we've evicted and may need again
+        self.evicted = {}
+        # hash -> number of pins, pinned blobs are never evicted
+        self.pins = {}
+        # Tracked blobs bigger than max_bytes
+        self.oversized = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def add(self, blob_hash, size, source):
+        # Track a blob that has just been fetched, returns the hashes to evict
+        self.remove(blob_hash)
+        self.evicted.pop(blob_hash, None)
+        self.entries[blob_hash] = CachedBlob(size, source)
+        if size > self.max_bytes:
+            self.oversized.add(blob_hash)
+            self.entries.move_to_end(blob_hash, last=False)
+        else:
+            self.size += size
+        return self.over_budget()
+
+    def remove(self, blob_hash):
+        cached = self.entries.pop(blob_hash, None)
+        if cached is not None:
+            if blob_hash in self.oversized:
+                self.oversized.discard(blob_hash)
+            else:
+                self.size -= cached.size
+        return cached
+
+    def touch(self, blob_hash):
+        # Count a read, True if it's a blob we're tracking
+        if blob_hash not in self.entries:
+            return False
+        if blob_hash not in self.oversized:
+            self.entries.move_to_end(blob_hash)
+        self.hits += 1
+        return True
+
+    def source(self, blob_hash):
+        # Where to fetch a blob from again, or None if it never came from a peer
+        cached = self.entries.get(blob_hash)
+        if cached is not None:
+            return cached.source
+        return self.evicted.get(blob_hash)
+
+    def missing(self, blob_hash):
+        # A read found the blob gone from the store. Returns its source if we can refetch it
+        source = self.source(blob_hash)
+        if source is not None:
+            self.misses += 1
+            self.remove(blob_hash)
+            self.evicted[blob_hash] = source
+        return source
+
+    def pin(self, blob_hash):
+        self.pins[blob_hash] = self.pins.get(blob_hash, 0) + 1
+
+    def unpin(self, blob_hash):
+        pins = self.pins.get(blob_hash, 0) - 1
+        if pins > 0:
+            self.pins[blob_hash] = pins
+        else:
+            self.pins.pop(blob_hash, None)
+
+    def over_budget(self):
+        # Evict oversized blobs nobody has pinned, then from the front until we
+        # fit, stepping over pinned blobs
+        evict = [blob_hash for blob_hash in self.oversized if blob_hash not in self.pins]
+        for blob_hash in evict:
+            self.evict(blob_hash)
+        if self.size <= self.max_bytes:
+            return evict
+        for blob_hash in list(self.entries):
+            if self.size <= self.max_bytes:
+                break
+            if blob_hash in self.pins:
+                continue
+            self.evict(blob_hash)
+            evict.append(blob_hash)
+        return evict
+
+    def evict(self, blob_hash):
+        cached = self.remove(blob_hash)
+        self.evicted[blob_hash] = cached.source
+        self.evictions += 1
+        self.evicted_bytes += cached.size
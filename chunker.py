@@ -0,0 +1,134 @@
+# Content-defined chunking, based on FastCDC (gear rolling hash with normalised chunking)
+# Cut points depend only on nearby content, so an edit in one place of a file
+# only changes the chunks around it and every other chunk keeps its hash.
+import random
+from typing import BinaryIO, Iterator, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MIN_SIZE = 256 * 1024
+AVG_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+HASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+# Fixed gear table. Changing the seed changes every cut point, which breaks dedup
+# against chunks already in the store, so never change it.
+_gear_rng = random.Random(0x5265637572736f)
+GEAR = [_gear_rng.getrandbits(64) for _ in range(256)]
+
+# The hash shifts one place left per byte, so after 64 bytes the oldest has been
+# shifted out and the hash at any position is a sum over the 64 bytes ending there.
+# With numpy that sum is worked out for a whole block of positions at once.
+WINDOW = 64
+# Positions hashed per numpy pass, small enough that we don't hash far past the cut
+SCAN_BLOCK = 64 * 1024
+if numpy is not None:
+    GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64)
+
+def _top_bits_mask(bits: int) -> int:
+    # The gear hash shifts left, so the top bits depend on the most bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+class Chunker:
+    def __init__(self, min_size: int = MIN_SIZE, avg_size: int = AVG_SIZE, max_size: int = MAX_SIZE):
+        if not 0 < min_size <= avg_size <= max_size:
+            raise ValueError("Chunk sizes must satisfy 0 < min_size <= avg_size <= max_size")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = max(avg_size.bit_length() - 1, 1)
+        # Harder to match before the average size, easier after it
+        self.mask_small = _top_bits_mask(bits + 2)
+        self.mask_large = _top_bits_mask(max(bits - 2, 1))
+
+    def find_cut(self, data) -> int:
+        # Length of the first chunk in data
+        length = len(data)
+        if length <= self.min_size:
+            return length
+        end = min(length, self.max_size)
+        normal = min(self.avg_size, end)
+        if numpy is None:
+            cut = self.find_cut_python(data, self.min_size, end, normal)
+            return end if cut is None else cut
+        # The hash starts from zero at min_size, so its first positions don't have a
+        # full window behind them yet. Those few go through the byte loop
+        window_start = min(self.min_size + WINDOW - 1, end)
+        cut = self.find_cut_python(data, self.min_size, window_start, normal)
+        if cut is not None:
+            return cut
+        array = numpy.frombuffer(data, dtype=numpy.uint8, count=end)
+        i = window_start
+        while i < end:
+            stop = min(i + SCAN_BLOCK, end)
+            if i < normal:
+                stop = min(stop, normal)
+                mask = self.mask_small
+            else:
+                mask = self.mask_large
+            hits = numpy.flatnonzero((gear_hashes(array, i, stop) & numpy.uint64(mask)) == 0)
+            if hits.size:
+                return i + int(hits[0]) + 1
+            i = stop
+        return end
+
+    def find_cut_python(self, data, start: int, end: int, normal: int) -> Optional[int]:
+        # Rolls the hash from zero at start, None if there's no cut before end
+        gear = GEAR
+        h = 0
+        i = start
+        mask = self.mask_small
+        while i < normal and i < end:
+            h = ((h << 1) + gear[data[i]]) & HASH_MASK
+            if not h & mask:
+                return i + 1
+            i += 1
+        mask = self.mask_large
+        while i < end:
+            h = ((h << 1) + gear[data[i]]) & HASH_MASK
+            if not h & mask:
+                return i + 1
+            i += 1
+        return None
+
+    def chunks(self, data) -> Iterator[memoryview]:
+        # Split a bytes-like object into chunks, without copying it
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            cut = self.find_cut(view[offset:])
+            yield view[offset:offset + cut]
+            offset += cut
+
+    def chunks_from_file(self, file: BinaryIO, read_size: int = 16 * 1024 * 1024) -> Iterator[bytes]:
+        # Split a file into chunks while only holding a few chunks in memory
+        buffer = bytearray()
+        eof = False
+        while buffer or not eof:
+            while not eof and len(buffer) < self.max_size:
+                block = file.read(max(read_size, self.max_size))
+                if not block:
+                    eof = True
+                buffer.extend(block)
+            if not buffer:
+                break
+            with memoryview(buffer) as view:
+                cut = self.find_cut(view)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+
+def gear_hashes(array, start, stop):
+    # The gear hash at each position in [start, stop), over the WINDOW bytes ending
+    # there. Needs start >= WINDOW - 1. Sums of 1, 2, 4 ... 64 bytes are built by
+    # doubling, each step adding the previous sums shifted by their length.
+    # uint64 arithmetic wraps, the same as masking with HASH_MASK
+    hashes = GEAR_ARRAY[array[start - WINDOW + 1:stop]]
+    span = 1
+    while span < WINDOW:
+        hashes[span:] += hashes[:-span] << numpy.uint64(span)
+        span *= 2
+    return hashes[WINDOW - 1:]
@@ -0,0 +1,108 @@
+# Binary format for control messages sent over gossip.
+# A frame carries any number of messages, so everything queued in one tick goes
+# out as a single broadcast:
+#   frame:   magic b"RC", format version (u8), message count (u16)
+#   message: message type (u8), payload length (u32), payload
+# Receivers skip message types they don't know, so new types can be added
+# without bumping the version. Changing an existing layout needs a new version.
+import base64
+import struct
+from dataclasses import dataclass
+from typing import List
+
+MAGIC = b"RC"
+VERSION = 1
+
+FRAME_HEADER = struct.Struct("<2sBH")
+MESSAGE_HEADER = struct.Struct("<BI")
+MAX_MESSAGES = 0xFFFF
+
+MSG_JOIN_OFFER = 1
+
+# Tickets and node IDs are base32 text, and are sent as the bytes they encode.
+# Each string is tagged with how it was packed.
+STRING_RAW = 0
+STRING_BASE32 = 1
+TICKET_PREFIXES = {2: "doc", 3: "blob", 4: "node"}
+
+@dataclass(frozen=True)
+class JoinOffer:
+    # A node inviting its peers to sync its ticket document
+    node_id: str
+    ticket: str
+
+def _to_base32(data: bytes) -> str:
+    return base64.b32encode(data).decode().lower().rstrip("=")
+
+def _from_base32(text: str) -> bytes:
+    padding = "=" * ((8 - len(text) % 8) % 8)
+    return base64.b32decode(text.upper() + padding)
+
+def pack_string(text: str) -> bytes:
+    tag, body = STRING_RAW, text
+    for prefix_tag, prefix in TICKET_PREFIXES.items():
+        if text.startswith(prefix):
+            tag, body = prefix_tag, text[len(prefix):]
+            break
+    else:
+        tag = STRING_BASE32
+    try:
+        data = _from_base32(body)
+        # Only pack strings that come back exactly as they were
+        if _to_base32(data) != body:
+            raise ValueError("Not canonical base32")
+    except ValueError:
+        tag, data = STRING_RAW, text.encode("utf-8")
+    return struct.pack("<BI", tag, len(data)) + data
+
+def unpack_string(buffer, offset: int):
+    tag, length = struct.unpack_from("<BI", buffer, offset)
+    offset += 5
+    data = bytes(buffer[offset:offset + length])
+    if len(data) != length:
+        raise ValueError("Truncated string")
+    offset += length
+    if tag == STRING_RAW:
+        return data.decode("utf-8"), offset
+    if tag == STRING_BASE32:
+        return _to_base32(data), offset
+    if tag in TICKET_PREFIXES:
+        return TICKET_PREFIXES[tag] + _to_base32(data), offset
+    raise ValueError("Unknown string tag: {}".format(tag))
+
+def encode_message(message) -> bytes:
+    if isinstance(message, JoinOffer):
+        payload = pack_string(message.node_id) + pack_string(message.ticket)
+        return MESSAGE_HEADER.pack(MSG_JOIN_OFFER, len(payload)) + payload
+    raise TypeError("Can't encode control message: {!r}".format(message))
+
+def encode_frame(messages) -> bytes:
+    messages = list(messages)
+    if len(messages) > MAX_MESSAGES:
+        raise ValueError("Too many messages for one frame: {}".format(len(messages)))
+    return FRAME_HEADER.pack(MAGIC, VERSION, len(messages)) + b"".join(encode_message(message) for message in messages)
+
+def decode_frame(data) -> List[object]:
+    buffer = memoryview(data)
+    if len(buffer) < FRAME_HEADER.size:
+        raise ValueError("Frame too short")
+    magic, version, count = FRAME_HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a control frame")
+    if version != VERSION:
+        raise ValueError("Unsupported control frame version: {}".format(version))
+    offset = FRAME_HEADER.size
+    messages = []
+    for _ in range(count):
+        message_type, length = MESSAGE_HEADER.unpack_from(buffer, offset)
+        offset += MESSAGE_HEADER.size
+        end = offset + length
+        if end > len(buffer):
+            raise ValueError("Truncated control message")
+        if message_type == MSG_JOIN_OFFER:
+            node_id, position = unpack_string(buffer, offset)
+            ticket, position = unpack_string(buffer, position)
+            messages.append(JoinOffer(node_id, ticket))
+        # Anything else is from a newer node, skip it
+        offset = end
+    return messages
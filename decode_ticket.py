@@ -1,8 +1,13 @@
 # Based on JavaScript from https://ticket.iroh.computer/
-import base64
+# Encodes and decodes iroh node, blob and doc tickets.
+# Decoded tickets are cached by their string and shared between callers,
+# so treat them as read-only.
+import re
+import struct
+from collections import OrderedDict
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional
+from typing import Iterable, Optional, Tuple, Union
 
 class TicketType(Enum):
     NODE = "node"
@@ -17,34 +22,81 @@ class Capability(Enum):
     READ = "Read"
     WRITE = "Write"
 
-@dataclass
+@dataclass(frozen=True)
 class AddrInfo:
     derp_url: Optional[str]
-    direct_addresses: List[str]
+    direct_addresses: Tuple[str, ...]
 
-@dataclass
+@dataclass(frozen=True)
 class NodeAddr:
     node_id: str
     info: AddrInfo
 
-@dataclass
+@dataclass(frozen=True)
 class NodeTicket:
     type: TicketType
     node: NodeAddr
 
-@dataclass
+@dataclass(frozen=True)
 class BlobTicket:
     type: TicketType
     node: NodeAddr
     format: BlobFormat
     hash: str
 
-@dataclass
+@dataclass(frozen=True)
 class DocTicket:
     type: TicketType
     capability: Capability
     namespace: str
-    nodes: List[NodeAddr]
+    nodes: Tuple[NodeAddr, ...]
+
+# Wire values, as postcard enum variants
+CAPABILITY_VALUES = {Capability.WRITE: 0, Capability.READ: 1}
+CAPABILITIES = {value: capability for capability, value in CAPABILITY_VALUES.items()}
+BLOB_FORMAT_VALUES = {BlobFormat.RAW: 0, BlobFormat.HASH_SEQ: 1}
+BLOB_FORMATS = {value: blob_format for blob_format, value in BLOB_FORMAT_VALUES.items()}
+
+NODE_ID_LENGTH = 32
+HASH_LENGTH = 32
+SECRET_KEY_LENGTH = 33
+
+IPV6 = struct.Struct(">8H")
+
+BASE32_ALPHABET = "abcdefghijklmnopqrstuvwxyz234567"
+# Every pair of base32 characters, indexed by the 10 bits they encode
+BASE32_PAIRS = [a + b for a in BASE32_ALPHABET for b in BASE32_ALPHABET]
+
+def encode_base32(data) -> str:
+    # Lower case and unpadded, 5 bytes (8 characters) at a time
+    length = len(data)
+    whole = length - length % 5
+    parts = []
+    for i in range(0, whole, 5):
+        bits = int.from_bytes(data[i:i + 5], "big")
+        parts.append(BASE32_PAIRS[bits >> 30] + BASE32_PAIRS[(bits >> 20) & 0x3FF]
+                     + BASE32_PAIRS[(bits >> 10) & 0x3FF] + BASE32_PAIRS[bits & 0x3FF])
+    if whole < length:
+        bits = int.from_bytes(bytes(data[whole:]).ljust(5, b"\0"), "big")
+        tail = (BASE32_PAIRS[bits >> 30] + BASE32_PAIRS[(bits >> 20) & 0x3FF]
+                + BASE32_PAIRS[(bits >> 10) & 0x3FF] + BASE32_PAIRS[bits & 0x3FF])
+        parts.append(tail[:((length - whole) * 8 + 4) // 5])
+    return "".join(parts)
+
+# base64.b32decode walks the string in Python. Mapping the RFC 4648 alphabet onto
+# the digits int() uses for base 32 lets int() do the decoding instead
+BASE32_DIGITS = str.maketrans(BASE32_ALPHABET, "0123456789abcdefghijklmnopqrstuv")
+BASE32_TEXT = re.compile("[a-z2-7]*")
+
+def decode_base32(text: str) -> bytes:
+    text = text.lower()
+    if not BASE32_TEXT.fullmatch(text) or len(text) % 8 in (1, 3, 6):
+        raise ValueError("Invalid base32")
+    if not text:
+        return b""
+    length = len(text) * 5 // 8
+    # The last character can carry a few bits past the end of the data
+    return (int(text.translate(BASE32_DIGITS), 32) >> (len(text) * 5 - length * 8)).to_bytes(length, "big")
 
 class TicketDecoder:
     def __init__(self, ticket_string: str):
@@ -61,11 +113,8 @@ class TicketDecoder:
         else:
             raise ValueError("Unknown ticket type")
 
-        # Add padding if necessary
-        padding = '=' * ((8 - len(ticket_string) % 8) % 8)
-        padded_ticket = ticket_string.upper() + padding
-        
-        self.buffer = base64.b32decode(padded_ticket)
+        # Fields are read straight out of the decoded bytes, without copying them out first
+        self.buffer = memoryview(decode_base32(ticket_string))
 
     def decode(self):
         if self.type == TicketType.NODE:
@@ -97,14 +146,10 @@ class TicketDecoder:
         if self.read_u8() != 0:
             raise ValueError("Expected variant 0")
         capability = self.read_capability()
-        namespace = ""
         if capability == Capability.READ:
             namespace = self.read_hash()
-        elif capability == Capability.WRITE:
-            namespace = self.read_secret_key()
         else:
-            raise ValueError(f"Unknown capability: {capability}")
-        
+            namespace = self.read_secret_key()
         return DocTicket(
             type=TicketType.DOC,
             capability=capability,
@@ -114,25 +159,21 @@ class TicketDecoder:
 
     def read_capability(self) -> Capability:
         value = self.read_varint()
-        if value == 0:
-            return Capability.WRITE
-        elif value == 1:
-            return Capability.READ
-        else:
+        capability = CAPABILITIES.get(value)
+        if capability is None:
             raise ValueError(f"Unknown capability: {value}")
+        return capability
 
     def read_blob_format(self) -> BlobFormat:
         value = self.read_varint()
-        if value == 0:
-            return BlobFormat.RAW
-        elif value == 1:
-            return BlobFormat.HASH_SEQ
-        else:
+        blob_format = BLOB_FORMATS.get(value)
+        if blob_format is None:
             raise ValueError(f"Unknown blob format: {value}")
+        return blob_format
 
-    def read_node_addrs(self) -> List[NodeAddr]:
+    def read_node_addrs(self) -> Tuple[NodeAddr, ...]:
         count = self.read_varint()
-        return [self.read_node_addr() for _ in range(count)]
+        return tuple(self.read_node_addr() for _ in range(count))
 
     def read_node_addr(self) -> NodeAddr:
         node_id = self.read_node_id()
@@ -140,9 +181,7 @@ class TicketDecoder:
         return NodeAddr(node_id=node_id, info=info)
 
     def read_node_id(self) -> str:
-        node_id = self.buffer[self.offset:self.offset + 32]
-        self.offset += 32
-        return base64.b32encode(node_id).decode().lower().rstrip('=')
+        return encode_base32(self.read_bytes(NODE_ID_LENGTH))
 
     def read_addr_info(self) -> AddrInfo:
         derp_url = None
@@ -153,9 +192,9 @@ class TicketDecoder:
             direct_addresses=self.read_addresses()
         )
 
-    def read_addresses(self) -> List[str]:
+    def read_addresses(self) -> Tuple[str, ...]:
         count = self.read_varint()
-        return [self.read_socket_addr() for _ in range(count)]
+        return tuple(self.read_socket_addr() for _ in range(count))
 
     def read_socket_addr(self) -> str:
         version = self.read_varint()
@@ -167,59 +206,190 @@ class TicketDecoder:
             raise ValueError(f"Unknown IP version: {version}")
 
     def read_ipv4(self) -> str:
-        ip = '.'.join(str(self.buffer[self.offset + i]) for i in range(4))
-        self.offset += 4
+        ip = "{}.{}.{}.{}".format(*self.read_bytes(4))
         port = self.read_varint()
         return f"{ip}:{port}"
 
     def read_ipv6(self) -> str:
-        ip = ':'.join(f"{self.buffer[self.offset + i*2]:02x}{self.buffer[self.offset + i*2 + 1]:02x}" for i in range(8))
-        self.offset += 16
+        ip = ':'.join(f"{group:04x}" for group in IPV6.unpack(self.read_bytes(16)))
         port = self.read_varint()
         return f"[{ip}]:{port}"
 
     def read_secret_key(self) -> str:
-        key = self.buffer[self.offset:self.offset + 33]
-        self.offset += 33
-        return base64.b32encode(key).decode().lower().rstrip('=')
+        return encode_base32(self.read_bytes(SECRET_KEY_LENGTH))
 
     def read_hash(self) -> str:
-        hash_value = self.buffer[self.offset:self.offset + 32]
-        self.offset += 32
-        return base64.b32encode(hash_value).decode().lower().rstrip('=')
+        return encode_base32(self.read_bytes(HASH_LENGTH))
 
     def read_option(self) -> bool:
         return self.read_u8() == 1
 
     def read_string(self) -> str:
         length = self.read_varint()
-        string = self.buffer[self.offset:self.offset + length].decode('utf-8')
-        self.offset += length
-        return string
+        return str(self.read_bytes(length), 'utf-8')
+
+    def read_bytes(self, length) -> memoryview:
+        # A view into the buffer, not a copy
+        end = self.offset + length
+        if end > len(self.buffer):
+            raise ValueError("Ticket is truncated")
+        view = self.buffer[self.offset:end]
+        self.offset = end
+        return view
 
     def read_u32(self) -> int:
         return self.read_varint()
 
     def read_u8(self) -> int:
-        value = self.buffer[self.offset]
+        try:
+            value = self.buffer[self.offset]
+        except IndexError:
+            raise ValueError("Ticket is truncated") from None
         self.offset += 1
         return value
 
     def read_varint(self) -> int:
-        value = 0
-        shift = 0
+        byte = self.read_u8()
+        # Almost every varint in a ticket fits in one byte
+        if byte < 0x80:
+            return byte
+        value = byte & 0x7F
+        shift = 7
         while True:
-            byte = self.buffer[self.offset]
-            self.offset += 1
+            byte = self.read_u8()
             value |= (byte & 0x7F) << shift
             if (byte & 0x80) == 0:
-                break
+                return value
             shift += 7
-        return value
 
-def decode_iroh_ticket(ticket_string: str):
-    decoder = TicketDecoder(ticket_string)
-    return decoder.decode()
+class TicketEncoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def encode(self, ticket) -> str:
+        if isinstance(ticket, NodeTicket):
+            self.write_node_ticket(ticket)
+            prefix = "node"
+        elif isinstance(ticket, BlobTicket):
+            self.write_blob_ticket(ticket)
+            prefix = "blob"
+        elif isinstance(ticket, DocTicket):
+            self.write_document_ticket(ticket)
+            prefix = "doc"
+        else:
+            raise TypeError(f"Not a ticket: {ticket!r}")
+        return prefix + encode_base32(self.buffer)
+
+    def write_node_ticket(self, ticket: NodeTicket):
+        self.write_u8(0)
+        self.write_node_addr(ticket.node)
+
+    def write_blob_ticket(self, ticket: BlobTicket):
+        self.write_u8(0)
+        self.write_node_addr(ticket.node)
+        self.write_varint(BLOB_FORMAT_VALUES[ticket.format])
+        self.write_fixed(ticket.hash, HASH_LENGTH)
+
+    def write_document_ticket(self, ticket: DocTicket):
+        self.write_u8(0)
+        self.write_varint(CAPABILITY_VALUES[ticket.capability])
+        if ticket.capability == Capability.READ:
+            self.write_fixed(ticket.namespace, HASH_LENGTH)
+        else:
+            self.write_fixed(ticket.namespace, SECRET_KEY_LENGTH)
+        self.write_varint(len(ticket.nodes))
+        for node_addr in ticket.nodes:
+            self.write_node_addr(node_addr)
+
+    def write_node_addr(self, node_addr: NodeAddr):
+        self.write_fixed(node_addr.node_id, NODE_ID_LENGTH)
+        if node_addr.info.derp_url is None:
+            self.write_u8(0)
+        else:
+            self.write_u8(1)
+            self.write_string(node_addr.info.derp_url)
+        self.write_varint(len(node_addr.info.direct_addresses))
+        for address in node_addr.info.direct_addresses:
+            self.write_socket_addr(address)
+
+    def write_socket_addr(self, address: str):
+        host, _, port = address.rpartition(":")
+        if host.startswith("["):
+            groups = host[1:-1].split(":")
+            if "" in groups:
+                # Expand a "::" abbreviation
+                gap = groups.index("")
+                groups = [group for group in groups if group]
+                groups[gap:gap] = ["0"] * (8 - len(groups))
+            self.write_varint(1)
+            self.buffer += IPV6.pack(*(int(group, 16) for group in groups))
+        else:
+            self.write_varint(0)
+            self.buffer += bytes(int(part) for part in host.split("."))
+        self.write_varint(int(port))
+
+    def write_fixed(self, text: str, length: int):
+        data = decode_base32(text)
+        if len(data) != length:
+            raise ValueError(f"Expected {length} bytes, got {len(data)}")
+        self.buffer += data
+
+    def write_string(self, text: str):
+        data = text.encode('utf-8')
+        self.write_varint(len(data))
+        self.buffer += data
+
+    def write_u8(self, value: int):
+        self.buffer.append(value)
+
+    def write_varint(self, value: int):
+        while value >= 0x80:
+            self.buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        self.buffer.append(value)
+
+Ticket = Union[NodeTicket, BlobTicket, DocTicket]
+
+def encode_iroh_ticket(ticket: Ticket) -> str:
+    # The ticket string for any kind of ticket, the inverse of decode_iroh_ticket
+    return TicketEncoder().encode(ticket)
+
+# Decoded tickets, most recently used last
+DECODE_CACHE_SIZE = 4096
+decode_cache = OrderedDict()
+cache_hits = 0
+cache_misses = 0
+
+def decode_iroh_ticket(ticket_string: str) -> Ticket:
+    global cache_hits, cache_misses
+    ticket = decode_cache.get(ticket_string)
+    if ticket is not None:
+        decode_cache.move_to_end(ticket_string)
+        cache_hits += 1
+        return ticket
+    cache_misses += 1
+    ticket = TicketDecoder(ticket_string).decode()
+    decode_cache[ticket_string] = ticket
+    if len(decode_cache) > DECODE_CACHE_SIZE:
+        decode_cache.popitem(last=False)
+    return ticket
+
+def decode_iroh_tickets(ticket_strings: Iterable[str]) -> list:
+    # Decode many tickets at once, in order. Repeats are only decoded once
+    decoded = {}
+    tickets = []
+    for ticket_string in ticket_strings:
+        ticket = decoded.get(ticket_string)
+        if ticket is None:
+            ticket = decoded[ticket_string] = decode_iroh_ticket(ticket_string)
+        tickets.append(ticket)
+    return tickets
+
+def clear_decode_cache():
+    global cache_hits, cache_misses
+    decode_cache.clear()
+    cache_hits = 0
+    cache_misses = 0
 
 #Example usage
 # ticket = "not-a-real-ticket"
@@ -230,4 +400,7 @@ def decode_iroh_ticket(ticket_string: str):
 # if isinstance(decoded_ticket, DocTicket) and decoded_ticket.nodes:
 #     node = decoded_ticket.nodes[0]
 #     print(f"Node ID: {node.node_id}")
-#     print(f"Relay URL: {node.info.derp_url}")
\ No newline at end of file
+#     print(f"Relay URL: {node.info.derp_url}")
+#
+# # And back again
+# print(encode_iroh_ticket(decoded_ticket))
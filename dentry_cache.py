@@ -0,0 +1,88 @@
+# (parent inode, name) -> child inode, for names lookup has already resolved.
+# Names that weren't there are cached too, as NEGATIVE, so probes for files that
+# don't exist are answered without touching the directory index or iroh.
+# Each parent's children document is watched while the cache holds entries for
+# that parent, and any insert for a name (a new entry or a deletion) drops what
+# we had for it.
+from collections import OrderedDict
+
+import recurso
+
+NEGATIVE = 0
+
+class DentryCache:
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Parent inode -> how many entries we hold for it
+        self.parent_entries = {}
+        # Children document ID <-> parent inode, for the parents being watched
+        self.children_docs = {}
+        self.parent_docs = {}
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def get(self, parent_inode, name):
+        # The child inode, NEGATIVE if the name is known not to exist, or None if we don't know
+        key = (parent_inode, name)
+        inode = self.entries.get(key)
+        if inode is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if inode == NEGATIVE:
+            self.negative_hits += 1
+        return inode
+
+    async def put(self, parent_inode, name, inode, children_doc_id):
+        key = (parent_inode, name)
+        if key not in self.entries:
+            self.parent_entries[parent_inode] = self.parent_entries.get(parent_inode, 0) + 1
+        self.entries[key] = inode
+        self.entries.move_to_end(key)
+        # Drop the least recently used entries once we're over the limit
+        while len(self.entries) > self.max_entries:
+            oldest, _ = self.entries.popitem(last=False)
+            self.forget(oldest[0])
+        if parent_inode not in self.parent_docs:
+            self.children_docs[children_doc_id] = parent_inode
+            self.parent_docs[parent_inode] = children_doc_id
+            # The directory index already listens to this document, so nothing
+            # can arrive between the entry going in and us listening
+            await recurso.watch_document_changes(children_doc_id, self.apply_change)
+
+    def invalidate(self, parent_inode, name):
+        if self.entries.pop((parent_inode, name), None) is not None:
+            self.forget(parent_inode)
+
+    def clear(self):
+        for parent_inode in list(self.parent_docs):
+            self.unwatch(parent_inode)
+        self.entries.clear()
+        self.parent_entries.clear()
+
+    def forget(self, parent_inode):
+        # An entry for parent_inode has gone, stop watching it once there are none left
+        count = self.parent_entries.get(parent_inode, 0) - 1
+        if count > 0:
+            self.parent_entries[parent_inode] = count
+            return
+        self.parent_entries.pop(parent_inode, None)
+        self.unwatch(parent_inode)
+
+    def unwatch(self, parent_inode):
+        children_doc_id = self.parent_docs.pop(parent_inode, None)
+        if children_doc_id is not None:
+            self.children_docs.pop(children_doc_id, None)
+            recurso.unwatch_document_changes(children_doc_id, self.apply_change)
+
+    async def apply_change(self, doc_id, entry):
+        # Listener for a parent's children document
+        parent_inode = self.children_docs.get(doc_id)
+        if parent_inode is None:
+            return
+        inode_type, name = await recurso.decode_filename(entry.key().decode("utf-8"))
+        if inode_type is not None:
+            self.invalidate(parent_inode, name)
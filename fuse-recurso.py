@@ -2,7 +2,10 @@ import pyfuse3
 import pyfuse3_asyncio
 import os
 import sys
+import time
+import json
 import asyncio
+from collections import OrderedDict
 
 from argparse import ArgumentParser
 import stat
@@ -10,6 +13,10 @@ import logging
 import errno
 # Import the Recurso node
 import recurso
+import instrumentation
+import inode_table
+import dentry_cache
+import readahead
 
 try:
     import faulthandler
@@ -20,6 +27,134 @@ else:
 
 log = logging.getLogger(__name__)
 
+ROOT_INODE_KEY = "01101100011011110111011001100101"
+
+# The read-only .recurso/stats file lives outside the documents, on inodes that
+# real files never get (theirs are random 64-bit numbers)
+STATS_DIR_NAME = ".recurso"
+STATS_FILE_NAME = "stats"
+STATS_DIR_INODE = pyfuse3.ROOT_INODE + 1
+STATS_FILE_INODE = pyfuse3.ROOT_INODE + 2
+
+# Ready-built EntryAttributes keyed by inode, each valid for ttl seconds.
+# iroh can't end a subscription, so we never subscribe to a document just for this
+# cache. Entries are dropped early on events from documents with a subscription of
+# their own: a directory's children document (its size is the child count) and the
+# inode map. Changes to metadata made on other nodes show up once the entry expires
+class AttrCache:
+    def __init__(self, ttl=1.0, max_entries=65536):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Which inodes were built from which documents, so events can find them
+        self.doc_inodes = {}
+        self.inode_docs = {}
+        # Documents we have a listener on. A listener is only kept while some entry
+        # was built from the document, so this is bounded by max_entries too
+        self.watched_docs = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, inode):
+        cached = self.entries.get(inode)
+        if cached is None:
+            self.misses += 1
+            return None
+        expires, attributes = cached
+        if expires < time.monotonic():
+            self.invalidate(inode)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(inode)
+        self.hits += 1
+        return attributes
+
+    def put(self, inode, attributes, doc_ids, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        self.invalidate(inode)
+        self.entries[inode] = (time.monotonic() + ttl, attributes)
+        self.inode_docs[inode] = doc_ids
+        for doc_id in doc_ids:
+            self.doc_inodes.setdefault(doc_id, set()).add(inode)
+        # Drop the least recently used entries once we're over the limit
+        while len(self.entries) > self.max_entries:
+            oldest, _ = self.entries.popitem(last=False)
+            self._forget_docs(oldest)
+
+    def invalidate(self, inode):
+        if self.entries.pop(inode, None) is not None:
+            self._forget_docs(inode)
+
+    def invalidate_doc(self, doc_id, entry=None):
+        for inode in list(self.doc_inodes.get(doc_id, ())):
+            self.invalidate(inode)
+
+    def _forget_docs(self, inode):
+        for doc_id in self.inode_docs.pop(inode, ()):
+            inodes = self.doc_inodes.get(doc_id)
+            if inodes is not None:
+                inodes.discard(inode)
+                if not inodes:
+                    del self.doc_inodes[doc_id]
+                    self.unwatch(doc_id)
+
+    async def watch(self, doc_ids):
+        # Drop cached attributes whenever a document they came from gets an insert.
+        # Only pass documents that are subscribed to anyway, see above
+        for doc_id in doc_ids:
+            # Entries may have been evicted while we were subscribing to an earlier document
+            if doc_id in self.watched_docs or doc_id not in self.doc_inodes:
+                continue
+            self.watched_docs.add(doc_id)
+            await recurso.watch_document_changes(doc_id, self.invalidate_doc)
+
+    def unwatch(self, doc_id):
+        if doc_id in self.watched_docs:
+            self.watched_docs.discard(doc_id)
+            recurso.unwatch_document_changes(doc_id, self.invalidate_doc)
+
+    def inode_map_changed(self, doc_id, entry):
+        # Listener for the inode map, an inode pointing somewhere new has new attributes
+        if entry.key() == ROOT_INODE_KEY.encode():
+            self.invalidate(pyfuse3.ROOT_INODE)
+            return
+        inode = inode_table.inode_from_key(entry.key())
+        if inode is not None:
+            self.invalidate(inode)
+
+# State for an open file, resolved once in open() and shared by every handle to that inode
+class OpenFile:
+    __slots__ = ("inode", "doc_id", "reader", "refcount", "write_buffer", "lock")
+
+    def __init__(self, inode, doc_id, reader):
+        self.inode = inode
+        self.doc_id = doc_id
+        self.reader = reader
+        self.refcount = 0
+        # Pending writes, created on the first write and committed on flush/release
+        self.write_buffer = None
+        self.lock = asyncio.Lock()
+
+# Serves a snapshot of the stats taken when the file was opened
+class StatsReader:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    async def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+def copy_attributes(entry):
+    # EntryAttributes can't be copied directly, so copy the fields we set
+    copy = pyfuse3.EntryAttributes()
+    for field in ("st_ino", "st_mode", "st_size", "st_uid", "st_gid",
+                  "st_atime_ns", "st_ctime_ns", "st_mtime_ns"):
+        setattr(copy, field, getattr(entry, field))
+    return copy
+
 class RecursoFs(pyfuse3.Operations):
     def __init__(self):
         # Inititialise the Recurso file system
@@ -29,15 +164,49 @@ class RecursoFs(pyfuse3.Operations):
         self.hello_data = b"hello recurso\n"
         self.recurso = None
         self.ticket = None
+        self.doc_cache_size = 1024
+        self.attr_cache = AttrCache()
+        # Open files: handle -> OpenFile, and inode -> the OpenFile its handles share
+        self.file_handles = {}
+        self.open_inodes = {}
+        self.next_fh = 1
+        # Handle -> Readahead, since access patterns belong to a handle rather than the file
+        self.readaheads = {}
+        # Largest readahead window in bytes, 0 turns readahead off
+        self.readahead_max = readahead.MAX_WINDOW
+        # How many children readdir resolves attributes for at once
+        self.readdir_concurrency = 32
+        # Directory inode -> name index of its children, for lookup
+        self.directory_indexes = {}
+        self.dentry_cache = dentry_cache.DentryCache()
+        self.root_inode = None
+        # Writes are buffered in memory up to this many bytes, then spill to a temp file
+        self.write_spill_threshold = 64 * 1024 * 1024
+        self.write_spill_dir = None
+        # Files at least this big are stored as content-defined chunks, None stores every file as one blob
+        self.chunk_threshold = None
+        # Persistent mode: where the node lives, and how long restored attributes are trusted for
+        self.data_dir = None
+        self.snapshot_ttl = 60.0
+        # Document joins and blob downloads from other nodes to run at once
+        self.sync_concurrency = 32
+        # Bytes of blobs fetched from other nodes to keep, 0 keeps them all
+        self.blob_cache_size = 0
+        # Inode -> document ID, mirrored from the inode map
+        self.inode_table = inode_table.InodeTable()
+        instrumentation.register_cache("attributes", lambda: (self.attr_cache.hits, self.attr_cache.misses))
+        instrumentation.register_cache("dentries", lambda: (self.dentry_cache.hits, self.dentry_cache.misses))
+        instrumentation.register_cache("readahead", lambda: (readahead.hits, readahead.misses))
+        instrumentation.register_cache("inodes", lambda: (self.inode_table.hits, self.inode_table.misses))
 
     async def load_recurso(self, ticket=None):
         global recurso
 
         # Start the Recurso node
-        self.recurso = await recurso.setup_iroh_node(debug=debug_mode)
+        self.recurso = await recurso.setup_iroh_node(debug=debug_mode, doc_cache_size=self.doc_cache_size, data_dir=self.data_dir, sync_concurrency=self.sync_concurrency, blob_cache_size=self.blob_cache_size)
         
         # Create a root document
-        self.root_doc_id, self.root_directory_doc_id, self.inode_map_doc_id = await recurso.create_root_document(ticket)
+        self.root_doc_id, self.root_directory_doc_id, self.inode_map_doc_id, self.ticket_doc_id = await recurso.create_root_document(ticket)
         # Load our root document
         root_doc = await recurso.node.docs().open(self.root_doc_id)
         # Create a ticket to join the root document
@@ -45,108 +214,309 @@ class RecursoFs(pyfuse3.Operations):
         print("To join another node, use this ticket: {}".format(ticket))
         print("You can use the command: `python3 fuse-recurso.py /mnt/test --ticket {}".format(ticket) + "`")
 
+        await recurso.watch_document_changes(self.inode_map_doc_id, self.attr_cache.inode_map_changed)
+
+        # Load the inode table. A saved one can serve lookups straight away while we rescan
+        saved_table = None
+        if self.data_dir is not None and os.path.exists(self.inode_table_path()):
+            saved_table = inode_table.InodeTable.load(self.inode_table_path())
+        if saved_table is not None:
+            self.inode_table = saved_table
+            asyncio.create_task(recurso.load_inode_table(self.inode_map_doc_id, self.inode_table))
+        else:
+            with recurso.startup_timer.phase("inodes"):
+                await recurso.load_inode_table(self.inode_map_doc_id, self.inode_table)
+
+        # Upgrade any v0 metadata documents in the background
+        asyncio.create_task(recurso.migrate_metadata_documents(self.inode_map_doc_id))
+
         return self.root_doc_id, self.inode_map_doc_id
 
+    async def get_inode_doc_id(self, inode):
+        # FileDoc or DirectoryDoc ID for an inode, from the inode table if it has it
+        inode = int(inode)
+        doc_id = self.inode_table.get(inode)
+        if doc_id is None:
+            # Not seen the inode map event yet, ask the document itself
+            doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(inode))
+            if doc_id is not None:
+                self.inode_table.set(inode, doc_id)
+        return doc_id
+
+    def inode_table_path(self):
+        return os.path.join(self.data_dir, "inode-table.bin")
+
+    def snapshot_path(self):
+        return os.path.join(self.data_dir, "fuse-snapshot.json")
+
+    def save_snapshot(self):
+        # Write the attribute cache and directory indexes to the data dir, so a
+        # restarted node can answer getattr and lookup before re-reading anything
+        if self.data_dir is None:
+            return
+        self.inode_table.save(self.inode_table_path())
+        attrs = []
+        for inode, (_, entry) in self.attr_cache.entries.items():
+            attrs.append([inode, entry.st_mode, entry.st_size, entry.st_uid, entry.st_gid,
+                          entry.st_atime_ns, entry.st_mtime_ns, entry.st_ctime_ns,
+                          list(self.attr_cache.inode_docs.get(inode, ()))])
+        directories = {}
+        for inode, directory_index in self.directory_indexes.items():
+            directories[str(inode)] = {
+                "children_doc_id": directory_index.children_doc_id,
+                "entries": {name: [dirent.type, dirent.doc_id, dirent.inode]
+                            for name, dirent in directory_index.entries.items()},
+            }
+        snapshot = {
+            # Version 1 listed metadata documents among each entry's sources
+            "version": 2,
+            "root_doc_id": self.root_doc_id,
+            "root_inode": self.root_inode,
+            "attrs": attrs,
+            "directories": directories,
+        }
+        # Write then rename, so a crash never leaves a half-written snapshot
+        tmp_path = self.snapshot_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path())
+
+    def load_snapshot(self):
+        if self.data_dir is None or not os.path.exists(self.snapshot_path()):
+            return
+        try:
+            with open(self.snapshot_path()) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Could not load snapshot: {}".format(e))
+            return
+        if snapshot.get("version") != 2 or snapshot.get("root_doc_id") != self.root_doc_id:
+            print("Snapshot is from an older version or a different root document, ignoring it")
+            return
+
+        self.root_inode = snapshot["root_inode"]
+        for inode, st_mode, st_size, st_uid, st_gid, st_atime_ns, st_mtime_ns, st_ctime_ns, doc_ids in snapshot["attrs"]:
+            entry = pyfuse3.EntryAttributes()
+            entry.st_ino = inode
+            entry.st_mode = st_mode
+            entry.st_size = st_size
+            entry.st_uid = st_uid
+            entry.st_gid = st_gid
+            entry.st_atime_ns = st_atime_ns
+            entry.st_mtime_ns = st_mtime_ns
+            entry.st_ctime_ns = st_ctime_ns
+            # Trusted for longer than normal entries. Directory sizes are still invalidated by
+            # events, other changes made while we were down show up once these expire
+            self.attr_cache.put(inode, entry, doc_ids, ttl=max(self.snapshot_ttl, self.attr_cache.ttl))
+        for inode, directory in snapshot["directories"].items():
+            directory_index = recurso.DirectoryIndex(directory["children_doc_id"])
+            for name, (inode_type, doc_id, child_inode) in directory["entries"].items():
+                directory_index.entries[name] = recurso.DirEntry(inode_type, doc_id, child_inode)
+            self.directory_indexes[int(inode)] = directory_index
+        print("Restored {} attributes and {} directories from snapshot".format(len(snapshot["attrs"]), len(snapshot["directories"])))
+        asyncio.create_task(self.refresh_snapshot())
+
+    async def refresh_snapshot(self):
+        # Listen to the children documents the snapshot's directory sizes came from, and
+        # rebuild the directory indexes to pick up whatever changed while we were down
+        for inode, doc_ids in list(self.attr_cache.inode_docs.items()):
+            await self.attr_cache.watch(doc_ids)
+        for inode, restored_index in list(self.directory_indexes.items()):
+            try:
+                directory_index = await recurso.load_directory_index(restored_index.children_doc_id)
+            except Exception as e:
+                print("Could not refresh directory index for inode {}: {}".format(inode, e))
+                continue
+            # Keep the inode numbers we already know for entries that haven't moved
+            for name, dirent in directory_index.entries.items():
+                restored = restored_index.entries.get(name)
+                if restored is not None and restored.doc_id == dirent.doc_id:
+                    dirent.inode = restored.inode
+            self.directory_indexes[inode] = directory_index
+        # Names resolved against the restored indexes may be stale
+        self.dentry_cache.clear()
+
+    async def snapshot_loop(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                print("Could not save snapshot: {}".format(e))
+
+    @instrumentation.timed("getattr")
     async def getattr(self, inode, ctx=None):
         # Get attributes of given inode (file or directory)
+        if inode == STATS_DIR_INODE or inode == STATS_FILE_INODE:
+            return self.stats_attributes(inode)
+        if inode == pyfuse3.ROOT_INODE or inode == ROOT_INODE_KEY:
+            cache_key = pyfuse3.ROOT_INODE
+        else:
+            cache_key = int(inode)
+        cached = self.attr_cache.get(cache_key)
+        if cached is None:
+            cached = await self.resolve_attributes(inode, cache_key)
+        # Files with uncommitted writes are the size of their write buffer
+        open_file = self.open_inodes.get(cache_key)
+        if open_file is not None and open_file.write_buffer is not None and open_file.write_buffer.dirty:
+            entry = copy_attributes(cached)
+            entry.st_size = open_file.write_buffer.size
+            return entry
+        return cached
+
+    def stats_attributes(self, inode):
+        # Never cached, the stats file's size changes as the stats do
         entry = pyfuse3.EntryAttributes()
+        entry.st_ino = inode
+        if inode == STATS_DIR_INODE:
+            entry.st_mode = stat.S_IFDIR | 0o555
+            entry.st_size = 1
+        else:
+            entry.st_mode = stat.S_IFREG | 0o444
+            entry.st_size = len(instrumentation.render_text().encode("utf-8"))
+        now_ns = time.time_ns()
+        entry.st_atime_ns = now_ns
+        entry.st_ctime_ns = now_ns
+        entry.st_mtime_ns = now_ns
+        entry.st_uid = os.getuid()
+        entry.st_gid = os.getgid()
+        return entry
+
+    async def resolve_attributes(self, inode, cache_key):
         # Clear the inode doc ID just in case
         inode_doc_id = None
-        if inode == pyfuse3.ROOT_INODE or inode == "01101100011011110111011001100101":
-            inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str("01101100011011110111011001100101"))
-            if debug_mode:
-                print("Loaded root inode")
-                print("Root inode doc ID: {}".format(inode_doc_id))
+        if cache_key == pyfuse3.ROOT_INODE:
+            inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(ROOT_INODE_KEY))
+            log.debug("Root inode doc ID: %s", inode_doc_id)
         else:
             # Lookup the inode in the central inode map
-            inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(inode))
-        print("Getting attributes for inode: {}".format(inode))
+            inode_doc_id = await self.get_inode_doc_id(inode)
+        log.debug("Getting attributes for inode: %s", inode)
 
-        inode_type = await recurso.get_by_key(inode_doc_id, "type")
+        return await self.load_attributes(inode_doc_id, cache_key=cache_key)
 
-        if debug_mode:
-            print("Inode type: {}".format(inode_type))
+    async def load_attributes(self, inode_doc_id, inode_type=None, cache_key=None, watch=True):
+        # Build the attributes for a FileDoc or DirectoryDoc and put them in the attribute cache
+        # The cache key defaults to the inode number from the document's metadata.
+        # With watch off nothing new is subscribed to, and the entry only lasts its TTL
+        entry = pyfuse3.EntryAttributes()
+        if inode_type is None:
+            inode_type = await recurso.get_by_key(inode_doc_id, "type")
+
+        log.debug("Inode type: %s", inode_type)
 
         # Lookup the metadata for the inode
-        metadata = await recurso.find_and_fetch_metadata_for_doc_id(inode_doc_id)
+        metadata_doc_id = await recurso.get_by_key(inode_doc_id, "metadata")
+        metadata = await recurso.get_metadata(metadata_doc_id)
+        if cache_key is None:
+            cache_key = metadata.st_ino
+        # Documents whose events make these attributes stale. Not the metadata document,
+        # that would take a subscription per file which iroh can never drop
+        source_doc_ids = []
 
         # If the inode is a directory, update the size based on the number of children
         if inode_type == "directory":
             children_doc_id = await recurso.get_by_key(inode_doc_id, "children")
-            children_document = await recurso.get_document(children_doc_id)
-            children = await recurso.get_all_keys_by_prefix(children_document, "fs")
-            entry.st_size = len(children)
+            # Counting subscribes to the children document, so listening to it is free
+            entry.st_size = await recurso.get_child_count(children_doc_id, watch)
+            if watch:
+                source_doc_ids.append(children_doc_id)
         else:
-            entry.st_size = metadata["st_size"]
+            entry.st_size = metadata.st_size
 
-        if inode == pyfuse3.ROOT_INODE:
+        if cache_key == pyfuse3.ROOT_INODE:
             # Force root to always be 0o755 permissions
             entry.st_mode = (stat.S_IFDIR | 0o755)
         else:
-            entry.st_mode = metadata["st_mode"]
-        entry.st_atime_ns = recurso.convert_seconds_to_ns(metadata["st_atime"])
-        entry.st_ctime_ns = recurso.convert_seconds_to_ns(metadata["st_ctime"])
-        entry.st_mtime_ns = recurso.convert_seconds_to_ns(metadata["st_mtime"])
-        entry.st_gid = metadata["st_gid"]
-        entry.st_uid = metadata["st_uid"]
-        entry.st_ino = int(inode)
+            entry.st_mode = metadata.st_mode
+        entry.st_atime_ns = recurso.convert_seconds_to_ns(metadata.st_atime)
+        entry.st_ctime_ns = recurso.convert_seconds_to_ns(metadata.st_ctime)
+        entry.st_mtime_ns = recurso.convert_seconds_to_ns(metadata.st_mtime)
+        entry.st_gid = metadata.st_gid
+        entry.st_uid = metadata.st_uid
+        entry.st_ino = cache_key
+
+        self.attr_cache.put(cache_key, entry, source_doc_ids)
+        await self.attr_cache.watch(source_doc_ids)
         return entry
 
+    @instrumentation.timed("lookup")
     async def lookup(self, parent_inode, name, ctx=None):
-        print("Lookup called for: {}".format(name))
         # if parent_inode != pyfuse3.ROOT_INODE or name != self.hello_name:
         if parent_inode == pyfuse3.ROOT_INODE:
-            print("Parent inode is root")
-            # Find the base document for the root
-            root_document_inode = "01101100011011110111011001100101"
-            # Find the document ID for the root document
-            root_document_doc_id = await recurso.get_by_key(self.inode_map_doc_id, root_document_inode)
-            # Grab the metadata document for the root document
-            metadata_doc_id = await recurso.get_by_key(root_document_doc_id, "metadata")
-            # Grab the inode number from the metadata document
-            parent_inode = await recurso.get_by_key(metadata_doc_id, "st_ino")
-        print("Parent inode: {}".format(parent_inode))
-
-        # Look up the parent inode document in the inode map
-        parent_inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(parent_inode))
-        print("Parent inode doc ID: {}".format(parent_inode_doc_id))
-
-        # Load the children document from the parent inode
-        children_doc_id = await recurso.get_by_key(parent_inode_doc_id, "children")
-        print("Children doc ID: {}".format(children_doc_id))
+            parent_inode = await self.get_root_inode()
 
         # Convert name from bytes to a string
         name = name.decode("utf8")
     
-        print("Looking for lost child: {}".format(name))
+        log.debug("Looking up %s in parent inode %s", name, parent_inode)
 
-        # Lookup the key name in the children document
-        # Try it as a directory first
-        try:
-            child_doc_id = await recurso.get_by_key(children_doc_id, "fsdir-" + name + "...RECURSO.UNiQ.v0")
-        except Exception as e:
-            # This is a soft error, we might be looking for a file
-            pass
-        # If we didn't find a directory, try a file
-        if not child_doc_id or child_doc_id == None:
-            try:
-                child_doc_id = await recurso.get_by_key(children_doc_id, "fsfile-" + name + "...RECURSO.UNiQ.v0")
-            except Exception as e:
-                # If we got here, we couldn't find a file or directory with that name
-                print("Could not find child metadata for {}".format(name))
+        if parent_inode == STATS_DIR_INODE:
+            if name != STATS_FILE_NAME:
                 raise pyfuse3.FUSEError(errno.ENOENT)
-        if debug_mode:
-            print("Found child doc ID: {}".format(child_doc_id))
-            print("Pulling metadata for child doc ID: {}".format(child_doc_id))
-        # We've got a place to pull metadata, let's get the inode
-        metadata_doc_id = await recurso.get_by_key(child_doc_id, "metadata")
-        if debug_mode:
-            print("Child metadata doc ID: {}".format(metadata_doc_id))
-        inode = await recurso.get_by_key(metadata_doc_id, "st_ino")
-        if debug_mode:
-            print("Child inode: {}".format(inode))
-        return await self.getattr(inode)
+            return self.stats_attributes(STATS_FILE_INODE)
+        if name == STATS_DIR_NAME and parent_inode == await self.get_root_inode():
+            return self.stats_attributes(STATS_DIR_INODE)
+
+        # Names we've resolved before, including ones that weren't there
+        parent_inode = int(parent_inode)
+        child_inode = self.dentry_cache.get(parent_inode, name)
+        if child_inode == dentry_cache.NEGATIVE:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+        if child_inode is not None:
+            return await self.getattr(child_inode)
+
+        # Answer from the parent's in-memory directory index
+        directory_index = await self.get_directory_index(parent_inode)
+        dirent = directory_index.entries.get(name)
+        if dirent is None:
+            log.debug("Could not find child metadata for %s", name)
+            await self.dentry_cache.put(parent_inode, name, dentry_cache.NEGATIVE, directory_index.children_doc_id)
+            raise pyfuse3.FUSEError(errno.ENOENT)
 
+        if dirent.doc_id is None:
+            # We saw the entry arrive before its content, fetch it now
+            dirent.doc_id = await recurso.get_by_key(directory_index.children_doc_id, await recurso.encode_filename(name, dirent.type))
+            if dirent.doc_id is None:
+                raise pyfuse3.FUSEError(errno.ENOENT)
+        if dirent.inode is None:
+            log.debug("Pulling metadata for child doc ID: %s", dirent.doc_id)
+            # We've got a place to pull metadata, let's get the inode
+            dirent.inode = (await recurso.find_and_fetch_metadata_for_doc_id(dirent.doc_id)).st_ino
+        log.debug("Child inode: %s", dirent.inode)
+        # Unless the name changed while we were fetching, it'll be answered from the cache next time
+        if directory_index.entries.get(name) is dirent:
+            await self.dentry_cache.put(parent_inode, name, int(dirent.inode), directory_index.children_doc_id)
+        return await self.getattr(dirent.inode)
+
+    async def get_root_inode(self):
+        # The real inode number of the root directory, from its metadata document
+        if self.root_inode is None:
+            # Find the document ID for the root document
+            root_document_doc_id = await recurso.get_by_key(self.inode_map_doc_id, ROOT_INODE_KEY)
+            # Grab the metadata document for the root document
+            metadata_doc_id = await recurso.get_by_key(root_document_doc_id, "metadata")
+            # Grab the inode number from the metadata document
+            self.root_inode = (await recurso.get_metadata(metadata_doc_id)).st_ino
+        return self.root_inode
+
+    async def get_directory_index(self, inode):
+        # Build the directory's name index on first use, it keeps itself current after that
+        directory_index = self.directory_indexes.get(inode)
+        if directory_index is None:
+            # Look up the directory document in the inode map
+            directory_doc_id = await self.get_inode_doc_id(inode)
+            if directory_doc_id is None:
+                raise pyfuse3.FUSEError(errno.ENOENT)
+            # Load the children document from the directory
+            children_doc_id = await recurso.get_by_key(directory_doc_id, "children")
+            if children_doc_id is None:
+                raise pyfuse3.FUSEError(errno.ENOTDIR)
+            directory_index = await recurso.load_directory_index(children_doc_id)
+            self.directory_indexes[inode] = directory_index
+        return directory_index
+
+    @instrumentation.timed("opendir")
     async def opendir(self, inode, ctx):
         # We're opening a directory, so we should figure out
         # * That it exists
@@ -156,28 +526,33 @@ class RecursoFs(pyfuse3.Operations):
         # For now we'll only have compatibility with the root directory
         # if inode != pyfuse3.ROOT_INODE:
         #     raise pyfuse3.FUSEError(errno.ENOENT)
+        if inode == STATS_DIR_INODE:
+            return STATS_DIR_INODE
         if inode == pyfuse3.ROOT_INODE:
             # Override the root inode ("1") to the actual root inode
             inode = "01101100011011110111011001100101"
 
-        print("Attempting to open directory: {}".format(inode))
+        log.debug("Attempting to open directory: %s", inode)
         directory_doc_id = await recurso.get_by_key(root_doc_id, "directory")
         metadata_doc_id = await recurso.get_by_key(directory_doc_id, "metadata")
         metadata = await recurso.get_metadata(metadata_doc_id)
-        inode = metadata["st_ino"]
+        inode = metadata.st_ino
         return inode
 
+    @instrumentation.timed("readdir")
     async def readdir(self, fh, start_id, token):
+        if fh == STATS_DIR_INODE:
+            if start_id == 0:
+                pyfuse3.readdir_reply(token, bytes(STATS_FILE_NAME, "utf8"), self.stats_attributes(STATS_FILE_INODE), 1)
+            return
+
         # Make sure we have a pointer to the inode map document
         if not self.inode_map_doc_id:
             print("Panic! No inode map ID found!")
             sys.exit(1)
 
         # Lookup the directory by inode from the central inode map
-        directory_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(fh))
-
-        # Lookup the metadata for the directory
-        metadata = await recurso.find_and_fetch_metadata_for_doc_id(directory_doc_id)
+        directory_doc_id = await self.get_inode_doc_id(fh)
 
         # Lookup the children for the directory which will contain the list of child files and directories
         children_doc_id = await recurso.get_by_key(directory_doc_id, "children")
@@ -197,90 +572,299 @@ class RecursoFs(pyfuse3.Operations):
         children_list = children["dirs"] + children["files"]
         # Sort children to ensure consistent order
         children_list.sort(key=lambda x: x.key())
-
-        # Iterate over children, respecting the start_id
-        for i, entry in enumerate(children_list):
-            if i < start_id:
-                continue
-            real_name = entry.key().decode("utf8")
-            real_name = real_name[real_name.find("-") + 1:]
-            real_name = real_name.split('...RECURSO.UNiQ.v0')[0]
-            hash = entry.content_hash()
+        child_count = len(children_list)
+        # Respect the start_id
+        children_list = children_list[start_id:]
+
+        # Resolve the children's attributes readdir_concurrency at a time, and stop at the
+        # first one the kernel's buffer has no room for, it will call us again from there.
+        # The child's type comes from its key, and everything lands in the attribute
+        # cache so the kernel's follow-up lookup/getattr calls are free.
+        directory_index = self.directory_indexes.get(int(fh))
+
+        async def resolve_child(entry):
+            inode_type, name = await recurso.decode_filename(entry.key().decode("utf8"))
+            # Children we've already got attributes for don't need their documents read again
+            dirent = directory_index.entries.get(name) if directory_index is not None else None
+            if dirent is not None and dirent.inode is not None:
+                cached = self.attr_cache.get(int(dirent.inode))
+                if cached is not None:
+                    return name, cached
+            instrumentation.count_iroh_call("entry.content_bytes")
             content = await entry.content_bytes(children_document)
-
-            # To render properly...
-            # We'll need to grab the document for that inode
-            inode_doc_id = content.decode("utf8")
-            # Get the metadata for the inode
-            metadata = await recurso.find_and_fetch_metadata_for_doc_id(inode_doc_id)
-
-            # Fetch the inode number
-            real_inode = metadata["st_ino"]
-
-            # Set attributes for the entry
-            try:
-                print("Getting attributes for: {}".format(real_inode))
-                entry_attributes = await self.getattr(real_inode)
-            except Exception as e:
-                print("Error getting attributes for inode: {}".format(real_inode))
-                print(e)
-                continue
-
-            print("Getting entry attributes for: {}".format(real_name))
-            
-            pyfuse3.readdir_reply(
-                token, bytes(real_name, "utf8"), entry_attributes, i + 1)
+            # Listing a directory shouldn't subscribe to every directory in it, iroh can't
+            # drop subscriptions. A lookup or getattr on the child will, if it comes
+            entry_attributes = await self.load_attributes(content.decode("utf8"), inode_type, watch=False)
+            if dirent is not None and dirent.inode is None:
+                dirent.inode = entry_attributes.st_ino
+            return name, entry_attributes
+
+        batch_size = max(1, self.readdir_concurrency)
+        for batch_start in range(0, len(children_list), batch_size):
+            batch = children_list[batch_start:batch_start + batch_size]
+            results = await asyncio.gather(*[resolve_child(entry) for entry in batch], return_exceptions=True)
+            for i, result in enumerate(results, start=start_id + batch_start):
+                if isinstance(result, Exception):
+                    print("Error getting attributes for child {} of inode {}: {}".format(i, fh, result))
+                    continue
+                real_name, entry_attributes = result
+                if not pyfuse3.readdir_reply(
+                        token, bytes(real_name, "utf8"), entry_attributes, i + 1):
+                    return
+
+        # The stats directory comes after the root directory's real children
+        if start_id <= child_count and fh == await self.get_root_inode():
+            pyfuse3.readdir_reply(token, bytes(STATS_DIR_NAME, "utf8"), self.stats_attributes(STATS_DIR_INODE), child_count + 1)
         return
 
+    @instrumentation.timed("open")
     async def open(self, inode, flags, ctx):
-        print("Opening inode: {}".format(inode))
-        if flags & os.O_RDWR or flags & os.O_WRONLY:
-            raise pyfuse3.FUSEError(errno.EACCES)
-        return pyfuse3.FileInfo(fh=inode)
+        log.debug("Opening inode: %s", inode)
+        inode = int(inode)
+        if inode == STATS_FILE_INODE:
+            if flags & os.O_RDWR or flags & os.O_WRONLY:
+                raise pyfuse3.FUSEError(errno.EACCES)
+            # Each open reads its own snapshot, not shared with other handles
+            data = instrumentation.render_text().encode("utf-8")
+            file_info = self.new_file_handle(OpenFile(inode, None, StatsReader(data)))
+            # The size getattr reported may already be out of date
+            file_info.direct_io = True
+            return file_info
+        open_file = self.open_inodes.get(inode)
+        if open_file is None:
+            # First open of this inode, resolve the file document and blob once
+            inode_doc_id = await self.get_inode_doc_id(inode)
+            if inode_doc_id is None:
+                log.debug("Could not get inode document for inode: %s", inode)
+                raise pyfuse3.FUSEError(errno.ENOENT)
+            reader = await recurso.open_blob_reader(inode_doc_id)
+            if reader is None:
+                raise pyfuse3.FUSEError(errno.EIO)
+            # Someone else may have opened it while we were resolving
+            open_file = self.open_inodes.get(inode)
+            if open_file is None:
+                open_file = OpenFile(inode, inode_doc_id, reader)
+                self.open_inodes[inode] = open_file
+                # Keep the blob cache from evicting it while it's open
+                recurso.pin_blob(reader.hash)
+        if flags & os.O_TRUNC and (flags & os.O_RDWR or flags & os.O_WRONLY):
+            # Start from an empty file, committed on flush even if nothing is written
+            async with open_file.lock:
+                self.new_write_buffer(open_file).truncate(0)
+        return self.new_file_handle(open_file)
+
+    def new_file_handle(self, open_file):
+        open_file.refcount += 1
+        fh = self.next_fh
+        self.next_fh += 1
+        self.file_handles[fh] = open_file
+        return pyfuse3.FileInfo(fh=fh)
+
+    def new_write_buffer(self, open_file):
+        if open_file.write_buffer is None:
+            open_file.write_buffer = recurso.WriteBuffer(self.write_spill_threshold, self.write_spill_dir, self.chunk_threshold)
+        return open_file.write_buffer
+
+    @instrumentation.timed("create")
+    async def create(self, parent_inode, name, mode, flags, ctx):
+        log.debug("Creating file: %s", name)
+        if parent_inode == pyfuse3.ROOT_INODE:
+            parent_inode = await self.get_root_inode()
+        name = name.decode("utf8")
+        directory_index = await self.get_directory_index(int(parent_inode))
+        if name in directory_index.entries:
+            raise pyfuse3.FUSEError(errno.EEXIST)
+
+        # Every file starts out as the empty blob, the first flush replaces it
+        blob_hash = await recurso.add_blob_bytes(b"")
+        file_doc_id = await recurso.create_file_document(name, 0, blob_hash, self.inode_map_doc_id, self.ticket_doc_id)
+        await recurso.set_by_key(directory_index.children_doc_id, await recurso.encode_filename(name, "file"), bytes(str(file_doc_id), "utf-8"))
 
+        # Apply the mode and owner we were asked for
+        metadata_doc_id = await recurso.get_by_key(file_doc_id, "metadata")
+        metadata = await recurso.get_metadata(metadata_doc_id)
+        metadata.st_mode = stat.S_IFREG | stat.S_IMODE(mode)
+        metadata.st_uid = ctx.uid
+        metadata.st_gid = ctx.gid
+        await recurso.set_metadata(metadata_doc_id, metadata)
+        inode = metadata.st_ino
+
+        # Don't wait for the children document's event to make the name visible
+        directory_index.entries[name] = recurso.DirEntry("file", file_doc_id, inode)
+        self.dentry_cache.invalidate(int(parent_inode), name)
+
+        open_file = OpenFile(inode, file_doc_id, recurso.BlobReader(blob_hash, 0))
+        self.open_inodes[inode] = open_file
+        recurso.pin_blob(open_file.reader.hash)
+        self.new_write_buffer(open_file)
+        return self.new_file_handle(open_file), await self.getattr(inode)
+
+    @instrumentation.timed("read")
     async def read(self, fh, off, size):
-        print("Reading from inode: {}".format(fh))
-        # Check that the inode exists by looking it up in the inode map
-        try:
-            # Find the document ID for the inode, based on the file handle we're reading from
-            inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, fh)
-        except Exception as e:
-            print("Could not get inode document for inode/file handle: {}".format(fh))
+        open_file = self.file_handles.get(fh)
+        if open_file is None:
+            raise pyfuse3.FUSEError(errno.EBADF)
+        if open_file.write_buffer is not None:
+            # Read our own uncommitted writes
+            return open_file.write_buffer.read(off, size)
+        if open_file.doc_id is None or not self.readahead_max:
+            return await open_file.reader.read(off, size)
+        reader = self.readaheads.get(fh)
+        if reader is None or reader.reader is not open_file.reader:
+            # First read on this handle, or the file has been rewritten since
+            if reader is not None:
+                reader.close()
+            reader = readahead.Readahead(open_file.reader, max_window=self.readahead_max)
+            self.readaheads[fh] = reader
+        # The blob store hands back exactly the requested range, so return it as is without slicing
+        return await reader.read(off, size)
+
+    @instrumentation.timed("write")
+    async def write(self, fh, off, buf):
+        open_file = self.file_handles.get(fh)
+        if open_file is None:
+            raise pyfuse3.FUSEError(errno.EBADF)
+        async with open_file.lock:
+            if open_file.write_buffer is None:
+                # First write to an existing file, start from its current content
+                await self.new_write_buffer(open_file).load(open_file.reader)
+            return open_file.write_buffer.write(off, buf)
+
+    @instrumentation.timed("flush")
+    async def flush(self, fh):
+        open_file = self.file_handles.get(fh)
+        if open_file is not None:
+            await self.commit_writes(open_file)
+
+    async def fsync(self, fh, datasync):
+        await self.flush(fh)
+
+    async def commit_writes(self, open_file):
+        # Turn the write buffer into a new blob with one bulk add, then point the file at it
+        async with open_file.lock:
+            write_buffer = open_file.write_buffer
+            if write_buffer is None or not write_buffer.dirty:
+                return
+            blob_hash, size, blob_format = await write_buffer.commit()
+            await recurso.update_file_document(open_file.doc_id, blob_hash, size, self.ticket_doc_id, blob_format)
+            recurso.unpin_blob(open_file.reader.hash)
+            open_file.reader = recurso.make_blob_reader(blob_hash, size, blob_format)
+            recurso.pin_blob(open_file.reader.hash)
+            self.attr_cache.invalidate(open_file.inode)
+
+    @instrumentation.timed("release")
+    async def release(self, fh):
+        open_file = self.file_handles.pop(fh, None)
+        if open_file is None:
+            return
+        reader = self.readaheads.pop(fh, None)
+        if reader is not None:
+            reader.close()
+        open_file.refcount -= 1
+        # Last handle to this inode, commit anything outstanding and drop the resolved state
+        if open_file.refcount == 0:
+            try:
+                await self.commit_writes(open_file)
+            finally:
+                if open_file.write_buffer is not None:
+                    open_file.write_buffer.close()
+                    open_file.write_buffer = None
+                if self.open_inodes.get(open_file.inode) is open_file:
+                    del self.open_inodes[open_file.inode]
+                if open_file.doc_id is not None:
+                    recurso.unpin_blob(open_file.reader.hash)
+
+    @instrumentation.timed("setattr")
+    async def setattr(self, inode, attr, fields, fh, ctx):
+        if inode == STATS_DIR_INODE or inode == STATS_FILE_INODE:
+            raise pyfuse3.FUSEError(errno.EACCES)
+        requested_inode = inode
+        if inode == pyfuse3.ROOT_INODE:
+            inode = await self.get_root_inode()
+        inode = int(inode)
+        inode_doc_id = await self.get_inode_doc_id(inode)
+        if inode_doc_id is None:
             raise pyfuse3.FUSEError(errno.ENOENT)
-        # Fetch the file using the blobhash
-        blobhash = await recurso.get_by_key(inode_doc_id, "blob")
-        file = await recurso.get_blob(blobhash)
-        # Return the data
-        return file[off:off+size]
 
+        if fields.update_size:
+            open_file = self.open_inodes.get(inode)
+            if open_file is not None:
+                # Truncate through the open file's write buffer, committed on flush
+                async with open_file.lock:
+                    if open_file.write_buffer is None:
+                        await self.new_write_buffer(open_file).load(open_file.reader)
+                    open_file.write_buffer.truncate(attr.st_size)
+            else:
+                reader = await recurso.open_blob_reader(inode_doc_id)
+                if reader is None:
+                    raise pyfuse3.FUSEError(errno.EISDIR)
+                write_buffer = recurso.WriteBuffer(self.write_spill_threshold, self.write_spill_dir, self.chunk_threshold)
+                try:
+                    if attr.st_size > 0:
+                        await write_buffer.load(reader)
+                    write_buffer.truncate(attr.st_size)
+                    blob_hash, size, blob_format = await write_buffer.commit()
+                    await recurso.update_file_document(inode_doc_id, blob_hash, size, self.ticket_doc_id, blob_format)
+                finally:
+                    write_buffer.close()
+
+        if fields.update_mode or fields.update_uid or fields.update_gid or fields.update_atime or fields.update_mtime:
+            metadata_doc_id = await recurso.get_by_key(inode_doc_id, "metadata")
+            metadata = await recurso.get_metadata(metadata_doc_id)
+            if fields.update_mode:
+                metadata.st_mode = stat.S_IFMT(metadata.st_mode) | stat.S_IMODE(attr.st_mode)
+            if fields.update_uid:
+                metadata.st_uid = attr.st_uid
+            if fields.update_gid:
+                metadata.st_gid = attr.st_gid
+            if fields.update_atime:
+                metadata.st_atime = attr.st_atime_ns // 1000000000
+            if fields.update_mtime:
+                metadata.st_mtime = attr.st_mtime_ns // 1000000000
+            await recurso.set_metadata(metadata_doc_id, metadata)
+
+        self.attr_cache.invalidate(inode)
+        if inode == await self.get_root_inode():
+            # getattr caches the root under pyfuse3.ROOT_INODE, not its real inode
+            self.attr_cache.invalidate(pyfuse3.ROOT_INODE)
+        return await self.getattr(requested_inode)
+
+    @instrumentation.timed("unlink")
     async def unlink(self, parent_inode, name, ctx):
-        print(f"Deleting file: {name} from parent inode: {parent_inode}")
+        log.debug("Deleting file: %s from parent inode: %s", name, parent_inode)
+        if parent_inode == STATS_DIR_INODE:
+            raise pyfuse3.FUSEError(errno.EACCES)
+        if parent_inode == pyfuse3.ROOT_INODE:
+            parent_inode = await self.get_root_inode()
 
         # Convert name from bytes to a string
         name = name.decode("utf8")
 
         # Look up the parent inode document in the inode map
-        parent_inode_doc_id = await recurso.get_by_key(self.inode_map_doc_id, str(parent_inode))
+        parent_inode_doc_id = await self.get_inode_doc_id(parent_inode)
 
         # Load the children document from the parent inode
         children_doc_id = await recurso.get_by_key(parent_inode_doc_id, "children")
 
         try:
             # Try to find the file in the children document
-            child_doc_id = await recurso.get_by_key(children_doc_id, recurso.encode_filename(name, "file"))
+            child_doc_id = await recurso.get_by_key(children_doc_id, await recurso.encode_filename(name, "file"))
         except Exception as e:
             # If we can't find the file, raise an error
             raise pyfuse3.FUSEError(errno.ENOENT)
 
         # Get the inode of the file to be deleted
         metadata_doc_id = await recurso.get_by_key(child_doc_id, "metadata")
-        inode = await recurso.get_by_key(metadata_doc_id, "st_ino")
+        inode = (await recurso.get_metadata(metadata_doc_id)).st_ino
 
         # Remove the file entry from the parent's children document
-        await recurso.delete_key(children_doc_id, recurso.encode_filename(name, "file"))
+        await recurso.delete_key(children_doc_id, await recurso.encode_filename(name, "file"))
 
         # Remove the file's inode entry from the inode map
         await recurso.delete_key(self.inode_map_doc_id, str(inode))
+        self.inode_table.discard(int(inode))
+        self.attr_cache.invalidate(int(inode))
+        self.dentry_cache.invalidate(int(parent_inode), name)
 
         # Delete the file's document and associated metadata
         await recurso.delete_document(child_doc_id)
@@ -294,7 +878,7 @@ class RecursoFs(pyfuse3.Operations):
             # If there's no blob, we can ignore this error
             pass
 
-        print(f"File {name} successfully deleted")
+        log.debug("File %s successfully deleted", name)
 
 
 def init_logging(debug=False):
@@ -324,6 +908,38 @@ def parse_args():
                         help='Enable FUSE debugging output')
     parser.add_argument('--ticket', type=str, default=False, 
                         help='ticket to join a root document. If provided, will attempt to join a cluster')
+    parser.add_argument('--doc-cache-size', type=int, default=1024,
+                        help='Number of open document handles to keep cached')
+    parser.add_argument('--attr-timeout', type=float, default=1.0,
+                        help='Seconds to cache inode attributes for (0 disables the cache)')
+    parser.add_argument('--attr-cache-size', type=int, default=65536,
+                        help='Maximum number of inodes to cache attributes for')
+    parser.add_argument('--dentry-cache-size', type=int, default=65536,
+                        help='Maximum number of names, found or not, to remember lookups for')
+    parser.add_argument('--readahead-max', type=int, default=8 * 1024 * 1024,
+                        help='Largest window in bytes to prefetch ahead of sequential reads, 0 to disable')
+    parser.add_argument('--readdir-concurrency', type=int, default=32,
+                        help='How many directory entries readdir resolves at once')
+    parser.add_argument('--write-spill-threshold', type=int, default=64 * 1024 * 1024,
+                        help='Bytes of pending writes per file to keep in memory before spilling to disk')
+    parser.add_argument('--write-spill-dir', type=str, default=None,
+                        help='Directory for spilled write buffers (defaults to the system temp dir)')
+    parser.add_argument('--chunk-threshold', type=int, default=0,
+                        help='Store files of at least this many bytes as deduplicated content-defined chunks (0 disables chunking)')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Keep blobs, docs and a snapshot of the inode indexes on disk here, and reuse them on restart')
+    parser.add_argument('--snapshot-ttl', type=float, default=60.0,
+                        help='Seconds to trust attributes restored from the snapshot for, unless they change')
+    parser.add_argument('--sync-concurrency', type=int, default=32,
+                        help='Document joins and blob downloads to run at once when syncing from other nodes')
+    parser.add_argument('--blob-cache-size', type=int, default=0,
+                        help='Bytes of blobs fetched from other nodes to keep, least recently read go first. 0 keeps them all')
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help='Record per-operation latencies and iroh calls, readable from .recurso/stats in the mount')
+    parser.add_argument('--prometheus-file', type=str, default=None,
+                        help='Periodically write the stats here in Prometheus text format (implies --stats)')
+    parser.add_argument('--prometheus-interval', type=float, default=10.0,
+                        help='Seconds between writes of --prometheus-file')
     return parser.parse_args()
 
 async def main():
@@ -339,23 +955,47 @@ async def main():
         debug_mode = True
 
     init_logging(options.debug)
+    if options.stats or options.prometheus_file:
+        instrumentation.enable()
 
     recursofs = RecursoFs()
+    recursofs.doc_cache_size = options.doc_cache_size
+    recursofs.attr_cache = AttrCache(options.attr_timeout, options.attr_cache_size)
+    recursofs.dentry_cache = dentry_cache.DentryCache(options.dentry_cache_size)
+    recursofs.readdir_concurrency = options.readdir_concurrency
+    recursofs.readahead_max = options.readahead_max
+    recursofs.write_spill_threshold = options.write_spill_threshold
+    recursofs.write_spill_dir = options.write_spill_dir
+    recursofs.chunk_threshold = options.chunk_threshold or None
+    recursofs.data_dir = options.data_dir
+    recursofs.snapshot_ttl = options.snapshot_ttl
+    recursofs.sync_concurrency = options.sync_concurrency
+    recursofs.blob_cache_size = options.blob_cache_size
     if options.ticket:
-        ticket = recurso.iroh.DocTicket(options.ticket)
+        ticket = options.ticket
     root_doc_id, inode_map_doc_id = await recursofs.load_recurso(ticket)
+    if options.data_dir:
+        # Warm start from the last snapshot, and keep it up to date
+        recursofs.load_snapshot()
+        asyncio.create_task(recursofs.snapshot_loop())
+    if options.prometheus_file:
+        asyncio.create_task(instrumentation.prometheus_loop(options.prometheus_file, options.prometheus_interval))
 
     fuse_options = set(pyfuse3.default_options)
     fuse_options.add('fsname=recurso')
     fuse_options.discard('default_permissions')
     if options.debug_fuse:
         fuse_options.add('debug')
-    pyfuse3.init(recursofs, options.mountpoint, fuse_options)
+    with recurso.startup_timer.phase("mount"):
+        pyfuse3.init(recursofs, options.mountpoint, fuse_options)
+    recurso.startup_timer.report()
     try:
         await pyfuse3.main()
     except:
         pyfuse3.close(unmount=True)
         raise
+    finally:
+        recursofs.save_snapshot()
 
     pyfuse3.close()
 
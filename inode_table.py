@@ -0,0 +1,230 @@
+# In-memory copy of the inode map: inode number -> FileDoc/DirectoryDoc ID.
+# Inodes live in a sorted array of uint64 and doc IDs in a parallel buffer of
+# their 32 raw bytes, so a million inodes take 40 MB rather than the 200 MB
+# a dict of strings would. Recent changes sit in a small dict on top and are
+# merged into the arrays in batches.
+# The arrays can be saved to a file and memory-mapped back in on the next start.
+import os
+import re
+import sys
+import mmap
+import struct
+import bisect
+import operator
+from array import array
+
+import decode_ticket
+
+DOC_ID_LENGTH = 32
+# A 32 byte doc ID in base32, the last character carries 4 bits of padding
+DOC_ID_TEXT_LENGTH = 52
+# Changes to hold before merging them into the arrays
+MERGE_THRESHOLD = 4096
+# The inode map also holds the root directory under this key. It's all digits,
+# but it isn't an inode and doesn't fit in 64 bits
+ROOT_INODE_KEY = "01101100011011110111011001100101"
+
+FILE_MAGIC = b"RINO"
+FILE_VERSION = 1
+# magic, version, byte order of the inode array (1 = little endian), inode count
+FILE_HEADER = struct.Struct("<4sBBxxQ")
+
+def inode_from_key(key):
+    # The inode number an inode map key stands for, or None for any other key
+    if isinstance(key, bytes):
+        key = key.decode("utf-8", "replace")
+    if not key.isdigit() or key == ROOT_INODE_KEY:
+        return None
+    inode = int(key)
+    if inode >= 1 << 64:
+        return None
+    return inode
+
+def packs(doc_id):
+    # Doc IDs are base32 namespace IDs, anything else can't be packed.
+    # The padding bits must be zero, or the doc ID wouldn't come back the same
+    return (len(doc_id) == DOC_ID_TEXT_LENGTH and doc_id[-1] in "aq"
+            and decode_ticket.BASE32_TEXT.fullmatch(doc_id) is not None)
+
+def pack_doc_id(doc_id):
+    if not packs(doc_id):
+        return None
+    return decode_ticket.decode_base32(doc_id)
+
+# Doc IDs joined up for pack_doc_ids, when every one of them packs
+PACKABLE_DOC_IDS = re.compile("(?:[a-z2-7]{51}[aq]aaaa)*")
+
+def pack_doc_ids(doc_ids):
+    # Pack many doc IDs with a single base32 decode, or return None if any of them
+    # don't pack. Each one is padded out to 56 characters, which is exactly 35 bytes,
+    # so they decode to fixed slots
+    text = "aaaa".join(doc_ids) + "aaaa" if doc_ids else ""
+    if not PACKABLE_DOC_IDS.fullmatch(text):
+        return None
+    packed = memoryview(decode_ticket.decode_base32(text))
+    slot = 35
+    out = bytearray()
+    for offset in range(0, len(packed), slot):
+        out += packed[offset:offset + DOC_ID_LENGTH]
+    return out
+
+class InodeTable:
+    def __init__(self, merge_threshold=MERGE_THRESHOLD):
+        self.merge_threshold = merge_threshold
+        self.inodes = array('Q')
+        self.doc_ids = bytearray()
+        # inode -> doc ID string, or None once deleted. Newer than the arrays
+        self.recent = {}
+        # Doc IDs that don't pack into 32 bytes, which no real document should have
+        self.unpacked = {}
+        self.mapping = None
+        # Whether there's anything save() hasn't written yet
+        self.changed = False
+        # Set while a scan for bulk_load is running, changes stay in recent until it's done
+        self.loading = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, inode):
+        if inode in self.recent:
+            doc_id = self.recent[inode]
+        else:
+            index = bisect.bisect_left(self.inodes, inode)
+            if index < len(self.inodes) and self.inodes[index] == inode:
+                offset = index * DOC_ID_LENGTH
+                doc_id = decode_ticket.encode_base32(self.doc_ids[offset:offset + DOC_ID_LENGTH])
+            else:
+                doc_id = self.unpacked.get(inode)
+        if doc_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return doc_id
+
+    def set(self, inode, doc_id):
+        self.recent[inode] = doc_id
+        self.changed = True
+        if len(self.recent) >= self.merge_threshold:
+            self.merge()
+
+    def discard(self, inode):
+        self.recent[inode] = None
+        self.changed = True
+        if len(self.recent) >= self.merge_threshold:
+            self.merge()
+
+    def __len__(self):
+        self.merge()
+        return len(self.inodes) + len(self.unpacked)
+
+    def merge(self):
+        # Fold the recent changes into the arrays. Unchanged runs are copied
+        # across whole, so this costs one pass of memcpy plus a step per change
+        if not self.recent or self.loading:
+            return
+        updates = sorted(self.recent.items())
+        self.recent = {}
+        old_inodes = memoryview(self.inodes)
+        old_doc_ids = memoryview(self.doc_ids)
+        inodes = array('Q')
+        doc_ids = bytearray()
+        start = 0
+        for inode, doc_id in updates:
+            end = bisect.bisect_left(old_inodes, inode, start)
+            inodes.frombytes(old_inodes[start:end].cast('B'))
+            doc_ids += old_doc_ids[start * DOC_ID_LENGTH:end * DOC_ID_LENGTH]
+            if end < len(old_inodes) and old_inodes[end] == inode:
+                # Replaced or deleted, either way the old entry goes
+                end += 1
+            start = end
+            self.unpacked.pop(inode, None)
+            if doc_id is None:
+                continue
+            packed = pack_doc_id(doc_id)
+            if packed is None:
+                self.unpacked[inode] = doc_id
+                continue
+            inodes.append(inode)
+            doc_ids += packed
+        inodes.frombytes(old_inodes[start:].cast('B'))
+        doc_ids += old_doc_ids[start * DOC_ID_LENGTH:]
+        old_inodes.release()
+        old_doc_ids.release()
+        self.inodes = inodes
+        self.doc_ids = doc_ids
+        # The arrays are in memory now, let go of the file they were mapped from
+        self.mapping = None
+
+    def begin_bulk_load(self):
+        # Call before starting the scan for bulk_load. Changes that arrive during the
+        # scan are held in recent, merging them into arrays that bulk_load is about
+        # to replace would lose them
+        self.loading = True
+
+    def end_bulk_load(self):
+        # Go back to merging as usual if the scan never got to bulk_load
+        if self.loading:
+            self.loading = False
+            if len(self.recent) >= self.merge_threshold:
+                self.merge()
+
+    def bulk_load(self, pairs):
+        # Replace the contents with (inode, doc ID) pairs from a full scan of the inode map.
+        # Changes made since begin_bulk_load win over what the scan found
+        pairs = sorted(pairs, key=operator.itemgetter(0))
+        self.unpacked = {}
+        packed = pack_doc_ids(list(map(operator.itemgetter(1), pairs)))
+        if packed is None:
+            # Some don't pack, so sort them out one by one
+            self.unpacked = {inode: doc_id for inode, doc_id in pairs if not packs(doc_id)}
+            pairs = [(inode, doc_id) for inode, doc_id in pairs if inode not in self.unpacked]
+            packed = pack_doc_ids(list(map(operator.itemgetter(1), pairs)))
+        self.inodes = array('Q', map(operator.itemgetter(0), pairs))
+        self.doc_ids = packed
+        self.mapping = None
+        self.changed = True
+        self.loading = False
+        self.merge()
+
+    def memory_usage(self):
+        # Bytes held by the arrays, which is all of it for a fully merged table
+        return self.inodes.itemsize * len(self.inodes) + len(self.doc_ids)
+
+    def save(self, path):
+        # Write then rename, so a crash never leaves a half-written table.
+        # Unpacked doc IDs aren't saved, the scan after loading puts them back
+        if not self.changed and os.path.exists(path):
+            return
+        self.merge()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, sys.byteorder == "little", len(self.inodes)))
+            f.write(self.inodes.tobytes())
+            f.write(self.doc_ids)
+        os.replace(tmp_path, path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path, merge_threshold=MERGE_THRESHOLD):
+        # Map a saved table into memory. Returns None if the file isn't one we can use
+        with open(path, "rb") as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return None
+        if len(mapping) < FILE_HEADER.size:
+            return None
+        magic, version, little_endian, count = FILE_HEADER.unpack_from(mapping)
+        if magic != FILE_MAGIC or version != FILE_VERSION or bool(little_endian) != (sys.byteorder == "little"):
+            return None
+        inodes_end = FILE_HEADER.size + count * 8
+        if len(mapping) != inodes_end + count * DOC_ID_LENGTH:
+            return None
+        table = cls(merge_threshold)
+        view = memoryview(mapping)
+        # Both arrays are read straight out of the page cache until the first merge
+        table.inodes = view[FILE_HEADER.size:inodes_end].cast('Q')
+        table.doc_ids = view[inodes_end:]
+        table.mapping = mapping
+        return table
@@ -0,0 +1,227 @@
+# Per-operation latency histograms, iroh call counts and cache hit rates.
+# Nothing is recorded until enable() is called, so a disabled build only pays
+# for a flag check per operation and per iroh call.
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import time
+
+enabled = False
+
+# Histogram buckets are powers of two, from 1us up to about 67s
+BUCKET_BOUNDS = [2 ** i / 1e6 for i in range(27)]
+
+class LatencyHistogram:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        # The last bucket catches everything above the largest bound
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        # Bucket i holds latencies up to BUCKET_BOUNDS[i]
+        micros = seconds * 1e6
+        index = 0 if micros <= 1 else math.ceil(math.log2(micros))
+        self.buckets[min(index, len(BUCKET_BOUNDS))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket the percentile falls in
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+class OpStats:
+    __slots__ = ("latency", "errors", "iroh_calls")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        # iroh call name -> calls made while running this op
+        self.iroh_calls = {}
+
+class OpContext:
+    __slots__ = ("op", "iroh_calls")
+
+    def __init__(self, op):
+        self.op = op
+        self.iroh_calls = {}
+
+ops = {}
+# Outside any op, iroh calls are counted against "background"
+current_op = contextvars.ContextVar("current_op", default=None)
+# name -> function returning (hits, misses)
+caches = {}
+# name -> function returning a count that only goes up
+counters = {}
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    ops.clear()
+
+def register_cache(name, counts):
+    # counts() is only called when stats are rendered
+    caches[name] = counts
+
+def register_counter(name, count):
+    counters[name] = count
+
+def op_stats(op):
+    stats = ops.get(op)
+    if stats is None:
+        stats = ops[op] = OpStats()
+    return stats
+
+def count_iroh_call(name):
+    if not enabled:
+        return
+    context = current_op.get()
+    calls = context.iroh_calls if context is not None else op_stats("background").iroh_calls
+    calls[name] = calls.get(name, 0) + 1
+
+def timed(op):
+    # Decorator for coroutine functions: records the latency and iroh calls of each call as op
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not enabled:
+                return await fn(*args, **kwargs)
+            parent = current_op.get()
+            context = OpContext(op)
+            token = current_op.set(context)
+            stats = op_stats(op)
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latency.observe(time.perf_counter() - start)
+                current_op.reset(token)
+                for name, count in context.iroh_calls.items():
+                    stats.iroh_calls[name] = stats.iroh_calls.get(name, 0) + count
+                    # Calls made by a nested op count towards the op that called it too
+                    if parent is not None:
+                        parent.iroh_calls[name] = parent.iroh_calls.get(name, 0) + count
+        return wrapper
+    return decorate
+
+def cache_counts():
+    return read_counts(caches)
+
+def counter_counts():
+    return read_counts(counters)
+
+def read_counts(registry):
+    counts = {}
+    for name, get_counts in registry.items():
+        try:
+            counts[name] = get_counts()
+        except Exception:
+            # The cache may not exist yet, e.g. before the node is set up
+            continue
+    return counts
+
+def render_text():
+    lines = []
+    if not enabled:
+        lines.append("# instrumentation is disabled, start with --stats to record latencies")
+    lines.append("{:<12} {:>9} {:>7} {:>10} {:>10} {:>10} {:>10} {:>11}".format(
+        "op", "count", "errors", "avg_ms", "p50_ms", "p99_ms", "max_ms", "iroh/op"))
+    for op in sorted(ops):
+        stats = ops[op]
+        latency = stats.latency
+        calls = sum(stats.iroh_calls.values())
+        lines.append("{:<12} {:>9} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>11.2f}".format(
+            op, latency.count, stats.errors,
+            latency.total / latency.count * 1e3 if latency.count else 0.0,
+            latency.percentile(0.50) * 1e3, latency.percentile(0.99) * 1e3, latency.max * 1e3,
+            calls / latency.count if latency.count else float(calls)))
+    lines.append("")
+    lines.append("{:<12} {:<24} {:>9}".format("op", "iroh call", "count"))
+    for op in sorted(ops):
+        for name, count in sorted(ops[op].iroh_calls.items()):
+            lines.append("{:<12} {:<24} {:>9}".format(op, name, count))
+    lines.append("")
+    lines.append("{:<12} {:>11} {:>11} {:>9}".format("cache", "hits", "misses", "hit_rate"))
+    for name, (hits, misses) in sorted(cache_counts().items()):
+        total = hits + misses
+        lines.append("{:<12} {:>11} {:>11} {:>8.1f}%".format(name, hits, misses, hits / total * 100 if total else 0.0))
+    counts = counter_counts()
+    if counts:
+        lines.append("")
+        lines.append("{:<24} {:>11}".format("counter", "value"))
+        for name, count in sorted(counts.items()):
+            lines.append("{:<24} {:>11}".format(name, count))
+    return "\n".join(lines) + "\n"
+
+def render_prometheus(prefix="recurso"):
+    lines = [
+        "# HELP {}_op_latency_seconds Latency of filesystem and document operations".format(prefix),
+        "# TYPE {}_op_latency_seconds histogram".format(prefix),
+    ]
+    for op in sorted(ops):
+        latency = ops[op].latency
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS, latency.buckets):
+            cumulative += count
+            lines.append('{}_op_latency_seconds_bucket{{op="{}",le="{:g}"}} {}'.format(prefix, op, bound, cumulative))
+        lines.append('{}_op_latency_seconds_bucket{{op="{}",le="+Inf"}} {}'.format(prefix, op, latency.count))
+        lines.append('{}_op_latency_seconds_sum{{op="{}"}} {:.9f}'.format(prefix, op, latency.total))
+        lines.append('{}_op_latency_seconds_count{{op="{}"}} {}'.format(prefix, op, latency.count))
+    lines.append("# HELP {}_op_errors_total Operations that raised".format(prefix))
+    lines.append("# TYPE {}_op_errors_total counter".format(prefix))
+    for op in sorted(ops):
+        lines.append('{}_op_errors_total{{op="{}"}} {}'.format(prefix, op, ops[op].errors))
+    lines.append("# HELP {}_iroh_calls_total iroh calls made while running each operation".format(prefix))
+    lines.append("# TYPE {}_iroh_calls_total counter".format(prefix))
+    for op in sorted(ops):
+        for name, count in sorted(ops[op].iroh_calls.items()):
+            lines.append('{}_iroh_calls_total{{op="{}",call="{}"}} {}'.format(prefix, op, name, count))
+    lines.append("# HELP {}_cache_requests_total Cache lookups by result".format(prefix))
+    lines.append("# TYPE {}_cache_requests_total counter".format(prefix))
+    for name, (hits, misses) in sorted(cache_counts().items()):
+        lines.append('{}_cache_requests_total{{cache="{}",result="hit"}} {}'.format(prefix, name, hits))
+        lines.append('{}_cache_requests_total{{cache="{}",result="miss"}} {}'.format(prefix, name, misses))
+    lines.append("# HELP {}_events_total Other things worth counting, such as cache evictions".format(prefix))
+    lines.append("# TYPE {}_events_total counter".format(prefix))
+    for name, count in sorted(counter_counts().items()):
+        lines.append('{}_events_total{{event="{}"}} {}'.format(prefix, name, count))
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    # Write then rename, so a scraper never reads a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+async def prometheus_loop(path, interval=10.0):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            write_prometheus(path)
+        except OSError as e:
+            print("Could not write Prometheus stats to {}: {}".format(path, e))
@@ -0,0 +1,126 @@
+# Sequential readahead for blob readers.
+# Wraps anything with an async read(offset, length) and a size. Once reads on a
+# handle follow on from each other, the next window is fetched in the background
+# while the caller works through the current one. The window doubles each time
+# it's consumed, up to max_window, and everything in flight is cancelled as soon
+# as a read lands somewhere else.
+import asyncio
+
+MIN_WINDOW = 128 * 1024
+MAX_WINDOW = 8 * 1024 * 1024
+# Sequential reads in a row before we start prefetching
+SEQUENTIAL_READS = 2
+
+# Reads served from prefetched data, and reads that had to go to the reader
+hits = 0
+misses = 0
+
+# A prefetch of [start, end), its data once the task finishes
+class Segment:
+    __slots__ = ("start", "end", "task")
+
+    def __init__(self, start, end, task):
+        self.start = start
+        self.end = end
+        self.task = task
+
+class Readahead:
+    def __init__(self, reader, min_window=MIN_WINDOW, max_window=MAX_WINDOW):
+        self.reader = reader
+        self.size = reader.size
+        self.min_window = min_window
+        self.max_window = max(min_window, max_window)
+        self.window = min_window
+        # Where the next read starts if the caller is reading sequentially
+        self.next_offset = 0
+        self.sequential = 0
+        # Prefetches in file order, each starting where the one before ends
+        self.segments = []
+
+    async def read(self, offset, length):
+        global hits, misses
+        if offset >= self.size:
+            return b""
+        length = min(length, self.size - offset)
+        end = offset + length
+
+        data = await self.read_prefetched(offset, end)
+        if data is not None:
+            hits += 1
+            self.sequential += 1
+            self.next_offset = max(self.next_offset, end)
+        else:
+            misses += 1
+            if offset == self.next_offset:
+                self.sequential += 1
+            elif not self.next_offset - self.window <= offset < self.next_offset:
+                # Random access, stop fetching ahead of a reader that isn't coming.
+                # Reads a little behind are concurrent requests arriving out of order
+                self.cancel()
+                self.sequential = 0
+                self.window = self.min_window
+            data = await self.reader.read(offset, length)
+            self.next_offset = max(self.next_offset, offset + len(data)) if self.sequential else offset + len(data)
+
+        self.drop_consumed()
+        if self.sequential >= SEQUENTIAL_READS:
+            self.prefetch()
+        return data
+
+    async def read_prefetched(self, offset, end):
+        # The range from the prefetches if they cover all of it, otherwise None
+        covering = []
+        position = offset
+        for segment in self.segments:
+            if segment.end <= position:
+                continue
+            if segment.start > position:
+                break
+            covering.append(segment)
+            position = segment.end
+            if position >= end:
+                break
+        if position < end or not covering:
+            return None
+        parts = []
+        for segment in covering:
+            try:
+                # Shielded, other reads may be waiting on the same prefetch
+                segment_data = await asyncio.shield(segment.task)
+            except asyncio.CancelledError:
+                if not segment.task.cancelled():
+                    raise
+                # Cancelled by a random read on another request, fall back to the reader
+                return None
+            except Exception:
+                # Let the direct read report the error, if it happens again
+                self.cancel()
+                return None
+            parts.append(memoryview(segment_data)[max(offset, segment.start) - segment.start:min(end, segment.end) - segment.start])
+        if len(parts) == 1:
+            return bytes(parts[0])
+        return b"".join(parts)
+
+    def drop_consumed(self):
+        while self.segments and self.segments[0].end <= self.next_offset:
+            self.segments.pop(0)
+
+    def prefetch(self):
+        # Keep a window's worth of data in flight ahead of the reader
+        prefetched_end = self.segments[-1].end if self.segments else self.next_offset
+        if prefetched_end - self.next_offset >= self.window or prefetched_end >= self.size:
+            return
+        end = min(prefetched_end + self.window, self.size)
+        task = asyncio.ensure_future(self.reader.read(prefetched_end, end - prefetched_end))
+        # A prefetch that fails or is never read shouldn't log "exception never retrieved"
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.segments.append(Segment(prefetched_end, end, task))
+        self.window = min(self.window * 2, self.max_window)
+
+    def cancel(self):
+        for segment in self.segments:
+            segment.task.cancel()
+        self.segments = []
+
+    def close(self):
+        self.cancel()
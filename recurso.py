@@ -1,4 +1,6 @@
 import iroh
+import os
+import logging
 import argparse
 import asyncio
 import time
@@ -7,21 +9,35 @@ import stat
 import random
 import string
 import decode_ticket
+import chunker
+import sync_scheduler
+import inode_table
+import blob_cache
+import watch_pipeline
+import control_codec
+import instrumentation
+import bisect
 import json
-import queue
 import base64
-import threading
+import struct
+import tempfile
+import contextlib
+from collections import OrderedDict
 from blake3 import blake3
 
+log = logging.getLogger(__name__)
+
 # Utility functions
 # These take docs, not doc IDs
 async def get_all_keys(doc):
     query = iroh.Query.all(None)
+    instrumentation.count_iroh_call("doc.get_many")
     entries = await doc.get_many(query)
     return entries
 
 async def get_all_keys_by_prefix(doc, prefix):
     query = iroh.Query.key_prefix(bytes(str(prefix), "utf-8"), None)
+    instrumentation.count_iroh_call("doc.get_many")
     entries = await doc.get_many(query)
     return entries
 
@@ -31,20 +47,150 @@ async def print_all_keys(doc):
         key = entry.key()
         hash = entry.content_hash()
         content = await entry.content_bytes(doc)
-        print("{} : {} (hash: {})".format(key, content.decode("utf8"), hash))
+        # Packed records (such as v1 metadata) aren't valid utf-8
+        print("{} : {} (hash: {})".format(key, content.decode("utf8", errors="replace"), hash))
 
 # These take doc IDs
+async def open_document(doc_id):
+    # Open a document by ID, reusing a cached handle if we already have one
+    doc = doc_cache.get(doc_id)
+    if doc is None:
+        instrumentation.count_iroh_call("docs.open")
+        doc = await node.docs().open(doc_id)
+        if doc is None and ticket_registry is not None and ticket_registry.remote_ticket_docs:
+            # We've never seen this document, ask the peers we sync with for a ticket to it
+            doc = await ticket_registry.request(doc_id)
+        if doc is None:
+            return None
+        doc_cache.put(doc_id, doc)
+    return doc
+
+async def open_local_document(doc_id):
+    # Like open_document, but returns None rather than asking our peers for a
+    # document we don't have, for background work that shouldn't wait on them
+    doc = doc_cache.get(doc_id)
+    if doc is None:
+        instrumentation.count_iroh_call("docs.open")
+        doc = await node.docs().open(doc_id)
+        if doc is None:
+            return None
+        doc_cache.put(doc_id, doc)
+    return doc
+
+async def watch_document_changes(doc_id, callback, remote_only=False):
+    # Call callback(doc_id, entry) for every insert into a document,
+    # or only for inserts that came from other nodes if remote_only is set.
+    # Each document is only subscribed once, later callers just add a listener
+    if doc_id in doc_listeners:
+        doc_listeners[doc_id].append((callback, remote_only))
+        return
+    doc_listeners[doc_id] = [(callback, remote_only)]
+    # Events are queued and handed to the listeners by the node's watch dispatcher
+    change_pipeline.watch(doc_id, dispatch_change)
+    if doc_id in change_watches:
+        # Subscribed before and unwatched since, the subscription picks up where it left off
+        return
+    change_watches[doc_id] = ChangeWatch(doc_id)
+    doc = await open_document(doc_id)
+    await doc.subscribe(change_watches[doc_id])
+
+def unwatch_document_changes(doc_id, callback):
+    # Remove a listener added by watch_document_changes. Once a document has no
+    # listeners its events are dropped as they arrive rather than queued. iroh
+    # can't end a subscription, so it stays, idle, for if the document is watched again
+    listeners = doc_listeners.get(doc_id)
+    if listeners is None:
+        return
+    # A new list rather than changing this one, dispatch_change may be going through it
+    listeners = [listener for listener in listeners if listener[0] != callback]
+    if listeners:
+        doc_listeners[doc_id] = listeners
+    else:
+        del doc_listeners[doc_id]
+        change_pipeline.unwatch(doc_id)
+
+async def dispatch_change(doc_id, change):
+    entry, remote = change
+    for callback, remote_only in doc_listeners.get(doc_id, []):
+        if remote_only and not remote:
+            continue
+        try:
+            result = callback(doc_id, entry)
+            # Listeners may be coroutines if they need to read the entry's content
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            print(f"Error in change listener for doc '{doc_id}': {str(e)}")
+
+# Build a name index of a directory from its children document.
+# The index subscribes to the document, so it stays current after this.
+async def load_directory_index(children_doc_id):
+    directory_index = DirectoryIndex(children_doc_id)
+    # Subscribe before scanning so nothing slips in between the two
+    await watch_document_changes(children_doc_id, directory_index.apply_change)
+    doc = await open_document(children_doc_id)
+    entries = await get_all_keys_by_prefix(doc, "fs")
+    entries = [entry for entry in entries if entry.content_len() > 0]
+    for _ in entries:
+        instrumentation.count_iroh_call("entry.content_bytes")
+    contents = await asyncio.gather(*[entry.content_bytes(doc) for entry in entries])
+    for entry, content in zip(entries, contents):
+        inode_type, name = await decode_filename(entry.key().decode("utf-8"))
+        if inode_type is None:
+            continue
+        # Keys sort fsdir- before fsfile-, so a directory wins over a file of the same name,
+        # and anything already set by a live event is newer than what we scanned
+        directory_index.entries.setdefault(name, DirEntry(inode_type, content.decode("utf-8")))
+    return directory_index
+
+# Fill an InodeTable from the inode map with one scan, and keep it current after that
+async def load_inode_table(inode_map_doc_id, table, concurrency=64):
+    # Changes that arrive while we scan are kept on top of what the scan finds
+    table.begin_bulk_load()
+    try:
+        # Subscribe before scanning so nothing slips in between the two
+        await watch_document_changes(inode_map_doc_id, lambda doc_id, entry: apply_inode_map_change(table, doc_id, entry))
+        doc = await open_document(inode_map_doc_id)
+        entries = await get_all_keys(doc)
+        # Only inode keys point at documents, and empty entries are deletions
+        entries = [entry for entry in entries if inode_table.inode_from_key(entry.key()) is not None and entry.content_len() > 0]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def read_entry(entry):
+            async with semaphore:
+                return inode_table.inode_from_key(entry.key()), (await entry.content_bytes(doc)).decode("utf-8")
+
+        table.bulk_load(await asyncio.gather(*[read_entry(entry) for entry in entries]))
+    finally:
+        table.end_bulk_load()
+    return table
+
+async def apply_inode_map_change(table, doc_id, entry):
+    inode = inode_table.inode_from_key(entry.key())
+    if inode is None:
+        return
+    if entry.content_len() == 0:
+        table.discard(inode)
+        return
+    try:
+        doc = await open_document(doc_id)
+        table.set(inode, (await entry.content_bytes(doc)).decode("utf-8"))
+    except Exception:
+        # Remote content may not have arrived yet, lookups fall back to the inode map
+        table.discard(inode)
+
 async def get_by_key(doc_id, keyname):
     # Fetch the directory document from a key within a doc
     # Get the document we were passed
     try:
-        doc = await node.docs().open(doc_id)
+        doc = await open_document(doc_id)
         # Lookup key
+        instrumentation.count_iroh_call("doc.get_exact")
         key_entry = await doc.get_exact(author, bytes(str(keyname), "utf-8"), False)
         if key_entry is None:
-            if debug_mode:
-                print(f"Key '{keyname}' not found in document {doc_id}")
+            log.debug("Key '%s' not found in document %s", keyname, doc_id)
             return None
+        instrumentation.count_iroh_call("entry.content_bytes")
         key_doc_id = await key_entry.content_bytes(doc)
         # Decode the key_doc_id from bytes to string
         key_doc_id = key_doc_id.decode("utf-8")
@@ -69,12 +215,46 @@ async def decode_filename(keyname):
     else:
         return None, None
 
+# Children documents keep a count of their fsfile-/fsdir- entries under this key,
+# so a directory's size doesn't need a listing of every child
+CHILD_COUNT_KEY = b"entries"
+
+def is_child_key(keyname):
+    if isinstance(keyname, bytes):
+        keyname = keyname.decode("utf-8")
+    return keyname.startswith("fsfile-") or keyname.startswith("fsdir-")
+
+def child_count_lock(doc_id):
+    # Serialises count updates on one children document
+    lock = child_count_locks.get(doc_id)
+    if lock is None:
+        lock = child_count_locks[doc_id] = asyncio.Lock()
+    return lock
+
+async def adjust_child_count(doc, delta):
+    instrumentation.count_iroh_call("doc.get_exact")
+    instrumentation.count_iroh_call("doc.set_bytes")
+    entry = await doc.get_exact(author, CHILD_COUNT_KEY, False)
+    count = int((await entry.content_bytes(doc)).decode()) if entry else 0
+    await doc.set_bytes(author, CHILD_COUNT_KEY, bytes(str(max(count + delta, 0)), "utf-8"))
+
 # Accepts bytes for the value. Make sure to convert to bytes before using this function.
 async def set_by_key(doc_id, keyname, value):
     # Get the document we were passed
     try:
-        doc = await node.docs().open(doc_id)
+        doc = await open_document(doc_id)
+        if is_child_key(keyname):
+            # New children bump the count, replacing an existing one doesn't
+            async with child_count_lock(doc_id):
+                instrumentation.count_iroh_call("doc.get_exact")
+                existing = await doc.get_exact(author, bytes(str(keyname), "utf-8"), False)
+                instrumentation.count_iroh_call("doc.set_bytes")
+                await doc.set_bytes(author, bytes(str(keyname), "utf-8"), value)
+                if existing is None:
+                    await adjust_child_count(doc, 1)
+            return
         # Set the value
+        instrumentation.count_iroh_call("doc.set_bytes")
         await doc.set_bytes(author, bytes(str(keyname), "utf-8"), value)
     except Exception as e:
         print(f"Error in set_by_key for key '{keyname}': {str(e)}")
@@ -83,16 +263,118 @@ async def set_by_key(doc_id, keyname, value):
 async def delete_key(doc_id, keyname):
     # Get the document we were passed
     try:
-        doc = await node.docs().open(doc_id)
+        doc = await open_document(doc_id)
+        if is_child_key(keyname):
+            async with child_count_lock(doc_id):
+                instrumentation.count_iroh_call("doc.get_exact")
+                existing = await doc.get_exact(author, bytes(str(keyname), "utf-8"), False)
+                instrumentation.count_iroh_call("doc.delete")
+                await doc.delete(author, bytes(str(keyname), "utf-8"))
+                if existing is not None:
+                    await adjust_child_count(doc, -1)
+            return
         # Delete the value
+        instrumentation.count_iroh_call("doc.delete")
         await doc.delete(author, bytes(str(keyname), "utf-8"))
     except Exception as e:
         print(f"Error in delete_key for key '{keyname}': {str(e)}")
         return None
+
+# How many writes a WriteBatch has in flight at once
+WRITE_BATCH_CONCURRENCY = 16
+
+# Collects (doc, key, value) writes and issues them concurrently on commit,
+# instead of awaiting one set_bytes round trip after another.
+# Docs can be given as handles or doc IDs. Setting the same key twice keeps the last value.
+class WriteBatch:
+    def __init__(self, concurrency=WRITE_BATCH_CONCURRENCY):
+        self.concurrency = concurrency
+        self.writes = OrderedDict()
+
+    def set(self, doc, keyname, value):
+        if isinstance(keyname, str):
+            keyname = bytes(keyname, "utf-8")
+        if isinstance(value, str):
+            value = bytes(value, "utf-8")
+        doc_key = doc if isinstance(doc, str) else doc.id()
+        self.writes[(doc_key, keyname)] = (doc, keyname, value)
+        return self
+
+    def __len__(self):
+        return len(self.writes)
+
+    async def write(self, semaphore, doc, keyname, value):
+        async with semaphore:
+            if isinstance(doc, str):
+                if is_child_key(keyname):
+                    # Children keys keep the entry count up to date
+                    await set_by_key(doc, keyname.decode("utf-8"), value)
+                    return
+                doc = await open_document(doc)
+            instrumentation.count_iroh_call("doc.set_bytes")
+            await doc.set_bytes(author, keyname, value)
+
+    async def commit(self):
+        writes = list(self.writes.values())
+        self.writes.clear()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.write(semaphore, doc, keyname, value) for doc, keyname, value in writes])
+        return len(writes)
+
+# Number of entries in a children document, without listing them. Unless watch is
+# off, the document is subscribed to so the stored count is redone after remote merges
+async def get_child_count(children_doc_id, watch=True):
+    if watch and children_doc_id not in child_count_watched:
+        # Counts from other nodes can race with ours, so recount after remote merges
+        child_count_watched.add(children_doc_id)
+        await watch_document_changes(children_doc_id, schedule_child_recount, remote_only=True)
+    count = await get_by_key(children_doc_id, CHILD_COUNT_KEY.decode())
+    if count is None:
+        # Older children documents have no count yet
+        return await recount_children(children_doc_id)
+    return int(count)
+
+# Count the entries in a children document from scratch and store the result
+async def recount_children(children_doc_id):
+    doc = await open_document(children_doc_id)
+    async with child_count_lock(children_doc_id):
+        children = await get_all_keys_by_prefix(doc, "fs")
+        count = len([entry for entry in children if entry.content_len() > 0])
+        value = bytes(str(count), "utf-8")
+        # Every write reaches our peers as a remote insert, so only write when the count changed
+        instrumentation.count_iroh_call("doc.get_exact")
+        stored = await doc.get_exact(author, CHILD_COUNT_KEY, False)
+        if stored is not None:
+            instrumentation.count_iroh_call("entry.content_bytes")
+        if stored is None or await stored.content_bytes(doc) != value:
+            instrumentation.count_iroh_call("doc.set_bytes")
+            await doc.set_bytes(author, CHILD_COUNT_KEY, value)
+    return count
+
+def schedule_child_recount(doc_id, entry, delay=1.0):
+    # Bursts of remote inserts only trigger one recount. Remote counts are left alone,
+    # recounting them would have two nodes rewriting each other's count forever
+    if not is_child_key(entry.key()):
+        return
+    if doc_id in pending_recounts:
+        return
+    pending_recounts.add(doc_id)
+
+    async def recount_later():
+        await asyncio.sleep(delay)
+        pending_recounts.discard(doc_id)
+        try:
+            await recount_children(doc_id)
+        except Exception as e:
+            print(f"Error recounting children for doc '{doc_id}': {str(e)}")
+
+    asyncio.create_task(recount_later())
     
 async def delete_document(doc_id):
     # Get the document we were passed
     try:
+        # Forget any cached handle first, it is useless once the doc is dropped
+        doc_cache.evict(doc_id)
         doc = await node.docs().drop(doc_id)
     except Exception as e:
         print(f"Error in delete_document for doc '{doc_id}': {str(e)}")
@@ -106,6 +388,9 @@ async def delete_blob(blob_hash):
         print(f"Error in delete_blob for blob '{blob_hash}': {str(e)}")
         return None
 
+# Chunk boundaries for chunked files. Every node must use the same sizes for chunks to dedup
+file_chunker = chunker.Chunker()
+
 # These take seconds
 def convert_seconds_to_ns(seconds):
     seconds_to_ns = int(seconds * 1e9)
@@ -113,7 +398,7 @@ def convert_seconds_to_ns(seconds):
 
 # Main functions
 async def scan_root_document(doc_id):
-    print("Scanning root document {}".format(doc_id))
+    log.debug("Scanning root document %s", doc_id)
     doc = await node.docs().open(doc_id)
     # Fetch all keys from the root document
     query = iroh.Query.all(None)
@@ -124,12 +409,12 @@ async def scan_root_document(doc_id):
         hash = entry.content_hash()
         content = await entry.content_bytes(doc)
         if key == b"type":
-            print("Type: {}".format(content.decode("utf8")))
+            log.debug("Type: %s", content.decode("utf8"))
             # Check if the type is set to "root document"
             if content.decode("utf8") == "root":
                 # Mark type as correct so that we can check version
                 type_is_correct = True
-                print("Root document found")
+                log.debug("Root document found")
             # Check if the type is set to anything other than "root document", but exists:
             else:
                 print("Found a document of type: {}".format(content.decode("utf8")))
@@ -138,7 +423,7 @@ async def scan_root_document(doc_id):
         if key == b"version":
             # Check version is v0
             if content.decode("utf8") == "v0":
-                print("Root document is v0")
+                log.debug("Root document is v0")
                 if type_is_correct:
                     return "ok"
                 else:
@@ -147,45 +432,56 @@ async def scan_root_document(doc_id):
                 print("Root document is not v0, bailing!")
                 return "err_not_v0"
     else:
-        print("No type set and no odd markers found. Creating as empty rootdoc...")
-        print("Dumping all entries")
-        for entry in entries:
-            key = entry.key()
-            hash = entry.content_hash()
-            content = await entry.content_bytes(doc)
-            print("{} : {} (hash: {})".format(key, content.decode("utf8"), hash))
+        log.debug("No type set and no odd markers found. Creating as empty rootdoc...")
+        # Reading every entry back is only worth it when someone will see it
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Dumping all entries")
+            for entry in entries:
+                content = await entry.content_bytes(doc)
+                log.debug("%s : %s (hash: %s)", entry.key(), content.decode("utf8"), entry.content_hash())
         return "empty"
 
-async def create_children_document(inode_map_doc_id):
-    print("Creating children document")
-    # Create the children document and fetch its ID
+# Create a new document and keep its handle, we're about to write to it
+async def create_document():
     doc = await node.docs().create()
+    doc_cache.put(doc.id(), doc)
+    return doc
+
+async def create_children_document(inode_map_doc_id, batch=None):
+    log.debug("Creating children document")
+    # Create the children document and fetch its ID
+    doc = await create_document()
     children_doc_id = doc.id()
-    # Create the children document itself
-    await doc.set_bytes(author, b"type", b"children")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
-    print("Created children document: {}".format(children_doc_id))
+    # Create the children document itself, in the caller's batch if there is one
+    writes = batch if batch is not None else WriteBatch()
+    writes.set(doc, b"type", b"children")
+    writes.set(doc, b"version", b"v0")
+    writes.set(doc, CHILD_COUNT_KEY, b"0")
+    writes.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    writes.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    if batch is None:
+        await writes.commit()
+    log.debug("Created children document: %s", children_doc_id)
     # Debug mode: print out the doc we just created
-    if debug_mode:
+    if debug_mode and batch is None:
         # Fetch all keys from the document
         await print_all_keys(doc)
     return children_doc_id
 
 # Create a metadata document with the name of a file or directory as well as its DirectoryDoc or FileDoc ID
-async def create_metadata_document(name, type, doc_id, inode_map_doc_id, size):
-    print("Creating metadata document")
+async def create_metadata_document(name, type, doc_id, inode_map_doc_id, size, batch=None):
+    log.debug("Creating metadata document")
     # Create the metadata document and fetch its ID
-    doc = await node.docs().create()
+    doc = await create_document()
     metadata_doc_id = doc.id()
+    writes = batch if batch is not None else WriteBatch()
     # Create the metadata document itself
-    await doc.set_bytes(author, b"type", b"metadata")
+    writes.set(doc, b"type", b"metadata")
     # Set the barename of the file.
-    await doc.set_bytes(author, b"name", bytes(str(name), "utf-8"))
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
+    writes.set(doc, b"name", bytes(str(name), "utf-8"))
+    writes.set(doc, b"version", bytes(METADATA_VERSION, "utf-8"))
+    writes.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    writes.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
 
     # Generate an initial inode
     # 1. Generate a UUID
@@ -200,66 +496,83 @@ async def create_metadata_document(name, type, doc_id, inode_map_doc_id, size):
         st_mode = stat.S_IFREG | 0o644
 
     # Initial metadata to populate the metadata document 
-    metadata = {
-        "st_mode": st_mode,  # Directory with rwxr-xr-x permissions
-        "st_ino": st_ino,   # Generated inode number (UUID-based)
-        "st_uid": 0,   # Root user ID
-        "st_gid": 0,   # Root group ID
-        "st_size": size,  # Initial size (empty if directory, size if file)
-        "st_atime": int(time.time()), # Time of last access
-        "st_mtime": int(time.time()), # Time of last modification
-        "st_ctime": int(time.time()), # Time of last status change
-    }
-
-    # Set the metadata as individual keys in the document
-    for key, value in metadata.items():
-        await doc.set_bytes(author, bytes(key, "utf-8"), bytes(str(value), "utf-8"))
-
-    # Load the inode map document
-    inode_map_doc = await node.docs().open(inode_map_doc_id)
-    print("Loaded inode map document: {}".format(inode_map_doc_id))
+    metadata = Metadata(
+        st_mode=st_mode,  # Directory with rwxr-xr-x permissions
+        st_ino=st_ino,   # Generated inode number (UUID-based)
+        st_uid=0,   # Root user ID
+        st_gid=0,   # Root group ID
+        st_size=size,  # Initial size (empty if directory, size if file)
+        st_atime=int(time.time()), # Time of last access
+        st_mtime=int(time.time()), # Time of last modification
+        st_ctime=int(time.time()), # Time of last status change
+    )
+
+    # Set the metadata as a single packed record
+    writes.set(doc, METADATA_RECORD_KEY, metadata.pack())
 
     # Push the origin document ID into the central inode map
-    print("Pushing inode map item name {} for inode {}".format(name, metadata["st_ino"]))
-    await inode_map_doc.set_bytes(author, bytes(str(metadata["st_ino"]), "utf-8"), bytes(str(doc_id), "utf-8"))
+    log.debug("Pushing inode map item name %s for inode %s", name, metadata.st_ino)
+    writes.set(inode_map_doc_id, bytes(str(metadata.st_ino), "utf-8"), bytes(str(doc_id), "utf-8"))
+    if batch is None:
+        await writes.commit()
 
-    print("Created metadata document: {}".format(metadata_doc_id))
+    log.debug("Created metadata document: %s", metadata_doc_id)
     # Debug mode: print out the doc we just created
-    if debug_mode:
+    if debug_mode and batch is None:
         # Fetch all keys from the document
         await print_all_keys(doc)
     return metadata_doc_id, st_ino
 
+# Share a document for writing and return the ticket as a string
+async def share_document(doc):
+    return str(await doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES))
+
+async def share_blob(blob_hash, blob_format):
+    hash = iroh.Hash.from_string(str(blob_hash))
+    return str(await node.blobs().share(hash, iroh_blob_format(blob_format), iroh.AddrInfoOptions.RELAY_AND_ADDRESSES))
+
+# Ticket documents hold a ticket to the inode map under TICKET_REGISTRY_KEY,
+# requests from their node as want_<doc_id>, and tickets published on request
+# as inode_<doc_id> followed by "-", "_metadata", "_children" or "_blob"
+TICKET_REGISTRY_KEY = "registry"
+TICKET_REQUEST_PREFIX = "want_"
+TICKET_SUFFIXES = ("-", "_metadata", "_children", "_blob")
+
+def ticket_key(doc_id, suffix):
+    return "inode_" + str(doc_id) + suffix
+
+def parse_ticket_key(keyname):
+    # (doc ID, suffix) for a key made by ticket_key, or None for anything else
+    if isinstance(keyname, bytes):
+        keyname = keyname.decode("utf-8", "replace")
+    if not keyname.startswith("inode_"):
+        return None
+    for suffix in TICKET_SUFFIXES:
+        if keyname.endswith(suffix) and len(keyname) > len("inode_") + len(suffix):
+            return keyname[len("inode_"):-len(suffix)], suffix
+    return None
+
 async def create_directory_document(name, inode_map_doc_id, ticket_doc_id):
-    print("Creating directory document")
-    doc = await node.docs().create()
+    log.debug("Creating directory document")
+    doc = await create_document()
     directory_doc_id = doc.id()
-    # Create the children document and fetch its ID
-    children_doc_id = await create_children_document(inode_map_doc_id)
-    # Create the metadata document and fetch its ID
-    metadata_doc_id, st_ino = await create_metadata_document(name, "directory", directory_doc_id, inode_map_doc_id, 0)
+    # Every write for the new directory goes out in one batch at the end
+    batch = WriteBatch()
+    # Create the children and metadata documents and fetch their IDs
+    children_doc_id, (metadata_doc_id, st_ino) = await asyncio.gather(
+        create_children_document(inode_map_doc_id, batch),
+        create_metadata_document(name, "directory", directory_doc_id, inode_map_doc_id, 0, batch),
+    )
     # Create the directory document
-    await doc.set_bytes(author, b"type", b"directory")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"metadata", bytes(metadata_doc_id, "utf-8"))
-    await doc.set_bytes(author, b"children", bytes(children_doc_id, "utf-8"))
-    print("Created directory document: {}".format(directory_doc_id))
-    # Create a ticket to join the directory document
-    writable_ticket = await doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    print("Created writable ticket: {}".format(writable_ticket))
-    # Add that ticket to the tickets document
-    tickets_doc = await node.docs().open(ticket_doc_id)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '-', "utf-8"), bytes(str(writable_ticket), "utf-8"))
-    # Create a ticket to join the metadata document
-    metadata_doc = await node.docs().open(metadata_doc_id)
-    writable_ticket_metadata = await metadata_doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '_metadata', "utf-8"), bytes(str(writable_ticket_metadata), "utf-8"))
-    # Create a ticket to join the children document
-    children_doc = await node.docs().open(children_doc_id)
-    writable_ticket_children = await children_doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '_children', "utf-8"), bytes(str(writable_ticket_children), "utf-8"))
+    batch.set(doc, b"type", b"directory")
+    batch.set(doc, b"version", b"v0")
+    batch.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"metadata", bytes(metadata_doc_id, "utf-8"))
+    batch.set(doc, b"children", bytes(children_doc_id, "utf-8"))
+    # Tickets for the directory are only made once a peer asks for it, see TicketRegistry
+    await batch.commit()
+    log.debug("Created directory document: %s", directory_doc_id)
     # Debug mode: print out the doc we just created
     if debug_mode:
         # Fetch all keys from the document
@@ -267,43 +580,35 @@ async def create_directory_document(name, inode_map_doc_id, ticket_doc_id):
 
     return directory_doc_id
 
-async def create_file_document(name, size, blob_hash, inode_map_doc_id, ticket_doc_id):
-    print("Creating file document")
-    doc = await node.docs().create()
+# How a file's content is stored: one RAW blob, or a HashSeq collection of content-defined chunks
+BLOB_FORMAT_RAW = "raw"
+BLOB_FORMAT_HASHSEQ = "hashseq"
+
+def iroh_blob_format(blob_format):
+    if blob_format == BLOB_FORMAT_HASHSEQ:
+        return iroh.BlobFormat.HASH_SEQ
+    return iroh.BlobFormat.RAW
+
+async def create_file_document(name, size, blob_hash, inode_map_doc_id, ticket_doc_id, blob_format=BLOB_FORMAT_RAW):
+    log.debug("Creating file document")
+    doc = await create_document()
     file_doc_id = doc.id()
-    # Create the metadata document and fetch its ID
-    metadata_doc_id, st_ino = await create_metadata_document(name, "file", file_doc_id, inode_map_doc_id, size)
+    batch = WriteBatch()
+    # Create the metadata document and fetch its ID.
+    # This also inserts the file document ID into the inode map
+    metadata_doc_id, st_ino = await create_metadata_document(name, "file", file_doc_id, inode_map_doc_id, size, batch)
     # Create the file document
-    await doc.set_bytes(author, b"type", b"file")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"metadata", bytes(str(metadata_doc_id), "utf-8"))
-    await doc.set_bytes(author, b"blob", bytes(str(blob_hash), "utf-8"))
-    await doc.set_bytes(author, b"size", bytes(str(size), "utf-8"))
-    print("Created file document: {}".format(file_doc_id))
-
-    # Create a ticket to join the file document
-    writable_ticket = await doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    print("Created writable ticket: {}".format(writable_ticket))
-    # Add that ticket to the tickets document
-    tickets_doc = await node.docs().open(ticket_doc_id)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '-', "utf-8"), bytes(str(writable_ticket), "utf-8"))
-    # Create a ticket to join the metadata document
-    metadata_doc = await node.docs().open(metadata_doc_id)
-    writable_ticket_metadata = await metadata_doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '_metadata', "utf-8"), bytes(str(writable_ticket_metadata), "utf-8"))
-    # Create a ticket to sync the blob
-    hash = iroh.Hash.from_string(str(blob_hash))    
-    blob_format = iroh.BlobFormat.RAW
-    ticket = await node.blobs().share(hash, blob_format, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
-    print("Created blob ticket: {}".format(ticket))
-    # Add that ticket to the tickets document
-    tickets_doc = await node.docs().open(ticket_doc_id)
-    await tickets_doc.set_bytes(author, bytes('inode_' + str(st_ino) + '_blob', "utf-8"), bytes(str(ticket), "utf-8"))
-
-    # Insert the file document ID into the inode map
-    await set_by_key(inode_map_doc_id, bytes(str(st_ino), "utf-8"), bytes(str(file_doc_id), "utf-8"))
+    batch.set(doc, b"type", b"file")
+    batch.set(doc, b"version", b"v0")
+    batch.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"metadata", bytes(str(metadata_doc_id), "utf-8"))
+    batch.set(doc, b"blob", bytes(str(blob_hash), "utf-8"))
+    batch.set(doc, b"format", bytes(blob_format, "utf-8"))
+    batch.set(doc, b"size", bytes(str(size), "utf-8"))
+    # Tickets for the file and its blob are only made once a peer asks for it, see TicketRegistry
+    await batch.commit()
+    log.debug("Created file document: %s", file_doc_id)
 
     # Debug mode: print out the doc we just created
     if debug_mode:
@@ -312,8 +617,29 @@ async def create_file_document(name, size, blob_hash, inode_map_doc_id, ticket_d
 
     return file_doc_id
 
+# Point an existing FileDoc at new content, and bring its metadata up to date
+async def update_file_document(file_doc_id, blob_hash, size, ticket_doc_id, blob_format=BLOB_FORMAT_RAW):
+    metadata_doc_id = await get_by_key(file_doc_id, "metadata")
+    metadata = await get_metadata(metadata_doc_id)
+    metadata.st_size = size
+    metadata.st_mtime = int(time.time())
+    metadata.st_ctime = int(time.time())
+
+    batch = WriteBatch()
+    batch.set(file_doc_id, b"blob", bytes(str(blob_hash), "utf-8"))
+    batch.set(file_doc_id, b"format", bytes(blob_format, "utf-8"))
+    batch.set(file_doc_id, b"size", bytes(str(size), "utf-8"))
+    batch.set(file_doc_id, b"updated", bytes(str(time.time()), "utf-8"))
+    await set_metadata(metadata_doc_id, metadata, batch)
+    await batch.commit()
+
+    # Peers that already asked for this file need a ticket for the new content
+    ticket_registry.invalidate(file_doc_id)
+    if await get_by_key(ticket_doc_id, ticket_key(file_doc_id, "_blob")) is not None:
+        await ticket_registry.publish(file_doc_id)
+
 async def create_dummy_file_document(name, size, inode_map_doc_id, ticket_doc_id):
-    print("Creating dummy file and document")
+    log.debug("Creating dummy file and document")
 
     # Generate a random file of the size we want.
     random_file_contents = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(size))
@@ -323,21 +649,32 @@ async def create_dummy_file_document(name, size, inode_map_doc_id, ticket_doc_id
     assert add_outcome.format == iroh.BlobFormat.RAW
     assert add_outcome.size == size
 
-    print("add_outcome.hash: {}".format(add_outcome.hash))
+    log.debug("add_outcome.hash: %s", add_outcome.hash)
 
+    # The file document already points at the uploaded blob
     file_doc_id = await create_file_document(name, size, add_outcome.hash, inode_map_doc_id, ticket_doc_id)
-    # Insert the uploaded blob to the file document
-    await set_by_key(file_doc_id, "blob", bytes(str(add_outcome.hash), "utf-8"))
     return file_doc_id
 
 async def create_root_document(ticket=False):
     global node
+    global ticket_registry
     # Find or create a root document for Recurso to use.
+    # A persistent node picks up the documents it was using last time
+    saved_state = load_node_state()
+    if saved_state and not ticket:
+        doc_id = saved_state["root_doc_id"]
+        with startup_timer.phase("scan"):
+            status = await scan_root_document(doc_id)
+        if status == "ok":
+            print("Reusing root doc from the data dir: {}".format(doc_id))
+            ticket_registry = TicketRegistry(saved_state["ticket_doc_id"])
+            return doc_id, saved_state["directory_doc_id"], saved_state["inode_map_doc_id"], saved_state["ticket_doc_id"]
+        print("Saved root doc {} is not usable, starting a new one".format(doc_id))
+        saved_state = None
     # If we've been given a ticket
     if ticket:
-        # We convert the ticket from a string to a DocTicket
-        ticket = iroh.DocTicket(ticket)
-        doc = await node.docs().join(ticket)
+        # Join, then wait for the first sync with the ticket's peers rather than guessing how long it takes
+        doc = await join_and_wait_for_sync(ticket)
         doc_id = doc.id()
         print("Joined root doc: {}".format(doc_id))
     else:
@@ -345,11 +682,18 @@ async def create_root_document(ticket=False):
         doc = await node.docs().create()
         doc_id = doc.id()
         print("Created new (blank) initial root doc: {}".format(doc_id))
-    # Without this sleep, sync issues occur
-    time.sleep(1)
-    ticket_doc_id = await create_ticket_document()
-    status = await scan_root_document(doc_id)
-    print("Created ticket doc: {}".format(ticket_doc_id))
+    if saved_state and saved_state["root_doc_id"] == doc_id:
+        # Rejoining the cluster we were in before, keep our ticket doc
+        ticket_doc_id = saved_state["ticket_doc_id"]
+    else:
+        # Reuse the ticket doc this node registered in the root doc, if there is one.
+        # Memory nodes get a new node ID every start, so they never have one
+        ticket_doc_id = await find_ticket_document(doc_id) if data_dir_path is not None else None
+        if ticket_doc_id is None:
+            ticket_doc_id = await create_ticket_document()
+    with startup_timer.phase("scan"):
+        status = await scan_root_document(doc_id)
+    print("Using ticket doc: {}".format(ticket_doc_id))
     print("Scan status: {}".format(status))
     if status == "ok":
         # Found a root document, return it
@@ -357,30 +701,101 @@ async def create_root_document(ticket=False):
         print("Loading existing directory and inode map document IDs")
         directory_doc_id = await get_by_key(doc_id, "directory")
         inode_map_doc_id = await get_by_key(doc_id, "inode_map")
-        return doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id
     elif status == "empty":
         # No root document found, create a new one and fetch the result
         directory_doc_id, inode_map_doc_id = await create_new_root_document(doc_id, ticket_doc_id)
-        return doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id
     elif status == "err_not_root":
         # Found a document of type other than "root document"
         print("Found a document of type other than 'root document'. Bailing!")
         # Error out
         return None, None, None, None
+    # Remember which ticket doc is ours, so the next start can find it again. Only
+    # persistent nodes keep their node ID, a memory node's key would never be used
+    # again and would pile up in the shared root doc
+    if data_dir_path is not None:
+        await set_by_key(doc_id, ticket_document_key(await node.net().node_id()), bytes(str(ticket_doc_id), "utf-8"))
+    # Tickets for everything else are handed out on request
+    ticket_registry = TicketRegistry(ticket_doc_id)
+    if await get_by_key(ticket_doc_id, TICKET_REGISTRY_KEY) is None:
+        await set_by_key(ticket_doc_id, TICKET_REGISTRY_KEY, bytes(await share_document(await open_document(inode_map_doc_id)), "utf-8"))
+    save_node_state({
+        "root_doc_id": doc_id,
+        "directory_doc_id": directory_doc_id,
+        "inode_map_doc_id": inode_map_doc_id,
+        "ticket_doc_id": ticket_doc_id,
+    })
+    return doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id
+
+# Persistent nodes remember which documents they were using in the data dir
+def node_state_path():
+    return os.path.join(data_dir_path, "recurso-state.json")
+
+def load_node_state():
+    if data_dir_path is None or not os.path.exists(node_state_path()):
+        return None
+    try:
+        with open(node_state_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading node state from '{node_state_path()}': {str(e)}")
+        return None
+
+def save_node_state(state):
+    if data_dir_path is None:
+        return
+    # Write then rename, so a crash never leaves a half-written state file
+    tmp_path = node_state_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, node_state_path())
+
+# Each node's ticket doc is registered in the root doc under this key
+def ticket_document_key(node_id):
+    return "tickets_" + str(node_id)
+
+async def find_ticket_document(root_doc_id):
+    ticket_doc_id = await get_by_key(root_doc_id, ticket_document_key(await node.net().node_id()))
+    if ticket_doc_id is None:
+        return None
+    # Only reuse it if we still have it, a memory node from an earlier run won't
+    if await open_local_document(ticket_doc_id) is None:
+        return None
+    print("Reusing ticket doc: {}".format(ticket_doc_id))
+    return ticket_doc_id
+
+# Join a document and wait until it has synced with one of the ticket's peers,
+# or until timeout seconds have passed, whichever comes first
+async def join_and_wait_for_sync(ticket, timeout=10):
+    if isinstance(ticket, str):
+        peers = [node_addr.node_id for node_addr in decode_ticket.decode_iroh_ticket(ticket).nodes]
+        ticket = iroh.DocTicket(ticket)
+    else:
+        peers = []
+    waiter = SyncWaiter(peers)
+    with startup_timer.phase("join"):
+        doc = await node.docs().join_and_subscribe(ticket, waiter)
+    with startup_timer.phase("sync"):
+        try:
+            await asyncio.wait_for(waiter.synced.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("Timed out after {}s waiting for {} to sync, carrying on".format(timeout, doc.id()))
+    return doc
 
 async def create_ticket_document():
     print("Creating node inode document")
-    doc = await node.docs().create()
+    doc = await create_document()
     ticket_doc_id = doc.id()
     node_id = await node.net().node_id()
     print("Created node inode document: {}".format(ticket_doc_id))
 
     # Set the type, version, created, updated, and inode_map keys
-    await doc.set_bytes(author, b"type", b"active_node_inodes")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"node_id", bytes(str(node_id), "utf-8"))
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
+    batch = WriteBatch()
+    batch.set(doc, b"type", b"active_node_inodes")
+    batch.set(doc, b"version", b"v0")
+    batch.set(doc, b"node_id", bytes(str(node_id), "utf-8"))
+    batch.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    await batch.commit()
 
     return ticket_doc_id
 
@@ -389,14 +804,16 @@ async def create_inode_map_document():
     # Takes the root directory's document ID as an argument
     # DO NOT pass this any other document ID including the root document itself
     print("Creating inode map document")
-    doc = await node.docs().create()
+    doc = await create_document()
     inode_map_doc_id = doc.id()
 
     # Set the type, version, created, updated, and inode_map keys
-    await doc.set_bytes(author, b"type", b"inode_map")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
+    batch = WriteBatch()
+    batch.set(doc, b"type", b"inode_map")
+    batch.set(doc, b"version", b"v0")
+    batch.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    await batch.commit()
 
     print("Created inode map document: {}".format(inode_map_doc_id))
     # Debug mode: print out the doc we just created
@@ -407,49 +824,43 @@ async def create_inode_map_document():
 
 async def create_new_root_document(doc_id, ticket_doc_id):
     print("Creating new root document in: {}".format(doc_id))
-    doc = await node.docs().open(doc_id)
+    doc = await open_document(doc_id)
 
     # Load the ticket map
-    # Create the inode map document and fetch its ID
-    inode_map_doc_id = await create_inode_map_document()
-    # Create a ticket to join the inode map document
-    writable_ticket = await doc.share(iroh.ShareMode.WRITE, iroh.AddrInfoOptions.RELAY_AND_ADDRESSES)
+    # Create the inode map document and fetch its ID, and a ticket to join it
+    inode_map_doc_id, writable_ticket = await asyncio.gather(create_inode_map_document(), share_document(doc))
     print("Created writable ticket for the inode map: {}".format(writable_ticket))
-    # Add the inode map ticket to the ticket map
-    await set_by_key(ticket_doc_id, bytes(str("01101100011011110111011001100101"), "utf-8"), bytes(str(writable_ticket), "utf-8"))
 
     # Create the directory document and fetch its ID
     directory_doc_id = await create_directory_document("RECURSO_ROOT_DIRECTORY", inode_map_doc_id, ticket_doc_id)
+    # Fetch the inode number for the root directory's directory document
+    metadata = await find_and_fetch_metadata_for_doc_id(directory_doc_id)
 
+    batch = WriteBatch()
+    # Add the inode map ticket to the ticket map
+    batch.set(ticket_doc_id, "01101100011011110111011001100101", writable_ticket)
     # Create the root document
-    await doc.set_bytes(author, b"type", b"root")
-    await doc.set_bytes(author, b"version", b"v0")
-    await doc.set_bytes(author, b"created", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"updated", bytes(str(time.time()), "utf-8"))
-    await doc.set_bytes(author, b"directory", bytes(directory_doc_id, "utf-8"))
-    await doc.set_bytes(author, b"inode_map", bytes(inode_map_doc_id, "utf-8"))
-
+    batch.set(doc, b"type", b"root")
+    batch.set(doc, b"version", b"v0")
+    batch.set(doc, b"created", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"updated", bytes(str(time.time()), "utf-8"))
+    batch.set(doc, b"directory", bytes(directory_doc_id, "utf-8"))
+    batch.set(doc, b"inode_map", bytes(inode_map_doc_id, "utf-8"))
     # Now we push the root document ID into the inode map
-    # Load in the inode_map_doc
-    inode_map_doc = await node.docs().open(inode_map_doc_id)
-
-    # Fetch the inode number for the root directory's directory document
-    metadata = await find_and_fetch_metadata_for_doc_id(directory_doc_id)
     # Set the inode number for the root directory to be equal to the document ID for the root directory's document
-    await inode_map_doc.set_bytes(author, bytes(str("01101100011011110111011001100101"), "utf-8"), bytes(str(directory_doc_id), "utf-8"))
+    batch.set(inode_map_doc_id, "01101100011011110111011001100101", bytes(str(directory_doc_id), "utf-8"))
     # Set the real inode number to be equal to the document ID for the root directory's document
-    await inode_map_doc.set_bytes(author, bytes(str(metadata["st_ino"]), "utf-8"), bytes(str(directory_doc_id), "utf-8"))
+    batch.set(inode_map_doc_id, str(metadata.st_ino), bytes(str(directory_doc_id), "utf-8"))
 
     # Create dummy files, push them into the children list
     children_doc_id = await get_by_key(directory_doc_id, "children")
-    created_file_id = await create_dummy_file_document("example.txt", 5, inode_map_doc_id, ticket_doc_id)
-    await set_by_key(children_doc_id, await encode_filename("example.txt", "file"), bytes(str(created_file_id), "utf-8"))
-    created_file_id = await create_dummy_file_document("example2.txt", 512, inode_map_doc_id, ticket_doc_id)
-    await set_by_key(children_doc_id, await encode_filename("example2.txt", "file"), bytes(str(created_file_id), "utf-8"))
-    created_file_id = await create_dummy_file_document("hello.txt", 1024, inode_map_doc_id, ticket_doc_id)
-    await set_by_key(children_doc_id, await encode_filename("hello.txt", "file"), bytes(str(created_file_id), "utf-8"))
-    created_file_id = await create_dummy_file_document("world.txt", 10240, inode_map_doc_id, ticket_doc_id)
-    await set_by_key(children_doc_id, await encode_filename("world.txt", "file"), bytes(str(created_file_id), "utf-8"))
+    dummy_files = [("example.txt", 5), ("example2.txt", 512), ("hello.txt", 1024), ("world.txt", 10240)]
+    created_file_ids = await asyncio.gather(*[
+        create_dummy_file_document(name, size, inode_map_doc_id, ticket_doc_id) for name, size in dummy_files
+    ])
+    for (name, size), created_file_id in zip(dummy_files, created_file_ids):
+        batch.set(children_doc_id, await encode_filename(name, "file"), bytes(str(created_file_id), "utf-8"))
+    await batch.commit()
 
     # Check that we have a valid inode map document
     assert inode_map_doc_id
@@ -460,70 +871,327 @@ async def create_new_root_document(doc_id, ticket_doc_id):
 # Then use get_metadata to fetch the metadata from within it
 async def find_and_fetch_metadata_for_doc_id(doc_id):
     # Get inode and other directory info from a DirectoryDoc or FileDoc
-    doc = await node.docs().open(doc_id)
+    doc = await open_document(doc_id)
     # Lookup metadata key
-    if debug_mode:
-        print("Attempting to get metadata for " + doc_id)
+    log.debug("Attempting to get metadata for %s", doc_id)
+    instrumentation.count_iroh_call("doc.get_exact")
     metadata_entry = await doc.get_exact(author, b"metadata", False)
+    instrumentation.count_iroh_call("entry.content_bytes")
     metadata_doc_id = await metadata_entry.content_bytes(doc)
     # Fetch metadata
     document_metadata = await get_metadata(metadata_doc_id.decode("utf-8"))
-    # Debug mode: print out the metadata we just fetched
-    if debug_mode:
-        print(document_metadata)
+    log.debug("Metadata for %s: %s", doc_id, document_metadata)
     return document_metadata
 
 async def get_metadata(doc_id):
     # Fetch the metadata document
-    metadata_doc = await node.docs().open(doc_id)
-
-    # Metadata to fetch
-    metadata = {
-        "st_mode": "UNLOADED",
-        "st_ino": "UNLOADED",   # Generated inode number (UUID-based)
-        "st_uid": "UNLOADED",   # Root user ID
-        "st_gid": "UNLOADED",   # Root group ID
-        "st_size": "UNLOADED",  # Initial size (empty directory)
-        "st_atime": "UNLOADED", # Time of last access
-        "st_mtime": "UNLOADED", # Time of last modification
-        "st_ctime": "UNLOADED"  # Time of creation
-    }
-
-    # Populate the metadata dictionary with actual values
-    for key, _ in metadata.items():
-        entry = await metadata_doc.get_exact(author, key.encode(), False)
-        if entry:
-            value = await entry.content_bytes(metadata_doc)
-            metadata[key] = int(value.decode())
+    metadata_doc = await open_document(doc_id)
+
+    # v1 keeps everything under "stat", v0 has one "st_" key per field.
+    # Both start with "st", so one prefix query fetches either layout
+    query = iroh.Query.author_key_prefix(author, b"st", None)
+    instrumentation.count_iroh_call("doc.get_many")
+    entries = await metadata_doc.get_many(query)
+
+    for entry in entries:
+        if entry.key() == METADATA_RECORD_KEY:
+            instrumentation.count_iroh_call("entry.content_bytes")
+            return Metadata.unpack(await entry.content_bytes(metadata_doc))
+
+    # No packed record, so this is a v0 document
+    for entry in entries:
+        instrumentation.count_iroh_call("entry.content_bytes")
+    values = await asyncio.gather(*[entry.content_bytes(metadata_doc) for entry in entries])
+
+    # Populate the metadata record with actual values
+    metadata = Metadata()
+    for entry, value in zip(entries, values):
+        key = entry.key().decode()
+        if key in Metadata.__slots__:
+            setattr(metadata, key, int(value.decode()))
 
     return metadata
 
+# Write a full set of stat fields into an existing metadata document
+async def set_metadata(doc_id, metadata, batch=None):
+    writes = batch if batch is not None else WriteBatch()
+    writes.set(doc_id, METADATA_RECORD_KEY, metadata.pack())
+    writes.set(doc_id, b"version", bytes(METADATA_VERSION, "utf-8"))
+    writes.set(doc_id, b"updated", bytes(str(time.time()), "utf-8"))
+    if batch is None:
+        await writes.commit()
+
+# Upgrade a single v0 metadata document to the packed v1 record.
+# Returns True if the document was migrated.
+async def migrate_metadata_document(doc_id):
+    version = await get_by_key(doc_id, "version")
+    if version != "v0":
+        return False
+    metadata = await get_metadata(doc_id)
+    if metadata.st_ino is None:
+        # Not a metadata document we understand, leave it alone
+        return False
+    await set_metadata(doc_id, metadata)
+    # Drop the old per-field keys, this deletes every key starting with "st_"
+    metadata_doc = await open_document(doc_id)
+    await metadata_doc.delete(author, b"st_")
+    return True
+
+# Walk the inode map and upgrade every v0 metadata document in place.
+# Meant to run as a background task, so it pauses between documents
+# to leave room for FUSE operations.
+async def migrate_metadata_documents(inode_map_doc_id, delay=0.01):
+    inode_map_doc = await open_document(inode_map_doc_id)
+    entries = await get_all_keys(inode_map_doc)
+    seen = set()
+    migrated = 0
+    for entry in entries:
+        # Only inode keys point at documents, and empty entries are deletions
+        if not entry.key().decode().isdigit() or entry.content_len() == 0:
+            continue
+        doc_id = (await entry.content_bytes(inode_map_doc)).decode("utf-8")
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        try:
+            # Documents that haven't synced here yet are for their owners to migrate.
+            # Once a document is open the reads below are served from the handle cache
+            if await open_local_document(doc_id) is None:
+                continue
+            metadata_doc_id = await get_by_key(doc_id, "metadata")
+            if metadata_doc_id is None or await open_local_document(metadata_doc_id) is None:
+                continue
+            if await migrate_metadata_document(metadata_doc_id):
+                migrated += 1
+        except Exception as e:
+            print(f"Error migrating metadata for doc '{doc_id}': {str(e)}")
+        await asyncio.sleep(delay)
+    if migrated:
+        print("Migrated {} metadata documents to {}".format(migrated, METADATA_VERSION))
+    return migrated
+
 async def get_document(doc_id):
-    doc = await node.docs().open(doc_id)
+    doc = await open_document(doc_id)
     return doc
 
 async def get_blob(blob_hash):
-    print("Trying to grab blob: {}".format(blob_hash))
+    log.debug("Trying to grab blob: %s", blob_hash)
     hash = iroh.Hash.from_string(blob_hash)
-    print("hash: {}".format(str(hash)))
-    blob = await node.blobs().read_to_bytes(hash)
-    print("read_to_bytes {}", blob)
+    async def read():
+        instrumentation.count_iroh_call("blobs.read_to_bytes")
+        return await node.blobs().read_to_bytes(hash)
+    blob = await read_fetched_blob(blob_hash, read)
+    log.debug("read_to_bytes: %d bytes", len(blob))
     return blob
 
-async def setup_iroh_node(ticket=False, debug=False):
+# Read only [offset, offset + length) of a blob, rather than loading all of it.
+# Reads past the end of the blob come back short.
+async def get_blob_range(blob_hash, offset, length):
+    hash = iroh.Hash.from_string(str(blob_hash))
+    async def read():
+        instrumentation.count_iroh_call("blobs.read_at")
+        return await node.blobs().read_at_to_bytes(hash, offset, iroh.ReadAtLen.at_most(length))
+    return await read_fetched_blob(blob_hash, read)
+
+# Add content to the blob store in one go and return its hash
+async def add_blob_bytes(data):
+    instrumentation.count_iroh_call("blobs.add_bytes")
+    add_outcome = await node.blobs().add_bytes(bytes(data))
+    return add_outcome.hash
+
+async def add_blob_from_path(path):
+    cb = AddCallback()
+    instrumentation.count_iroh_call("blobs.add_from_path")
+    await node.blobs().add_from_path(path, False, iroh.SetTagOption.auto(), iroh.WrapOption.no_wrap(), cb)
+    return cb.hash
+
+# Blobs fetched from other nodes are held under a tag of their own. Evicting one
+# deletes the tag, and the store's garbage collection frees it unless something
+# else (a file we wrote, a document) still refers to it
+BLOB_CACHE_TAG_PREFIX = b"recurso-cache-"
+# How often the store collects untagged blobs when the blob cache is on
+BLOB_GC_INTERVAL_MILLIS = 10000
+
+def blob_cache_tag(blob_hash):
+    return BLOB_CACHE_TAG_PREFIX + str(blob_hash).encode("utf-8")
+
+# Run read() against a blob, fetching it again first if the blob cache evicted it
+async def read_fetched_blob(blob_hash, read):
+    if fetched_blobs is None:
+        return await read()
+    blob_hash = str(blob_hash)
+    # Pinned while we read it, or a blob too big for the cache would be evicted
+    # again as soon as it was fetched, and fetched again on every read
+    fetched_blobs.pin(blob_hash)
+    try:
+        try:
+            data = await read()
+        except Exception:
+            if not await refetch_blob(blob_hash):
+                raise
+            data = await read()
+    finally:
+        fetched_blobs.unpin(blob_hash)
+    fetched_blobs.touch(blob_hash)
+    if blob_hash in fetched_blobs.oversized and blob_hash not in fetched_blobs.pins:
+        # Nothing else is reading it, it can go now
+        await evict_blobs(fetched_blobs.over_budget())
+    return data
+
+async def refetch_blob(blob_hash):
+    # Returns False if the blob didn't come from a peer, so there's nowhere to get it
+    pending = refetching.get(blob_hash)
+    if pending is None:
+        ticket = fetched_blobs.missing(blob_hash)
+        if ticket is None:
+            return False
+        log.debug("Fetching evicted blob again: %s", blob_hash)
+        pending = refetching[blob_hash] = asyncio.ensure_future(download_blob_ticket(ticket))
+        pending.add_done_callback(lambda _: refetching.pop(blob_hash, None))
+    await asyncio.shield(pending)
+    return True
+
+# Size a downloaded blob takes in the store, chunks included for collections
+async def fetched_blob_size(hash, blob_format):
+    if blob_format != iroh.BlobFormat.HASH_SEQ:
+        return await node.blobs().size(hash)
+    instrumentation.count_iroh_call("blobs.get_collection")
+    collection = await node.blobs().get_collection(hash)
+    sizes = await asyncio.gather(*(node.blobs().size(link.link) for link in collection.blobs()))
+    return sum(sizes)
+
+async def evict_blobs(blob_hashes):
+    for blob_hash in blob_hashes:
+        log.debug("Evicting blob: %s", blob_hash)
+        try:
+            await node.tags().delete(blob_cache_tag(blob_hash))
+        except Exception as e:
+            print(f"Error evicting blob '{blob_hash}': {str(e)}")
+
+# Open files pin their blob, so it isn't evicted from under a reader
+def pin_blob(blob_hash):
+    if fetched_blobs is not None:
+        fetched_blobs.pin(str(blob_hash))
+
+def unpin_blob(blob_hash):
+    if fetched_blobs is not None:
+        fetched_blobs.unpin(str(blob_hash))
+
+# Resolve the blob behind a FileDoc once, for reading ranges from it repeatedly
+async def open_blob_reader(file_doc_id):
+    blob_hash = await get_by_key(file_doc_id, "blob")
+    size = await get_by_key(file_doc_id, "size")
+    if blob_hash is None or size is None:
+        print("No blob found in file document: {}".format(file_doc_id))
+        return None
+    # Files written before chunking existed have no format key, they're all RAW
+    blob_format = await get_by_key(file_doc_id, "format")
+    return make_blob_reader(blob_hash, int(size), blob_format)
+
+def make_blob_reader(blob_hash, size, blob_format=BLOB_FORMAT_RAW):
+    if blob_format == BLOB_FORMAT_HASHSEQ:
+        return ChunkedBlobReader(blob_hash, size)
+    return BlobReader(blob_hash, size)
+
+# Store content as content-defined chunks tied together by a HashSeq collection.
+# Chunks are blobs in their own right, so unchanged chunks are shared between
+# versions and files. Each chunk is named after its offset in the file, so
+# readers can find the chunks covering a range without reading the others.
+async def add_chunked_blob(chunks):
+    links = []
+    await add_chunks(chunks, 0, links)
+    return await create_chunk_collection(links)
+
+# Add each chunk as a blob, appending (offset, hash) to links. Stops early once
+# resync(offset) is true for the offset after a chunk. Returns where it stopped
+async def add_chunks(chunks, offset, links, resync=None):
+    chunks = iter(chunks)
+    while True:
+        # Finding chunk boundaries scans every byte, so step the chunker in a
+        # worker thread rather than stalling the event loop FUSE runs on
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        links.append((offset, await add_blob_bytes(chunk)))
+        offset += len(chunk)
+        if resync is not None and resync(offset):
+            break
+    return offset
+
+async def create_chunk_collection(links):
+    collection = iroh.Collection()
+    for offset, chunk_hash in links:
+        collection.push("{:016x}".format(offset), chunk_hash)
+    instrumentation.count_iroh_call("blobs.create_collection")
+    hash_and_tag = await node.blobs().create_collection(collection, iroh.SetTagOption.auto(), [])
+    return hash_and_tag.hash
+
+async def setup_iroh_node(ticket=False, debug=False, doc_cache_size=1024, data_dir=None, sync_concurrency=32, blob_cache_size=0):
     global node
+    global fetched_blobs
+    global refetching
     global author
     global debug_mode
+    global doc_cache
+    global doc_listeners
+    global change_watches
+    global child_count_locks
+    global child_count_watched
+    global pending_recounts
+    global data_dir_path
+    global startup_timer
+    global ticket_registry
+    global sync_scheduler_queue
+    global change_pipeline
     # setup event loop, to ensure async callbacks work
     iroh.iroh_ffi.uniffi_set_event_loop(asyncio.get_running_loop())
 
     print("Starting Recurso Distributed File System")
+    startup_timer = StartupTimer()
 
     # set debug mode based on debug flag
     debug_mode = debug
 
-    # create iroh node
-    node = await iroh.Iroh.memory()
+    # Fresh handle cache for this node, handles from an old node are no good
+    doc_cache = DocumentCache(doc_cache_size)
+    doc_listeners = {}
+    change_watches = {}
+    child_count_locks = {}
+    child_count_watched = set()
+    pending_recounts = set()
+    # Set up by create_root_document, once we know our ticket doc
+    ticket_registry = None
+    # Joins and downloads from other nodes run in the background, a bounded number at a time
+    sync_scheduler_queue = sync_scheduler.SyncScheduler(sync_concurrency)
+    # One dispatcher hands every watched document's changes to its listeners
+    change_pipeline = watch_pipeline.WatchPipeline()
+    # Hit rates for .recurso/stats, looked up when the stats are rendered
+    instrumentation.register_cache("documents", lambda: (doc_cache.hits, doc_cache.misses))
+    instrumentation.register_cache("tickets", lambda: (ticket_registry.hits, ticket_registry.generated))
+    instrumentation.register_cache("decoded_tickets", lambda: (decode_ticket.cache_hits, decode_ticket.cache_misses))
+    # Blobs fetched from other nodes, kept within blob_cache_size bytes. 0 keeps them all
+    fetched_blobs = blob_cache.BlobCache(blob_cache_size) if blob_cache_size else None
+    refetching = {}
+    instrumentation.register_cache("blobs", lambda: (fetched_blobs.hits, fetched_blobs.misses))
+    instrumentation.register_counter("blob_evictions", lambda: fetched_blobs.evictions)
+    instrumentation.register_counter("blob_evicted_bytes", lambda: fetched_blobs.evicted_bytes)
+
+    # create iroh node, on disk if we were given somewhere to keep it
+    data_dir_path = data_dir
+    with startup_timer.phase("node"):
+        # Evicted blobs are only freed by garbage collection, so turn it on for the blob cache
+        options = iroh.NodeOptions(gc_interval_millis=BLOB_GC_INTERVAL_MILLIS) if fetched_blobs is not None else None
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            if options is not None:
+                node = await iroh.Iroh.persistent_with_options(os.path.join(data_dir, "iroh"), options)
+            else:
+                node = await iroh.Iroh.persistent(os.path.join(data_dir, "iroh"))
+            print("Using persistent store in: {}".format(data_dir))
+        elif options is not None:
+            node = await iroh.Iroh.memory_with_options(options)
+        else:
+            node = await iroh.Iroh.memory()
     node_id = await node.net().node_id()
     print("Started Iroh node: {}".format(node_id))
 
@@ -537,169 +1205,267 @@ async def setup_iroh_node(ticket=False, debug=False):
     if debug_mode:
         print(f"Default author: {author}")
 
-async def gossip_loop(ticket, gossip_topic):
-    global node
-    # We're going to keep track of which nodes are connected to our gossip loop
-    gossip_nodes = []
-
-    # If we've been given a ticket, grab the node ID and add it to the connected nodes list
+async def start_control_channel(node, ticket, gossip_topic, join_ticket):
+    # Connect to the nodes in the ticket we joined with, if any, and start
+    # listening for control messages on the gossip topic
+    bootstrap = []
     if ticket:
-        # Decode the ticket's node ID
-        ticket_decoded = decode_ticket.decode_iroh_ticket(ticket)
-        # List the nodes
-        initial_gossip_nodes = ticket_decoded.nodes
-        # Add the NodeAddr objects to the connected nodes list
-        gossip_nodes.extend(initial_gossip_nodes)
-        # Print out the initial nodes we'll connect to
-        print("Nodes to connect to: {}".format(
-            [gossip_node.node_id for gossip_node in gossip_nodes]
-        ))
-
-        for gossip_node in gossip_nodes:
-            public_key = iroh.PublicKey.from_string(gossip_node.node_id)
-            derp_url = gossip_node.info.derp_url
-            addresses = gossip_node.info.direct_addresses
+        for gossip_node in decode_ticket.decode_iroh_ticket(ticket).nodes:
             node_addr = iroh.NodeAddr(
-                node_id=public_key,
-                derp_url=derp_url,  # This is optional, you can pass None if not needed
-                addresses=addresses
+                node_id=iroh.PublicKey.from_string(gossip_node.node_id),
+                derp_url=gossip_node.info.derp_url,  # This is optional, you can pass None if not needed
+                addresses=list(gossip_node.info.direct_addresses)
             )
             await node.net().add_node_addr(node_addr)
+            bootstrap.append(gossip_node.node_id)
             print("We connected to node {}".format(gossip_node.node_id))
-        # Subscribe to the gossip topic
-        my_node_id = await node.net().node_id()
-        cb0 = GossipCallback(my_node_id)
-        print("Subscribing to gossip topic: {} as node {}".format(gossip_topic, my_node_id))
-        sink0 = await node.gossip().subscribe(gossip_topic, [gossip_node.node_id], cb0)
-
-    # If we haven't been given a ticket, we're just going to listen for control messages
     else:
         print("Listening for control messages")
-        cb0 = GossipCallback(node.net().node_id())
-        # Convert gossip topic to base64 so that we can display it
-        translated_gossip_topic = base64.b64encode(gossip_topic)
-        print("Subscribing to gossip topic: {} as node {}".format(translated_gossip_topic, await node.net().node_id()))
-        sink0 = await node.gossip().subscribe(gossip_topic, [await node.net().node_id()], cb0)
+        bootstrap.append(await node.net().node_id())
+    channel = ControlChannel(node, gossip_topic, join_ticket)
+    await channel.start(bootstrap)
+    return channel
 
-    while True:
-        event = await cb0.chan.get()
-        if debug_mode:
-            print("<<", event.type())
-        if (event.type() == iroh.MessageType.JOINED):
-            if debug_mode:
-                print(">>", event.type())
-             # Broadcast message from whichever nodes did not join
-            msg_content = '{{"msg": "Hello, join me!", "node_id": "{}", "join_ticket": "{}"}}'.format(
-                await node.net().node_id(), read_only_ticket
-            )
-            msg_content = bytearray(msg_content.encode("utf-8"))
-
-            await sink0.broadcast(msg_content)
-        elif (event.type() == iroh.MessageType.RECEIVED):
-            # We received a message, let's read it
-            message = event.as_received().content.decode("utf-8")
-            # Load the message as a JSON object
-            message = json.loads(message)
-            if message["msg"] == "Hello, join me!": 
-                # Notify the user that a node gave us an offer to join
-                print("Node {} joined and asked us to sync from them.".format(message["node_id"]))
-                await asyncio.to_thread(await sync_from_node(node, message["join_ticket"]))
-                print("Spawned a thread and continued")
-        await asyncio.sleep(1)
-
-async def watch_document(node, doc, event_queue):
-    while True:
-        try:
-            print("Watching document: " + doc.id())
-            update = await event_queue.get()
-            print("Update: {}".format(update))
-            await process_document_update(node, doc, update)
-        except asyncio.CancelledError:
-            # Handle cancellation if needed
-            break
-        except Exception as e:
-            print(f"Error processing update: {e}")
-            # Optionally, add a small delay before continuing
-            await asyncio.sleep(0.1)
-
-async def process_document_update(node, doc, update):
-    if update.type() == iroh.WatchEventType.INSERT:
-        content = await update.content_bytes(doc)
-        print(update.key())
-        print("TRIGGERED")
-        if update.key() == b"join_ticket":
-            new_ticket = content.decode()
-            await join_and_watch_document(node, iroh.DocTicket(new_ticket))
+async def process_document_update(node, doc, entry):
+    if entry.key() == b"join_ticket":
+        content = await entry.content_bytes(doc)
+        await join_and_watch_document(node, content.decode())
 
 async def sync_from_node(node, read_only_ticket):
-    # Read document once, then watch it in a separate thread
+    # Join a peer's ticket document, act on what's in it, then keep following it
     remote_node_id = decode_ticket.decode_iroh_ticket(read_only_ticket).nodes[0].node_id
     print("Syncing {}".format(read_only_ticket) + " from node: {}".format(remote_node_id))
-    remote_tickets_doc = await node.docs().join(iroh.DocTicket(read_only_ticket))
+    remote_tickets_doc = await join_and_wait_for_sync(read_only_ticket)
     print("Opened remote tickets document")
-    await asyncio.sleep(1)
     if remote_tickets_doc:
-        first_tickets = await get_all_keys_by_prefix(remote_tickets_doc, "inode_")
-        # Iterate over children, respecting the start_id
-        for i, entry in enumerate(first_tickets):
-            # Print the key
-            # Load the ticket
-            ticket_data = await entry.content_bytes(remote_tickets_doc)
-            ticket_data = ticket_data.decode()
-            print("iteration: {}".format(i))
-            # If the ticket is for a blob, join it and watch it
-            if b"_blob" in entry.key():
-                print("Syncing blob ticket")
-                decoded_ticket = decode_ticket.decode_iroh_ticket(ticket_data)
-                # We should consider downloading the blob here
-                always_download_blobs = True
-                if always_download_blobs:
-                    cb = AddCallback()
-                    nodeaddr = iroh.NodeAddr(iroh.PublicKey.from_string(decoded_ticket.node.node_id), decoded_ticket.node.info.derp_url, decoded_ticket.node.info.direct_addresses)
-                    hash = iroh.Hash.from_string(decoded_ticket.hash)
-                    opts = iroh.BlobDownloadOptions(iroh.BlobFormat.RAW, [nodeaddr], iroh.SetTagOption.auto())
-                    blob = await node.blobs().download(hash, opts, cb)
-            elif b"inode_" in entry.key():
-                # It's a document. Let's sync and follow it in a separate thread
-                print("Syncing document ticket")
-                result = asyncio.to_thread(join_and_watch_document(node, ticket_data))
-                print(result)
-            else:
-                # This should never fire.
-                print("Unknown ticket type")
+        remote_tickets_doc_id = remote_tickets_doc.id()
+        if ticket_registry is not None:
+            ticket_registry.remote_ticket_docs.add(remote_tickets_doc_id)
+        # Subscribe first so nothing the peer adds while we scan is missed
+        await watch_document_changes(
+            remote_tickets_doc_id,
+            lambda doc_id, entry: handle_remote_ticket(remote_tickets_doc, entry),
+            remote_only=True,
+        )
+        entries = await get_all_keys(remote_tickets_doc)
+        for entry in entries:
+            await handle_remote_ticket(remote_tickets_doc, entry)
+
+# Act on one entry of a peer's ticket document
+async def handle_remote_ticket(remote_tickets_doc, entry):
+    key = entry.key()
+    # Empty entries are deletions, such as requests that have been answered
+    if entry.content_len() == 0:
+        return
+    try:
+        content = (await entry.content_bytes(remote_tickets_doc)).decode()
+        if key == TICKET_REGISTRY_KEY.encode():
+            # The peer's inode map, which maps every inode to its document ID
+            print("Syncing ticket registry")
+            await sync_scheduler_queue.submit(TICKET_REGISTRY_KEY, lambda: join_ticket(content), sync_scheduler.PRIORITY_METADATA)
+        elif key.startswith(TICKET_REQUEST_PREFIX.encode()):
+            # The peer wants a document, publish tickets for it if we have it
+            if ticket_registry is not None:
+                await ticket_registry.publish(key[len(TICKET_REQUEST_PREFIX):].decode())
+        elif key.startswith(b"inode_"):
+            await schedule_ticket_sync(key, content)
+    except Exception as e:
+        print(f"Error handling remote ticket '{key}': {str(e)}")
 
-        # Now we're going to watch the document for any new tickets
-        remote_tickets_doc, event_queue = await join_and_watch_document(node, read_only_ticket)
-        # Now we watch the document for any new tickets
-        print("Watching document for new tickets")
-        while True:
-            update = await event_queue.get()
-            print(update)
-            if update.type() == iroh.WatchEventType.INSERT:
-                print("Found new ticket in document: {}".format(update.cont))
-                content = await update.content_bytes(remote_tickets_doc)
-                new_ticket = content.decode()
-                print("New ticket: {}".format(new_ticket))
-                # We got a new ticket. Let's sync from it
-                await asyncio.to_thread(await sync_from_node(node, new_ticket))
+# Queue the join or download behind a published ticket, most urgent first
+async def schedule_ticket_sync(keyname, ticket):
+    parsed = parse_ticket_key(keyname)
+    if parsed is None:
+        log.debug("Ignoring ticket under unknown key %s", keyname)
+        return None
+    doc_id, suffix = parsed
+    size = 0
+    accessed = None
+    if suffix == "_blob":
+        priority = sync_scheduler.PRIORITY_BLOB
+        size = await local_file_size(doc_id)
+        sync = lambda: download_blob_ticket(ticket)
+    else:
+        priority = sync_scheduler.PRIORITY_METADATA if suffix == "_metadata" else sync_scheduler.PRIORITY_DOCUMENT
+        sync = lambda: join_ticket(ticket)
+    if ticket_registry is not None and ticket_registry.pending:
+        # We asked for this document, so something is waiting on it
+        if doc_id in ticket_registry.pending:
+            priority = sync_scheduler.PRIORITY_WANTED
+            accessed = time.time()
+    # Keyed the same way whether the key arrived as bytes or str, so bump() finds it
+    return await sync_scheduler_queue.submit(ticket_key(doc_id, suffix), sync, priority, size=size, accessed=accessed)
+
+# Size of a file whose document we already have, so small blobs can go first
+async def local_file_size(file_doc_id):
+    doc = await open_local_document(file_doc_id)
+    if doc is None:
+        return 0
+    instrumentation.count_iroh_call("doc.get_exact")
+    entry = await doc.get_exact(author, b"size", False)
+    if entry is None:
+        return 0
+    instrumentation.count_iroh_call("entry.content_bytes")
+    return int((await entry.content_bytes(doc)).decode())
+
+# Join a document from a ticket, and wake anyone waiting on it
+async def join_ticket(ticket):
+    doc = await node.docs().join(iroh.DocTicket(ticket))
+    doc_cache.put(doc.id(), doc)
+    if ticket_registry is not None:
+        ticket_registry.joined(doc.id())
+    return doc
+
+async def download_blob_ticket(ticket):
+    decoded_ticket = decode_ticket.decode_iroh_ticket(ticket)
+    cb = AddCallback()
+    nodeaddr = iroh.NodeAddr(iroh.PublicKey.from_string(decoded_ticket.node.node_id), decoded_ticket.node.info.derp_url, list(decoded_ticket.node.info.direct_addresses))
+    hash = iroh.Hash.from_string(decoded_ticket.hash)
+    # Chunked files are HashSeq collections, downloading one fetches its chunks too
+    if decoded_ticket.format == decode_ticket.BlobFormat.HASH_SEQ:
+        blob_format = iroh.BlobFormat.HASH_SEQ
+    else:
+        blob_format = iroh.BlobFormat.RAW
+    if fetched_blobs is None:
+        opts = iroh.BlobDownloadOptions(blob_format, [nodeaddr], iroh.SetTagOption.auto())
+        await node.blobs().download(hash, opts, cb)
+        return
+    # Tagged so the blob cache can let go of it again
+    opts = iroh.BlobDownloadOptions(blob_format, [nodeaddr], iroh.SetTagOption.named(blob_cache_tag(decoded_ticket.hash)))
+    await node.blobs().download(hash, opts, cb)
+    size = await fetched_blob_size(hash, blob_format)
+    await evict_blobs(fetched_blobs.add(decoded_ticket.hash, size, ticket))
 
 async def join_and_watch_document(node, ticket):
     try:
-        event_queue = queue.Queue()
-        # Convert the ticket to a DocTicket
-        ticket = iroh.DocTicket(ticket)
-        doc = await node.docs().join(ticket)
-        callback = DocWatch(event_queue)
-        await doc.subscribe(callback)
-        asyncio.create_task(watch_document(node, doc, event_queue))
+        doc = await join_ticket(ticket)
+        await watch_document_changes(doc.id(), lambda doc_id, entry: process_document_update(node, doc, entry))
         print("Joined and watched document.")
-        return doc, event_queue
+        return doc
     except Exception as e:
         print(f"Failed to join document: {e}")
-        return None, None
+        return None
 # Classes
 
 # GossipMessage
+# Sends and receives control messages for one node on one gossip topic.
+# Messages queued while a frame is going out are sent together in the next one,
+# and we only sync from a peer once for each ticket it offers.
+class ControlChannel:
+    def __init__(self, node, gossip_topic, join_ticket, on_join_offer=None):
+        self.node = node
+        self.gossip_topic = gossip_topic
+        self.join_ticket = str(join_ticket)
+        # Called with each new JoinOffer, syncs from the offering node by default
+        self.on_join_offer = on_join_offer or self.sync_from_offer
+        self.node_id = None
+        self.sink = None
+        self.outbox = OrderedDict()
+        self.outbox_ready = asyncio.Event()
+        # node_id -> the last ticket we acted on from it
+        self.offers_seen = {}
+        self.tasks = []
+        self.frames_sent = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.duplicate_offers = 0
+        self.bad_frames = 0
+        # Seconds from receiving a join offer to having synced the offering node's tickets
+        self.sync_latencies = []
+
+    async def start(self, bootstrap):
+        self.node_id = str(await self.node.net().node_id())
+        callback = GossipCallback(self.node_id)
+        print("Subscribing to gossip topic: {} as node {}".format(base64.b64encode(self.gossip_topic), self.node_id))
+        self.sink = await self.node.gossip().subscribe(self.gossip_topic, bootstrap, callback)
+        self.tasks = [asyncio.create_task(self.receive(callback)), asyncio.create_task(self.flush())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def send(self, message):
+        # Queue a message for the next frame, a message that's already queued isn't sent twice
+        self.outbox[message] = None
+        self.outbox_ready.set()
+
+    def offer_join(self):
+        self.send(control_codec.JoinOffer(self.node_id, self.join_ticket))
+
+    async def flush(self):
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            messages = list(self.outbox)
+            self.outbox.clear()
+            for start in range(0, len(messages), control_codec.MAX_MESSAGES):
+                batch = messages[start:start + control_codec.MAX_MESSAGES]
+                try:
+                    await self.sink.broadcast(control_codec.encode_frame(batch))
+                except Exception as e:
+                    print(f"Error broadcasting control messages: {str(e)}")
+                    continue
+                self.frames_sent += 1
+                self.messages_sent += len(batch)
+
+    async def receive(self, callback):
+        while True:
+            event = await callback.chan.get()
+            if debug_mode:
+                print("<<", event.type())
+            if event.type() in (iroh.MessageType.JOINED, iroh.MessageType.NEIGHBOR_UP):
+                # Someone new is listening, tell them where our tickets are
+                self.offer_join()
+            elif event.type() == iroh.MessageType.RECEIVED:
+                try:
+                    messages = control_codec.decode_frame(event.as_received().content)
+                except (ValueError, struct.error) as e:
+                    self.bad_frames += 1
+                    print(f"Ignoring control frame: {str(e)}")
+                    continue
+                for message in messages:
+                    self.messages_received += 1
+                    if isinstance(message, control_codec.JoinOffer):
+                        self.handle_join_offer(message)
+
+    def handle_join_offer(self, offer):
+        if offer.node_id == self.node_id:
+            return
+        if self.offers_seen.get(offer.node_id) == offer.ticket:
+            self.duplicate_offers += 1
+            return
+        self.offers_seen[offer.node_id] = offer.ticket
+        print("Node {} asked us to sync from them.".format(offer.node_id))
+        result = self.on_join_offer(offer)
+        if asyncio.iscoroutine(result):
+            asyncio.create_task(self.timed(offer, result))
+
+    async def timed(self, offer, sync):
+        start = time.monotonic()
+        try:
+            await sync
+        except Exception as e:
+            print(f"Error syncing from join offer: {str(e)}")
+            # Forget the offer, so the peer's next offer of the same ticket is tried again
+            if self.offers_seen.get(offer.node_id) == offer.ticket:
+                del self.offers_seen[offer.node_id]
+            return
+        self.sync_latencies.append(time.monotonic() - start)
+
+    async def sync_from_offer(self, offer):
+        await sync_from_node(self.node, offer.ticket)
+
+    def stats(self):
+        return {
+            "frames_sent": self.frames_sent,
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "duplicate_offers": self.duplicate_offers,
+            "bad_frames": self.bad_frames,
+            "peers": len(self.offers_seen),
+        }
+
 class GossipCallback(iroh.GossipMessageCallback):
     def __init__(self, name):
         # Initialisation
@@ -713,6 +1479,384 @@ class GossipCallback(iroh.GossipMessageCallback):
             print(self.name, msg.type())
         await self.chan.put(msg)
 
+# Metadata documents store every stat field in one fixed-layout record (v1):
+# schema version, st_mode, st_ino, st_uid, st_gid, st_size, st_atime, st_mtime, st_ctime
+METADATA_VERSION = "v1"
+METADATA_RECORD_KEY = b"stat"
+METADATA_RECORD = struct.Struct("<BIQIIQqqq")
+
+# Stat fields for a single inode, as read from a metadata document
+# Fields that aren't present in the document are left as None
+class Metadata:
+    __slots__ = ("st_mode", "st_ino", "st_uid", "st_gid", "st_size", "st_atime", "st_mtime", "st_ctime")
+
+    def __init__(self, st_mode=None, st_ino=None, st_uid=None, st_gid=None,
+                 st_size=None, st_atime=None, st_mtime=None, st_ctime=None):
+        self.st_mode = st_mode
+        self.st_ino = st_ino
+        self.st_uid = st_uid
+        self.st_gid = st_gid
+        self.st_size = st_size
+        self.st_atime = st_atime
+        self.st_mtime = st_mtime
+        self.st_ctime = st_ctime
+
+    def pack(self):
+        return METADATA_RECORD.pack(1, self.st_mode or 0, self.st_ino or 0, self.st_uid or 0, self.st_gid or 0,
+                                    self.st_size or 0, self.st_atime or 0, self.st_mtime or 0, self.st_ctime or 0)
+
+    @classmethod
+    def unpack(cls, data):
+        if data[0] != 1:
+            raise ValueError("Unknown metadata record version: {}".format(data[0]))
+        return cls(*METADATA_RECORD.unpack(data)[1:])
+
+    def __repr__(self):
+        fields = ", ".join("{}={}".format(name, getattr(self, name)) for name in self.__slots__)
+        return "Metadata({})".format(fields)
+
+# Reads ranges of a single blob, with the hash parsed and the size known up front
+class BlobReader:
+    def __init__(self, blob_hash, size):
+        self.hash = iroh.Hash.from_string(str(blob_hash))
+        self.size = size
+
+    async def read(self, offset, length):
+        if offset >= self.size:
+            return b""
+        length = min(length, self.size - offset)
+        async def read():
+            instrumentation.count_iroh_call("blobs.read_at")
+            return await node.blobs().read_at_to_bytes(self.hash, offset, iroh.ReadAtLen.exact(length))
+        return await read_fetched_blob(self.hash, read)
+
+# Reads ranges of a chunked (HashSeq) file, touching only the chunks that cover the range
+class ChunkedBlobReader:
+    def __init__(self, blob_hash, size):
+        self.hash = iroh.Hash.from_string(str(blob_hash))
+        self.size = size
+        # Chunk start offsets and hashes, loaded from the collection on first read
+        self.offsets = None
+        self.hashes = None
+
+    async def load_chunks(self):
+        instrumentation.count_iroh_call("blobs.get_collection")
+        collection = await node.blobs().get_collection(self.hash)
+        # Names are zero-padded hex offsets, so they sort in file order
+        links = sorted(collection.blobs(), key=lambda link: link.name)
+        self.offsets = [int(link.name, 16) for link in links]
+        self.hashes = [link.link for link in links]
+
+    async def read(self, offset, length):
+        if offset >= self.size:
+            return b""
+        # The blob cache tracks the collection, its chunks come and go with it
+        return await read_fetched_blob(self.hash, lambda: self.read_chunks(offset, length))
+
+    async def read_chunks(self, offset, length):
+        if self.offsets is None:
+            await self.load_chunks()
+        end = offset + min(length, self.size - offset)
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        parts = []
+        while offset < end:
+            chunk_end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+            take = min(end, chunk_end) - offset
+            instrumentation.count_iroh_call("blobs.read_at")
+            parts.append(await node.blobs().read_at_to_bytes(self.hashes[i], offset - self.offsets[i], iroh.ReadAtLen.exact(take)))
+            offset += take
+            i += 1
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+# One child of a directory. inode (and doc_id, for entries that arrived
+# before their content) are filled in lazily by whoever needs them.
+class DirEntry:
+    __slots__ = ("type", "doc_id", "inode")
+
+    def __init__(self, type, doc_id, inode=None):
+        self.type = type
+        self.doc_id = doc_id
+        self.inode = inode
+
+# Name -> DirEntry for one directory, mirroring its children document
+class DirectoryIndex:
+    def __init__(self, children_doc_id):
+        self.children_doc_id = children_doc_id
+        self.entries = {}
+
+    async def apply_change(self, doc_id, entry):
+        inode_type, name = await decode_filename(entry.key().decode("utf-8"))
+        if inode_type is None:
+            return
+        if entry.content_len() == 0:
+            # Empty entries are deletions
+            dirent = self.entries.get(name)
+            if dirent is not None and dirent.type == inode_type:
+                del self.entries[name]
+            return
+        try:
+            doc = await open_document(doc_id)
+            child_doc_id = (await entry.content_bytes(doc)).decode("utf-8")
+        except Exception:
+            # Remote content may not have arrived yet, lookup will fetch it
+            child_doc_id = None
+        self.entries[name] = DirEntry(inode_type, child_doc_id)
+
+# Pending writes to one file. Kept in memory until they pass spill_threshold bytes,
+# then moved to a temp file, and turned into a single new blob by commit().
+# Files of at least chunk_threshold bytes are committed as chunked HashSeq blobs.
+class WriteBuffer:
+    def __init__(self, spill_threshold=64 * 1024 * 1024, spill_dir=None, chunk_threshold=None):
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.chunk_threshold = chunk_threshold
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+        self.dirty = False
+        # Range written or truncated since the last load or commit
+        self.dirty_start = None
+        self.dirty_end = 0
+        # Chunk offsets and hashes of the content as of the last load or commit,
+        # if it was chunked. Commits only re-chunk around what's changed since
+        self.chunk_offsets = None
+        self.chunk_hashes = None
+
+    async def load(self, reader, chunk_size=4 * 1024 * 1024):
+        # Start from the existing content of a file
+        for offset in range(0, reader.size, chunk_size):
+            self.write(offset, await reader.read(offset, chunk_size))
+        if isinstance(reader, ChunkedBlobReader):
+            if reader.offsets is None:
+                await reader.load_chunks()
+            self.chunk_offsets = list(reader.offsets)
+            self.chunk_hashes = list(reader.hashes)
+        self.dirty = False
+        self.dirty_start = None
+        self.dirty_end = 0
+
+    def mark_dirty(self, start, end):
+        self.dirty = True
+        self.dirty_start = start if self.dirty_start is None else min(self.dirty_start, start)
+        self.dirty_end = max(self.dirty_end, end)
+
+    def spill(self):
+        self.file = tempfile.NamedTemporaryFile(prefix="recurso-write-", dir=self.spill_dir)
+        self.file.write(self.data)
+        self.data = bytearray()
+
+    def write(self, offset, buf):
+        end = offset + len(buf)
+        if self.file is None and end > self.spill_threshold:
+            self.spill()
+        if self.file is None:
+            # Fill any hole with zeroes, then overwrite in place
+            if offset > len(self.data):
+                self.data.extend(bytes(offset - len(self.data)))
+            self.data[offset:end] = buf
+        else:
+            self.file.seek(offset)
+            self.file.write(buf)
+        # Zeroes filling a hole count as written too
+        self.mark_dirty(min(offset, self.size), end)
+        self.size = max(self.size, end)
+        return len(buf)
+
+    def read(self, offset, length):
+        length = max(min(length, self.size - offset), 0)
+        if self.file is None:
+            return bytes(memoryview(self.data)[offset:offset + length])
+        self.file.flush()
+        return os.pread(self.file.fileno(), length, offset)
+
+    def truncate(self, size):
+        if self.file is None and size > self.spill_threshold:
+            self.spill()
+        if self.file is None:
+            if size < len(self.data):
+                del self.data[size:]
+            else:
+                self.data.extend(bytes(size - len(self.data)))
+        else:
+            self.file.truncate(size)
+        self.mark_dirty(min(size, self.size), max(size, self.size))
+        self.size = size
+
+    async def commit(self):
+        # Returns the new blob's hash, its size and its format
+        blob_format = BLOB_FORMAT_RAW
+        if self.chunk_threshold and self.size >= self.chunk_threshold:
+            blob_format = BLOB_FORMAT_HASHSEQ
+            blob_hash = await self.commit_chunks()
+        else:
+            self.chunk_offsets = None
+            self.chunk_hashes = None
+            if self.file is None:
+                blob_hash = await add_blob_bytes(self.data)
+            else:
+                self.file.flush()
+                blob_hash = await add_blob_from_path(self.file.name)
+        self.dirty = False
+        self.dirty_start = None
+        self.dirty_end = 0
+        return blob_hash, self.size, blob_format
+
+    async def commit_chunks(self):
+        # A cut point only depends on the content since the previous cut, so the chunks
+        # that end before the first change would come out the same and are kept as
+        # they are. Chunking resumes from the last of their boundaries, and once a new
+        # cut lands on an old boundary past the last change, the rest are kept too
+        old_offsets = self.chunk_offsets or []
+        old_hashes = self.chunk_hashes or []
+        dirty_start = self.size if self.dirty_start is None else self.dirty_start
+        kept = max(bisect.bisect_right(old_offsets, dirty_start) - 1, 0)
+        links = list(zip(old_offsets[:kept], old_hashes[:kept]))
+        start = old_offsets[kept] if old_offsets else 0
+        old_index = {offset: i for i, offset in enumerate(old_offsets) if offset >= self.dirty_end}
+
+        if self.file is None:
+            chunks = file_chunker.chunks(memoryview(self.data)[start:])
+        else:
+            self.file.flush()
+            self.file.seek(start)
+            chunks = file_chunker.chunks_from_file(self.file)
+        offset = await add_chunks(chunks, start, links, lambda offset: offset in old_index)
+        if offset < self.size:
+            i = old_index[offset]
+            links.extend(zip(old_offsets[i:], old_hashes[i:]))
+
+        self.chunk_offsets = [offset for offset, _ in links]
+        self.chunk_hashes = [chunk_hash for _, chunk_hash in links]
+        return await create_chunk_collection(links)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.data = bytearray()
+
+# Bounded LRU of open document handles, keyed by doc ID
+class DocumentCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.docs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id):
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            self.misses += 1
+            return None
+        # Mark as most recently used
+        self.docs.move_to_end(doc_id)
+        self.hits += 1
+        return doc
+
+    def put(self, doc_id, doc):
+        self.docs[doc_id] = doc
+        self.docs.move_to_end(doc_id)
+        # Drop the least recently used handles once we're over the limit
+        while len(self.docs) > self.max_size:
+            self.docs.popitem(last=False)
+
+    def evict(self, doc_id):
+        self.docs.pop(doc_id, None)
+
+    def stats(self):
+        return {"size": len(self.docs), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+# Hands out share tickets on demand, rather than sharing every document as it is created.
+# A peer that needs a document writes a request into its own ticket document, and
+# whichever node has the document publishes tickets for it into its ticket document.
+# Derived tickets are kept in a bounded LRU, keyed by doc ID.
+class TicketRegistry:
+    def __init__(self, ticket_doc_id, max_size=4096):
+        self.ticket_doc_id = ticket_doc_id
+        self.max_size = max_size
+        self.tickets = OrderedDict()
+        # Documents we've asked peers for, set once we've joined them
+        self.pending = {}
+        # Ticket documents of the peers we sync with
+        self.remote_ticket_docs = set()
+        self.generated = 0
+        self.hits = 0
+
+    async def tickets_for_document(self, doc_id):
+        # Tickets for a document and the documents and blob hanging off it, by key suffix
+        tickets = self.tickets.get(doc_id)
+        if tickets is not None:
+            self.tickets.move_to_end(doc_id)
+            self.hits += 1
+            return tickets
+        # Don't go through open_document, that would ask our peers for documents we don't have
+        instrumentation.count_iroh_call("docs.open")
+        doc = await node.docs().open(doc_id)
+        if doc is None:
+            return {}
+        metadata_doc_id, children_doc_id, blob_hash, blob_format = await asyncio.gather(
+            get_by_key(doc_id, "metadata"),
+            get_by_key(doc_id, "children"),
+            get_by_key(doc_id, "blob"),
+            get_by_key(doc_id, "format"),
+        )
+        shares = {"-": share_document(doc)}
+        for suffix, linked_doc_id in (("_metadata", metadata_doc_id), ("_children", children_doc_id)):
+            linked_doc = await node.docs().open(linked_doc_id) if linked_doc_id else None
+            if linked_doc is not None:
+                shares[suffix] = share_document(linked_doc)
+        if blob_hash:
+            shares["_blob"] = share_blob(blob_hash, blob_format or BLOB_FORMAT_RAW)
+        tickets = dict(zip(shares, await asyncio.gather(*shares.values())))
+        self.generated += 1
+        self.tickets[doc_id] = tickets
+        while len(self.tickets) > self.max_size:
+            self.tickets.popitem(last=False)
+        return tickets
+
+    async def publish(self, doc_id):
+        # Returns False if we don't have the document
+        tickets = await self.tickets_for_document(doc_id)
+        if not tickets:
+            return False
+        batch = WriteBatch()
+        for suffix, ticket in tickets.items():
+            batch.set(self.ticket_doc_id, ticket_key(doc_id, suffix), ticket)
+        await batch.commit()
+        return True
+
+    async def request(self, doc_id, timeout=10):
+        # Ask our peers for a document and wait until we've joined it
+        event = self.pending.get(doc_id)
+        if event is None:
+            event = self.pending[doc_id] = asyncio.Event()
+            # If its ticket is already queued behind others, move it to the front
+            await sync_scheduler_queue.bump(ticket_key(doc_id, "-"))
+            await set_by_key(self.ticket_doc_id, TICKET_REQUEST_PREFIX + doc_id, bytes(str(time.time()), "utf-8"))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("No peer answered our request for document {} within {}s".format(doc_id, timeout))
+            return None
+        finally:
+            if self.pending.pop(doc_id, None) is not None:
+                # Answered or given up on, either way the request can go
+                await delete_key(self.ticket_doc_id, TICKET_REQUEST_PREFIX + doc_id)
+        return await node.docs().open(doc_id)
+
+    def joined(self, doc_id):
+        event = self.pending.get(doc_id)
+        if event is not None:
+            event.set()
+
+    def invalidate(self, doc_id):
+        self.tickets.pop(doc_id, None)
+
+    def stats(self):
+        return {"size": len(self.tickets), "max_size": self.max_size, "generated": self.generated, "hits": self.hits}
+
 # Add callback for when we get a hash back from iroh
 class AddCallback:
     hash = None
@@ -732,43 +1876,62 @@ class AddCallback:
             abort_event = progress_event.as_abort()
             raise Exception(abort_event.error)
 
-class DocWatch:
-    def __init__(self, queue):
-        self.queue = queue
+# Fires once a joined document has finished syncing with one of the given peers,
+# or once all the content from a sync has arrived
+class SyncWaiter:
+    def __init__(self, peers):
+        self.peers = set(str(peer) for peer in peers)
+        self.synced = asyncio.Event()
+
+    async def event(self, e):
+        t = e.type()
+        if t == iroh.LiveEventType.SYNC_FINISHED:
+            peer = str(e.as_sync_finished().peer)
+            if debug_mode:
+                print(f"Live Event - SyncFinished: synced peer: {peer}")
+            if not self.peers or peer in self.peers:
+                self.synced.set()
+        elif t == iroh.LiveEventType.PENDING_CONTENT_READY:
+            self.synced.set()
+
+# Times each startup phase, so we can see where time-to-first-mount goes
+class StartupTimer:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            # Phases can run more than once (e.g. several joins), so add them up
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    def report(self):
+        print("Startup timing:")
+        for name, seconds in self.phases.items():
+            print("  {:<8} {:8.3f}s".format(name, seconds))
+        print("  {:<8} {:8.3f}s".format("total", time.monotonic() - self.started))
+
+# Queues local and remote inserts for the listeners registered with watch_document_changes.
+# Inserts to the same key coalesce while queued, and a full queue holds up the subscription.
+class ChangeWatch:
+    def __init__(self, doc_id):
+        self.doc_id = doc_id
 
     async def event(self, e):
         t = e.type()
         if t == iroh.LiveEventType.INSERT_LOCAL:
             entry = e.as_insert_local()
-            print(f"LiveEvent - InsertLocal: entry hash {entry.content_hash()}")
-            self.queue.put(True)
+            remote = False
         elif t == iroh.LiveEventType.INSERT_REMOTE:
-            insert_remove_event = e.as_insert_remote()
-            if debug_mode:
-                print(f"LiveEvent - InsertRemote:\n\tentry hash:\n\t{insert_remove_event.entry.content_hash()}\n\tcontent_status: {insert_remove_event.content_status}")
-                print("Insert Remove events will be eventually followed by the ContentReady event")
-        elif t == iroh.LiveEventType.CONTENT_READY:
-            hash_val = e.as_content_ready()
-            if debug_mode:
-                print(f"LiveEvent - ContentReady: hash {hash_val}")
-        elif t == iroh.LiveEventType.NEIGHBOR_UP:
-            node_id = e.as_neighbor_up()
-            if debug_mode:
-                print(f"LiveEvent - NeighborUp: node id {node_id}")
-        elif t == iroh.LiveEventType.NEIGHBOR_DOWN:
-            node_id = e.as_neighbor_down()
-            if debug_mode:
-                print(f"LiveEvent - NeighborDown: node id {node_id}")
-        elif t == iroh.LiveEventType.SYNC_FINISHED:
-            sync_event = e.as_sync_finished()
-            if debug_mode:
-                print(f"Live Event - SyncFinished: synced peer: {sync_event.peer}")
-        elif t == iroh.LiveEventType.PENDING_CONTENT_READY:
-            if debug_mode:
-                print(f"Live Event - PendingContentReady")
+            entry = e.as_insert_remote().entry
+            remote = True
         else:
-            if debug_mode:
-                print("Event type was: {}".format(t))
+            return
+        await change_pipeline.put(self.doc_id, (remote, entry.key()), (entry, remote))
 
 async def main():
     global node
@@ -777,6 +1940,7 @@ async def main():
     global inode_map_doc_id
     global gossip_topic
     global read_only_ticket
+    global control_channel
     # set initial var states
     debug_mode = False
     ticket = False
@@ -785,17 +1949,22 @@ async def main():
     parser = argparse.ArgumentParser(description='Recurso Demo')
     parser.add_argument('--ticket', type=str, help='ticket to join a root document')
     parser.add_argument('--debug', action='store_true', help='enable debug mode')
+    parser.add_argument('--doc-cache-size', type=int, default=1024, help='number of open document handles to keep cached')
+    parser.add_argument('--data-dir', type=str, default=None, help='keep blobs and docs on disk here and reuse them on restart')
+    parser.add_argument('--sync-concurrency', type=int, default=32, help='document joins and blob downloads to run at once when syncing from other nodes')
+    parser.add_argument('--blob-cache-size', type=int, default=0, help='bytes of blobs fetched from other nodes to keep, least recently read go first. 0 keeps them all')
 
     args = parser.parse_args()
 
     if args.debug:
         debug_mode = True
+    logging.basicConfig(level=logging.DEBUG if debug_mode else logging.INFO, format="%(message)s")
     if args.ticket:
         ticket = args.ticket
         print("Loaded ticket")
 
     # Setup iroh node
-    await setup_iroh_node(ticket, debug_mode)
+    await setup_iroh_node(ticket, debug_mode, doc_cache_size=args.doc_cache_size, data_dir=args.data_dir, sync_concurrency=args.sync_concurrency, blob_cache_size=args.blob_cache_size)
 
     # create or find root document
     root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await create_root_document(ticket=ticket)
@@ -815,8 +1984,15 @@ async def main():
     # We'll create a hash of the root doc ID and use it as our gossip topic
     gossip_topic = blake3(bytes(root_doc_id, "utf-8")).digest()
 
-    # In a background thread, use a gossip loop that listens for control messages
-    asyncio.create_task(gossip_loop(ticket, gossip_topic))
+    # Listen for control messages, and offer our ticket doc to whoever joins
+    control_channel = await start_control_channel(node, ticket, gossip_topic, read_only_ticket)
+
+    # Upgrade any v0 metadata documents in the background
+    asyncio.create_task(migrate_metadata_documents(inode_map_doc_id))
+    # Show how syncing from other nodes is getting on
+    asyncio.create_task(sync_scheduler_queue.report())
+
+    startup_timer.report()
 
     # Stay alive until we get a SIGINT
     try:
@@ -0,0 +1,217 @@
+# Background scheduler for sync jobs (document joins and blob downloads)
+# Jobs run with bounded concurrency, in priority order, and are retried with
+# exponential backoff when they fail.
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+# Priority classes, lower runs first
+PRIORITY_WANTED = 0    # something is waiting on this right now
+PRIORITY_METADATA = 1  # metadata documents and the inode map
+PRIORITY_DOCUMENT = 2  # file, directory and children documents
+PRIORITY_BLOB = 3      # file content
+
+class SyncJob:
+    __slots__ = ("key", "fn", "priority", "size", "accessed", "attempts", "seq", "future", "running", "rerun")
+
+    def __init__(self, key, fn, priority, size, accessed, future):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.size = size
+        self.accessed = accessed
+        self.attempts = 0
+        self.seq = 0
+        self.future = future
+        self.running = False
+        # Resubmitted while running, run again with the newest fn once this run ends
+        self.rerun = False
+
+    def sort_key(self):
+        # Higher priority class first, then most recently accessed, then smallest
+        return (self.priority, -self.accessed, self.size, self.seq)
+
+class SyncScheduler:
+    def __init__(self, concurrency: int = 32, max_attempts: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 30.0):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heap = []
+        # Queued, running or backing-off jobs by key, so a key is only synced once at a time
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.condition = None
+        self.idle = None
+        self.workers = []
+        self.running = 0
+        self.delayed = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        self.condition = asyncio.Condition()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for task in self.workers:
+            task.cancel()
+        self.workers = []
+
+    async def submit(self, key, fn: Callable[[], Awaitable], priority: int = PRIORITY_DOCUMENT,
+                     size: int = 0, accessed: Optional[float] = None) -> asyncio.Future:
+        # Queue fn() under key and return a future for its result.
+        # Submitting a key that is already queued replaces its fn, since the newest
+        # ticket for a key is the one worth syncing, and can raise its priority.
+        # If the job is already running it runs again with the new fn afterwards.
+        if not self.workers:
+            self.start()
+        job = self.jobs.get(key)
+        if job is not None:
+            job.fn = fn
+            if job.running:
+                job.rerun = True
+            if priority < job.priority or (accessed or 0) > job.accessed:
+                await self.reprioritise(job, min(priority, job.priority), max(accessed or 0, job.accessed))
+            return job.future
+        job = SyncJob(key, fn, priority, size, accessed or 0, asyncio.get_running_loop().create_future())
+        self.jobs[key] = job
+        self.submitted += 1
+        await self.push(job)
+        return job.future
+
+    async def bump(self, key, accessed: Optional[float] = None):
+        # Move a queued job to the front of the queue, e.g. because a read is waiting on it
+        job = self.jobs.get(key)
+        if job is not None:
+            await self.reprioritise(job, PRIORITY_WANTED, accessed or time.time())
+
+    async def reprioritise(self, job, priority, accessed):
+        job.priority = priority
+        job.accessed = accessed
+        # The old heap entry goes stale, pop() skips entries whose seq doesn't match
+        if job.seq:
+            await self.push(job)
+
+    async def push(self, job):
+        job.seq = next(self.counter) + 1
+        async with self.condition:
+            self.idle.clear()
+            heapq.heappush(self.heap, (job.sort_key(), job))
+            self.condition.notify()
+
+    def pop(self):
+        while self.heap:
+            sort_key, job = heapq.heappop(self.heap)
+            if sort_key[-1] == job.seq and self.jobs.get(job.key) is job:
+                job.seq = 0
+                return job
+        return None
+
+    async def worker(self):
+        while True:
+            async with self.condition:
+                job = self.pop()
+                while job is None:
+                    await self.condition.wait()
+                    job = self.pop()
+                self.running += 1
+            try:
+                await self.run(job)
+            finally:
+                self.running -= 1
+                self.check_idle()
+
+    async def run(self, job):
+        job.attempts += 1
+        job.running = True
+        try:
+            result = await job.fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if await self.run_again(job):
+                return
+            if job.attempts >= self.max_attempts:
+                print(f"Giving up on sync job '{job.key}' after {job.attempts} attempts: {str(e)}")
+                self.failed += 1
+                self.finish(job, exception=e)
+                return
+            delay = min(self.backoff * 2 ** (job.attempts - 1), self.max_backoff)
+            # Jitter, so jobs that failed together don't all retry together
+            delay *= random.uniform(0.5, 1.0)
+            print(f"Sync job '{job.key}' failed ({str(e)}), retrying in {delay:.1f}s")
+            self.retried += 1
+            self.delayed += 1
+            asyncio.create_task(self.retry_later(job, delay))
+            return
+        finally:
+            job.running = False
+        if await self.run_again(job):
+            return
+        self.completed += 1
+        self.finish(job, result=result)
+
+    async def run_again(self, job):
+        # A newer fn arrived while this one was running, queue it rather than finishing
+        if not job.rerun:
+            return False
+        job.rerun = False
+        job.attempts = 0
+        await self.push(job)
+        return True
+
+    async def retry_later(self, job, delay):
+        await asyncio.sleep(delay)
+        self.delayed -= 1
+        await self.push(job)
+
+    def finish(self, job, result=None, exception=None):
+        self.jobs.pop(job.key, None)
+        if job.future.done():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+            # Nobody has to be waiting on the result, don't warn about it going unretrieved
+            job.future.exception()
+        else:
+            job.future.set_result(result)
+
+    def check_idle(self):
+        # Stale heap entries don't count, only jobs that still have to run
+        if not self.jobs:
+            self.idle.set()
+
+    async def wait_idle(self):
+        if self.idle is not None:
+            await self.idle.wait()
+
+    def progress(self):
+        return {
+            "queued": len(self.jobs) - self.running - self.delayed,
+            "running": self.running,
+            "backing_off": self.delayed,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+    async def report(self, interval: float = 5.0):
+        # Print progress every interval seconds while there is work to do
+        last = None
+        while True:
+            await asyncio.sleep(interval)
+            progress = self.progress()
+            if progress != last and (progress["queued"] or progress["running"] or progress["backing_off"]):
+                print("Sync: {completed}/{submitted} done, {queued} queued, {running} running, "
+                      "{backing_off} backing off, {failed} failed".format(**progress))
+            last = progress
@@ -0,0 +1,65 @@
+# Test the byte budget, LRU order and pinning of the blob cache
+import blob_cache
+
+def test_evicts_least_recently_read():
+    cache = blob_cache.BlobCache(max_bytes=300)
+    assert cache.add("a", 100, "ticket-a") == []
+    assert cache.add("b", 100, "ticket-b") == []
+    assert cache.add("c", 100, "ticket-c") == []
+    assert cache.touch("a")
+    # Over budget, b is now the least recently read
+    assert cache.add("d", 100, "ticket-d") == ["b"]
+    assert cache.size == 300
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert cache.evictions == 1
+    assert cache.evicted_bytes == 100
+    assert not cache.touch("b")
+
+def test_pinned_blobs_stay():
+    cache = blob_cache.BlobCache(max_bytes=150)
+    cache.add("a", 100, "ticket-a")
+    cache.pin("a")
+    cache.pin("a")
+    assert cache.add("b", 100, "ticket-b") == ["b"]
+    cache.unpin("a")
+    assert "a" in cache.pins
+    cache.unpin("a")
+    assert cache.add("c", 100, "ticket-c") == ["a"]
+
+def test_refetch_source_survives_eviction():
+    cache = blob_cache.BlobCache(max_bytes=100)
+    cache.add("a", 100, "ticket-a")
+    cache.add("b", 100, "ticket-b")
+    # Blobs we authored were never added, so there's nowhere to refetch them from
+    assert cache.missing("local") is None
+    assert cache.missing("a") == "ticket-a"
+    assert cache.misses == 1
+    # Fetched again, it's tracked like any other download
+    assert cache.add("a", 100, "ticket-a") == ["b"]
+    assert "a" not in cache.evicted
+    assert cache.source("b") == "ticket-b"
+
+def test_oversized_blob_kept_while_pinned():
+    cache = blob_cache.BlobCache(max_bytes=300)
+    cache.add("a", 100, "ticket-a")
+    cache.add("b", 100, "ticket-b")
+    # Too big to ever fit, a reader has it pinned while it's fetched
+    cache.pin("big")
+    assert cache.add("big", 1000, "ticket-big") == []
+    # It doesn't push everything else out, and reads don't move it back
+    assert cache.size == 200
+    assert cache.touch("big")
+    assert list(cache.entries) == ["big", "a", "b"]
+    assert cache.add("c", 100, "ticket-c") == []
+    # Once unpinned it's the first to go
+    cache.unpin("big")
+    assert cache.over_budget() == ["big"]
+    assert cache.source("big") == "ticket-big"
+    assert not cache.oversized
+    assert cache.size == 300
+
+def test_unpinned_oversized_blob_is_not_kept():
+    cache = blob_cache.BlobCache(max_bytes=300)
+    cache.add("a", 100, "ticket-a")
+    assert cache.add("big", 1000, "ticket-big") == ["big"]
+    assert list(cache.entries) == ["a"]
@@ -0,0 +1,70 @@
+# Test that children documents keep an accurate entry count
+import pytest
+import asyncio
+import recurso
+
+@pytest.mark.asyncio
+async def test_child_count_maintained():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    children_doc_id = await recurso.create_children_document(inode_map_doc_id)
+    assert await recurso.get_child_count(children_doc_id) == 0
+
+    for name in ["never", "gonna", "give"]:
+        await recurso.set_by_key(children_doc_id, await recurso.encode_filename(name, "file"), b"rheibcmkl4jn63iolncyffoxyhoe327unn5wndwvmvkb5dmnxsjq")
+    await recurso.set_by_key(children_doc_id, await recurso.encode_filename("you", "directory"), b"rheibcmkl4jn63iolncyffoxyhoe327unn5wndwvmvkb5dmnxsjq")
+    assert await recurso.get_child_count(children_doc_id) == 4
+
+    # Replacing an existing child doesn't change the count
+    await recurso.set_by_key(children_doc_id, await recurso.encode_filename("never", "file"), b"somethingelse")
+    assert await recurso.get_child_count(children_doc_id) == 4
+
+    # Non-child keys don't count
+    await recurso.set_by_key(children_doc_id, "updated", b"0")
+    assert await recurso.get_child_count(children_doc_id) == 4
+
+    await recurso.delete_key(children_doc_id, await recurso.encode_filename("gonna", "file"))
+    assert await recurso.get_child_count(children_doc_id) == 3
+
+    # A recount from scratch agrees with the maintained count
+    assert await recurso.recount_children(children_doc_id) == 3
+
+async def test_child_count_missing_is_recounted():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    # The root directory was populated with four example files
+    children_doc_id = await recurso.get_by_key(root_directory_doc_id, "children")
+    children_document = await recurso.get_document(children_doc_id)
+    await children_document.delete(recurso.author, recurso.CHILD_COUNT_KEY)
+
+    assert await recurso.get_child_count(children_doc_id) == 4
+    assert await recurso.get_by_key(children_doc_id, "entries") == "4"
+
+async def test_child_count_without_watching():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    # Listing a directory counts its subdirectories without subscribing to them
+    children_doc_id = await recurso.get_by_key(root_directory_doc_id, "children")
+    assert await recurso.get_child_count(children_doc_id, watch=False) == 4
+    assert children_doc_id not in recurso.child_count_watched
+    assert await recurso.get_child_count(children_doc_id) == 4
+    assert children_doc_id in recurso.child_count_watched
+
+class FakeEntry:
+    def __init__(self, key):
+        self._key = key
+
+    def key(self):
+        return self._key
+
+def test_remote_count_writes_do_not_trigger_recounts():
+    recurso.pending_recounts = set()
+    # A peer's own recount arriving here must not start another one
+    recurso.schedule_child_recount("children", FakeEntry(recurso.CHILD_COUNT_KEY))
+    assert recurso.pending_recounts == set()
@@ -0,0 +1,60 @@
+# Test content-defined chunking
+import io
+import os
+import random
+import pytest
+import chunker
+
+def make_chunker():
+    # Small sizes so the tests run quickly
+    return chunker.Chunker(min_size=1024, avg_size=4096, max_size=16384)
+
+def random_data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+def test_chunks_reassemble():
+    data = random_data(200000)
+    chunks = list(make_chunker().chunks(data))
+    assert b"".join(chunks) == data
+
+def test_chunk_sizes_within_bounds():
+    c = make_chunker()
+    data = random_data(500000)
+    sizes = [len(chunk) for chunk in c.chunks(data)]
+    # Every chunk but the last respects the minimum, none exceed the maximum
+    assert all(c.min_size <= size <= c.max_size for size in sizes[:-1])
+    assert sizes[-1] <= c.max_size
+
+def test_chunks_are_content_defined():
+    c = make_chunker()
+    data = random_data(300000)
+    # Insert a few bytes near the start, only the chunks around the edit should change
+    edited = data[:5000] + b"recurso" + data[5000:]
+    before = set(bytes(chunk) for chunk in c.chunks(data))
+    after = set(bytes(chunk) for chunk in c.chunks(edited))
+    assert len(before & after) >= len(before) - 3
+
+def test_chunks_from_file_match_in_memory():
+    c = make_chunker()
+    data = random_data(300000)
+    from_memory = [bytes(chunk) for chunk in c.chunks(data)]
+    from_file = list(c.chunks_from_file(io.BytesIO(data), read_size=5000))
+    assert from_file == from_memory
+
+def test_empty_input():
+    c = make_chunker()
+    assert list(c.chunks(b"")) == []
+    assert list(c.chunks_from_file(io.BytesIO(b""))) == []
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        chunker.Chunker(min_size=10, avg_size=5, max_size=20)
+
+def test_vectorized_scan_matches_byte_loop(monkeypatch):
+    pytest.importorskip("numpy")
+    for c in [make_chunker(), chunker.Chunker(min_size=64, avg_size=64, max_size=64), chunker.Chunker(min_size=100, avg_size=128, max_size=200)]:
+        for data in [random_data(300000), bytes(100000)]:
+            vectorized = [len(chunk) for chunk in c.chunks(data)]
+            with monkeypatch.context() as patch:
+                patch.setattr(chunker, "numpy", None)
+                assert [len(chunk) for chunk in c.chunks(data)] == vectorized
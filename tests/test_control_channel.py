@@ -0,0 +1,60 @@
+# Test that two local nodes exchange join offers over the control channel
+import pytest
+import asyncio
+import iroh
+import recurso
+from blake3 import blake3
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+@pytest.mark.asyncio
+async def test_join_offers_exchanged_once():
+    await recurso.setup_iroh_node()
+    other_node = await iroh.Iroh.memory()
+    topic = blake3(b"test_join_offers_exchanged_once").digest()
+
+    offers, other_offers = [], []
+    channel = recurso.ControlChannel(recurso.node, topic, "docaaaa", offers.append)
+    other_channel = recurso.ControlChannel(other_node, topic, "docbbbb", other_offers.append)
+    await channel.start([])
+    await other_node.net().add_node_addr(await recurso.node.net().node_addr())
+    await other_channel.start([str(await recurso.node.net().node_id())])
+
+    # Joining the topic makes each side offer its ticket to the other
+    await wait_for(lambda: offers and other_offers)
+    assert offers[0].ticket == "docbbbb"
+    assert other_offers[0].ticket == "docaaaa"
+
+    # Offering the same ticket again doesn't trigger another sync
+    other_channel.offer_join()
+    await wait_for(lambda: channel.duplicate_offers > 0)
+    assert len(offers) == 1
+
+    channel.stop()
+    other_channel.stop()
+
+@pytest.mark.asyncio
+async def test_failed_sync_is_retried():
+    attempts = []
+
+    async def sync(offer):
+        attempts.append(offer.ticket)
+        if len(attempts) == 1:
+            raise ConnectionError("peer went away")
+
+    channel = recurso.ControlChannel(None, b"topic", "docaaaa", sync)
+    offer = recurso.control_codec.JoinOffer("peer", "docbbbb")
+    channel.handle_join_offer(offer)
+    await wait_for(lambda: attempts and "peer" not in channel.offers_seen)
+
+    # The first sync failed, so the same offer isn't a duplicate
+    channel.handle_join_offer(offer)
+    await wait_for(lambda: len(attempts) == 2)
+    await asyncio.sleep(0)
+    assert channel.offers_seen == {"peer": "docbbbb"}
+    channel.handle_join_offer(offer)
+    assert channel.duplicate_offers == 1
@@ -0,0 +1,42 @@
+# Test the binary control message format
+import pytest
+import struct
+import control_codec
+
+NODE_ID = "3huxdx54bapti2vmbtpfnrkiw2fpxy2ryod6bogns5nwqdy6zjba"
+TICKET = "docaaacarwhmusoqf362j3jpzrehzkw3bqamcp2mmbhn3fmag3mzzfjp4beahj2v7aezhojvfqi5wltr4vxymgzqnctryyup327ct7iy4s5noxy6aaa"
+
+def test_join_offer_round_trip():
+    offer = control_codec.JoinOffer(NODE_ID, TICKET)
+    frame = control_codec.encode_frame([offer])
+    assert control_codec.decode_frame(frame) == [offer]
+    # Base32 text goes over the wire as the bytes it encodes, so the frame is
+    # smaller than the message as text
+    assert len(frame) < len(NODE_ID) + len(TICKET)
+
+def test_many_messages_in_one_frame():
+    offers = [control_codec.JoinOffer(NODE_ID, TICKET + "a" * i) for i in range(100)]
+    assert control_codec.decode_frame(control_codec.encode_frame(offers)) == offers
+
+def test_non_base32_strings_survive():
+    offer = control_codec.JoinOffer("not a node id!", "doc-with-UPPER-and-dashes")
+    assert control_codec.decode_frame(control_codec.encode_frame([offer])) == [offer]
+
+def test_unknown_message_types_are_skipped():
+    offer = control_codec.JoinOffer(NODE_ID, TICKET)
+    frame = control_codec.encode_frame([offer, offer])
+    # Rewrite the header to claim a third message, of a type from the future
+    unknown = control_codec.MESSAGE_HEADER.pack(200, 3) + b"new"
+    frame = control_codec.FRAME_HEADER.pack(control_codec.MAGIC, control_codec.VERSION, 3) + frame[control_codec.FRAME_HEADER.size:] + unknown
+    assert control_codec.decode_frame(frame) == [offer, offer]
+
+def test_bad_frames_rejected():
+    frame = control_codec.encode_frame([control_codec.JoinOffer(NODE_ID, TICKET)])
+    with pytest.raises(ValueError):
+        control_codec.decode_frame(b"RC")
+    with pytest.raises(ValueError):
+        control_codec.decode_frame(b'{"msg": "Hello, join me!"}')
+    with pytest.raises(ValueError):
+        control_codec.decode_frame(frame[:2] + bytes([control_codec.VERSION + 1]) + frame[3:])
+    with pytest.raises((ValueError, struct.error)):
+        control_codec.decode_frame(frame[:-10])
@@ -9,9 +9,9 @@ async def test_create_directory_document():
     await recurso.setup_iroh_node()
     author = recurso.author
 
-    root_doc_id, root_directory_doc_id, inode_map_doc_id = await recurso.create_root_document()
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
 
-    directory_doc_id = await recurso.create_directory_document("Testfolder", inode_map_doc_id)
+    directory_doc_id = await recurso.create_directory_document("Testfolder", inode_map_doc_id, ticket_doc_id)
     directory_document = await recurso.get_document(directory_doc_id)
 
     # Basic smoke tests
@@ -46,14 +46,17 @@ async def test_create_directory_document():
     assert isinstance(children_content.decode('utf-8'), str)
     assert len(children_content.decode('utf-8')) > 0
 
+@pytest.mark.asyncio
 async def test_create_directory_document_metadata():
     global author
     await recurso.setup_iroh_node()
     author = recurso.author
 
-    root_doc_id, root_directory_doc_id, inode_map_doc_id = await recurso.create_root_document()
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
 
-    directory_doc_id = await recurso.create_directory_document("Testfolder", inode_map_doc_id)
+    directory_doc_id = await recurso.create_directory_document("Testfolder", inode_map_doc_id, ticket_doc_id)
     directory_document = await recurso.get_document(directory_doc_id)
 
-    await recurso.get_metadata_for_doc_id(directory_doc_id)
+    metadata = await recurso.find_and_fetch_metadata_for_doc_id(directory_doc_id)
+    assert metadata.st_ino is not None
+
@@ -9,7 +9,7 @@ async def test_create_root_document():
     await recurso.setup_iroh_node()
     author = recurso.author
 
-    root_doc_id, root_directory_doc_id, inode_map_doc_id = await recurso.create_root_document()
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
     root_document = await recurso.get_document(root_doc_id)
 
     # Basic smoke tests
@@ -38,14 +38,16 @@ async def test_create_root_document():
     assert isinstance(directory_content.decode('utf-8'), str)
     assert len(directory_content.decode('utf-8')) > 0
 
+@pytest.mark.asyncio
 async def test_get_root_document_directory_metadata():
     global author
     await recurso.setup_iroh_node()
     author = recurso.author
 
-    root_doc_id, root_directory_doc_id, inode_map_doc_id = await recurso.create_root_document()
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
     root_document = await recurso.get_document(root_doc_id)
 
     root_directory_document = await recurso.get_document(root_doc_id)
 
-    await recurso.get_metadata_for_doc_id(root_directory_doc_id)
\ No newline at end of file
+    metadata = await recurso.find_and_fetch_metadata_for_doc_id(root_directory_doc_id)
+    assert metadata.st_ino is not None
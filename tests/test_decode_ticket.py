@@ -0,0 +1,77 @@
+# Test the ticket codec and its decode cache
+import pytest
+import base64
+import decode_ticket
+
+DOC_TICKET = "docaaacarwhmusoqf362j3jpzrehzkw3bqamcp2mmbhn3fmag3mzzfjp4beahj2v7aezhojvfqi5wltr4vxymgzqnctryyup327ct7iy4s5noxy6aaa"
+NODE_ID = "2ovpybgj3snjmchns44pfn6dbwmdiu4ogfd66xyu72ghexllv6hq"
+HASH = base64.b32encode(bytes(range(32))).decode().lower().rstrip("=")
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    decode_ticket.clear_decode_cache()
+    yield
+    decode_ticket.clear_decode_cache()
+
+def node_addr(derp_url=None, addresses=()):
+    return decode_ticket.NodeAddr(NODE_ID, decode_ticket.AddrInfo(derp_url, tuple(addresses)))
+
+def test_doc_ticket_round_trip():
+    ticket = decode_ticket.decode_iroh_ticket(DOC_TICKET)
+    assert ticket.capability == decode_ticket.Capability.WRITE
+    assert ticket.nodes[0].node_id == NODE_ID
+    assert decode_ticket.encode_iroh_ticket(ticket) == DOC_TICKET
+
+def test_read_doc_ticket_round_trip():
+    ticket = decode_ticket.DocTicket(decode_ticket.TicketType.DOC, decode_ticket.Capability.READ, HASH,
+                                     (node_addr(), node_addr("https://relay.example./")))
+    encoded = decode_ticket.encode_iroh_ticket(ticket)
+    assert encoded.startswith("doc")
+    assert decode_ticket.decode_iroh_ticket(encoded) == ticket
+
+def test_node_ticket_round_trip():
+    ticket = decode_ticket.NodeTicket(decode_ticket.TicketType.NODE, node_addr(
+        "https://relay.example./", ["192.168.1.2:11204", "[fe80:0000:0000:0000:0000:0000:0000:0001]:300"]))
+    encoded = decode_ticket.encode_iroh_ticket(ticket)
+    assert encoded.startswith("node")
+    assert decode_ticket.decode_iroh_ticket(encoded) == ticket
+
+def test_blob_ticket_round_trip():
+    for blob_format in decode_ticket.BlobFormat:
+        ticket = decode_ticket.BlobTicket(decode_ticket.TicketType.BLOB, node_addr(addresses=["10.0.0.1:70000"]), blob_format, HASH)
+        encoded = decode_ticket.encode_iroh_ticket(ticket)
+        assert encoded.startswith("blob")
+        assert decode_ticket.decode_iroh_ticket(encoded) == ticket
+
+def test_abbreviated_ipv6_is_expanded():
+    ticket = decode_ticket.NodeTicket(decode_ticket.TicketType.NODE, node_addr(addresses=["[::1]:5"]))
+    decoded = decode_ticket.decode_iroh_ticket(decode_ticket.encode_iroh_ticket(ticket))
+    assert decoded.node.info.direct_addresses == ("[0000:0000:0000:0000:0000:0000:0000:0001]:5",)
+
+def test_decode_cache():
+    first = decode_ticket.decode_iroh_ticket(DOC_TICKET)
+    assert decode_ticket.decode_iroh_ticket(DOC_TICKET) is first
+    # Shared between callers, so nothing in it can be changed
+    assert isinstance(first.nodes, tuple)
+    assert isinstance(first.nodes[0].info.direct_addresses, tuple)
+    assert (decode_ticket.cache_hits, decode_ticket.cache_misses) == (1, 1)
+
+def test_decode_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(decode_ticket, "DECODE_CACHE_SIZE", 2)
+    tickets = [decode_ticket.encode_iroh_ticket(decode_ticket.NodeTicket(
+        decode_ticket.TicketType.NODE, node_addr(addresses=["10.0.0.{}:1".format(i)]))) for i in range(3)]
+    for ticket in tickets:
+        decode_ticket.decode_iroh_ticket(ticket)
+    assert list(decode_ticket.decode_cache) == tickets[1:]
+
+def test_bulk_decode():
+    decoded = decode_ticket.decode_iroh_tickets([DOC_TICKET, DOC_TICKET, DOC_TICKET])
+    assert len(decoded) == 3
+    assert decoded[0] is decoded[1] is decoded[2]
+    assert decode_ticket.cache_misses == 1
+
+def test_bad_tickets():
+    with pytest.raises(ValueError):
+        decode_ticket.decode_iroh_ticket("nope" + DOC_TICKET[3:])
+    with pytest.raises(ValueError):
+        decode_ticket.decode_iroh_ticket(DOC_TICKET[:40])
@@ -0,0 +1,71 @@
+# Test negative entries, LRU eviction and invalidation in the dentry cache
+import pytest
+import recurso
+import dentry_cache
+
+class FakeEntry:
+    def __init__(self, key):
+        self._key = key
+
+    def key(self):
+        return self._key
+
+@pytest.fixture
+def watched(monkeypatch):
+    # children doc ID -> listeners, in place of real document subscriptions
+    listeners = {}
+
+    async def watch(doc_id, callback, remote_only=False):
+        listeners.setdefault(doc_id, []).append(callback)
+
+    def unwatch(doc_id, callback):
+        listeners[doc_id].remove(callback)
+        if not listeners[doc_id]:
+            del listeners[doc_id]
+
+    monkeypatch.setattr(recurso, "watch_document_changes", watch)
+    monkeypatch.setattr(recurso, "unwatch_document_changes", unwatch)
+    return listeners
+
+@pytest.mark.asyncio
+async def test_negative_hits(watched):
+    cache = dentry_cache.DentryCache()
+    assert cache.get(1, "missing") is None
+    await cache.put(1, "missing", dentry_cache.NEGATIVE, "children-1")
+    await cache.put(1, "present", 42, "children-1")
+    assert cache.get(1, "missing") == dentry_cache.NEGATIVE
+    assert cache.get(1, "present") == 42
+    assert (cache.hits, cache.misses, cache.negative_hits) == (2, 1, 1)
+    # One subscription per parent, however many names it has
+    assert len(watched["children-1"]) == 1
+
+@pytest.mark.asyncio
+async def test_lru_eviction_unwatches_empty_parents(watched):
+    cache = dentry_cache.DentryCache(max_entries=2)
+    await cache.put(1, "a", 10, "children-1")
+    await cache.put(2, "b", 20, "children-2")
+    assert cache.get(1, "a") == 10
+    # Parent 2's only entry is the least recently used
+    await cache.put(3, "c", dentry_cache.NEGATIVE, "children-3")
+    assert cache.get(2, "b") is None
+    assert list(cache.entries) == [(1, "a"), (3, "c")]
+    assert set(watched) == {"children-1", "children-3"}
+    assert cache.children_docs == {"children-1": 1, "children-3": 3}
+
+@pytest.mark.asyncio
+async def test_insert_invalidates_name(watched):
+    cache = dentry_cache.DentryCache()
+    await cache.put(1, "new-file", dentry_cache.NEGATIVE, "children-1")
+    await cache.put(1, "other", 7, "children-1")
+    for callback in list(watched["children-1"]):
+        await callback("children-1", FakeEntry((await recurso.encode_filename("new-file", "file")).encode()))
+    assert cache.get(1, "new-file") is None
+    assert cache.get(1, "other") == 7
+    # Keys that aren't children leave everything alone
+    await cache.apply_change("children-1", FakeEntry(b"entries"))
+    assert cache.get(1, "other") == 7
+
+    # The parent's last entry going stops the subscription
+    await cache.apply_change("children-1", FakeEntry((await recurso.encode_filename("other", "directory")).encode()))
+    assert "children-1" not in watched
+    assert not cache.children_docs
@@ -0,0 +1,48 @@
+# Test that document handles are cached and evicted
+import pytest
+import asyncio
+import recurso
+
+@pytest.mark.asyncio
+async def test_document_cache_hits():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    # The first open of a document we haven't seen is a miss
+    recurso.doc_cache.evict(root_doc_id)
+    misses = recurso.doc_cache.misses
+    assert await recurso.get_by_key(root_doc_id, "type") == "root"
+    assert recurso.doc_cache.misses == misses + 1
+
+    # Every open after that should reuse the cached handle
+    hits = recurso.doc_cache.hits
+    assert await recurso.get_by_key(root_doc_id, "version") == "v0"
+    assert await recurso.get_by_key(root_doc_id, "directory") == root_directory_doc_id
+    assert recurso.doc_cache.hits == hits + 2
+    assert recurso.doc_cache.misses == misses + 1
+
+async def test_document_cache_bounded():
+    await recurso.setup_iroh_node(doc_cache_size=2)
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    await recurso.get_document(root_doc_id)
+    await recurso.get_document(root_directory_doc_id)
+    await recurso.get_document(inode_map_doc_id)
+
+    # Only the two most recently used handles are kept
+    assert recurso.doc_cache.stats()["size"] == 2
+    assert root_doc_id not in recurso.doc_cache.docs
+
+async def test_document_cache_evicts_on_delete():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    children_doc_id = await recurso.create_children_document(inode_map_doc_id)
+    await recurso.get_document(children_doc_id)
+    assert children_doc_id in recurso.doc_cache.docs
+
+    await recurso.delete_document(children_doc_id)
+    assert children_doc_id not in recurso.doc_cache.docs
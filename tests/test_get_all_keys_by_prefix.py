@@ -12,12 +12,12 @@ import asyncio
 import recurso
 
 @pytest.mark.asyncio
-async def test_create_directory_document():
+async def test_get_all_keys_by_prefix():
     global author
     await recurso.setup_iroh_node()
     author = recurso.author
 
-    root_doc_id, directory_doc_id, inode_map_doc_id = await recurso.create_root_document()
+    root_doc_id, directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
     root_document = await recurso.get_document(root_doc_id)
 
     # not needed now
@@ -70,5 +70,4 @@ async def test_create_directory_document():
 
     # Lookup the entries and assert that 5 are found
     entries = await recurso.get_all_keys_by_prefix(children_document, "fsdir")
-
-asyncio.run(test_create_directory_document())
\ No newline at end of file
+    assert len(entries) == 5
@@ -0,0 +1,144 @@
+# Test the array-backed inode table
+import os
+import random
+import decode_ticket
+import inode_table
+
+def random_doc_id():
+    return decode_ticket.encode_base32(os.urandom(inode_table.DOC_ID_LENGTH))
+
+def random_inodes(count):
+    return {random.getrandbits(64): random_doc_id() for _ in range(count)}
+
+def test_bulk_load_and_get():
+    inodes = random_inodes(1000)
+    table = inode_table.InodeTable()
+    table.bulk_load(inodes.items())
+    assert len(table) == 1000
+    for inode, doc_id in inodes.items():
+        assert table.get(inode) == doc_id
+    assert table.get(12345) is None
+    # 8 bytes of inode and 32 of doc ID each
+    assert table.memory_usage() == 1000 * 40
+
+def test_changes_merge_into_the_arrays():
+    inodes = random_inodes(500)
+    table = inode_table.InodeTable(merge_threshold=16)
+    table.bulk_load(inodes.items())
+    removed = list(inodes)[:100]
+    for inode in removed:
+        table.discard(inode)
+    added = random_inodes(100)
+    for inode, doc_id in added.items():
+        table.set(inode, doc_id)
+    replaced = list(inodes)[200]
+    new_doc_id = random_doc_id()
+    table.set(replaced, new_doc_id)
+
+    assert len(table) == 500
+    assert not table.recent
+    assert all(table.get(inode) is None for inode in removed)
+    assert all(table.get(inode) == doc_id for inode, doc_id in added.items())
+    assert table.get(replaced) == new_doc_id
+    # Still sorted after merging
+    assert list(table.inodes) == sorted(table.inodes)
+
+def test_changes_during_a_scan_win():
+    table = inode_table.InodeTable()
+    newer = random_doc_id()
+    table.set(7, newer)
+    table.discard(8)
+    table.bulk_load([(7, random_doc_id()), (8, random_doc_id()), (9, random_doc_id())])
+    assert table.get(7) == newer
+    assert table.get(8) is None
+    assert table.get(9) is not None
+
+def test_doc_ids_that_do_not_pack():
+    table = inode_table.InodeTable()
+    table.bulk_load([(1, "not-a-doc-id")])
+    table.set(2, "ALSO-NOT")
+    assert table.get(1) == "not-a-doc-id"
+    assert table.get(2) == "ALSO-NOT"
+    table.discard(1)
+    assert table.get(1) is None
+    assert len(table) == 1
+
+def test_save_and_map(tmp_path):
+    inodes = random_inodes(1000)
+    table = inode_table.InodeTable()
+    table.bulk_load(inodes.items())
+    path = str(tmp_path / "inode-table.bin")
+    table.save(path)
+
+    mapped = inode_table.InodeTable.load(path)
+    assert mapped.mapping is not None
+    for inode, doc_id in inodes.items():
+        assert mapped.get(inode) == doc_id
+
+    # Changes move the table off the file and into memory
+    inode = random.getrandbits(64)
+    doc_id = random_doc_id()
+    mapped.set(inode, doc_id)
+    mapped.merge()
+    assert mapped.mapping is None
+    assert mapped.get(inode) == doc_id
+    assert len(mapped) == 1001
+
+def test_load_rejects_other_files(tmp_path):
+    path = str(tmp_path / "inode-table.bin")
+    with open(path, "wb") as f:
+        f.write(b"not an inode table at all")
+    assert inode_table.InodeTable.load(path) is None
+
+def test_inode_map_keys():
+    # An inode map as create_root_document leaves it, plus a few files
+    root_doc_id = random_doc_id()
+    inodes = random_inodes(10)
+    inode_map = [(inode_table.ROOT_INODE_KEY.encode(), root_doc_id), (b"not-an-inode", random_doc_id())]
+    inode_map += [(str(inode).encode(), doc_id) for inode, doc_id in inodes.items()]
+    # Digits, but past what an inode can be
+    inode_map.append((str(1 << 64).encode(), random_doc_id()))
+
+    pairs = [(inode_table.inode_from_key(key), doc_id) for key, doc_id in inode_map
+             if inode_table.inode_from_key(key) is not None]
+    table = inode_table.InodeTable()
+    table.bulk_load(pairs)
+    assert len(table) == 10
+    for inode, doc_id in inodes.items():
+        assert table.get(inode) == doc_id
+    assert inode_table.inode_from_key(str((1 << 64) - 1)) == (1 << 64) - 1
+
+def test_changes_during_a_scan_past_the_merge_threshold():
+    table = inode_table.InodeTable(merge_threshold=16)
+    table.bulk_load(random_inodes(50).items())
+    scanned = random_inodes(100)
+    # Events keep arriving while the scan runs, more than a merge's worth
+    table.begin_bulk_load()
+    newer = {inode: random_doc_id() for inode in list(scanned)[:40]}
+    for inode, doc_id in newer.items():
+        table.set(inode, doc_id)
+    deleted = list(scanned)[40:60]
+    for inode in deleted:
+        table.discard(inode)
+    added = random_inodes(30)
+    for inode, doc_id in added.items():
+        table.set(inode, doc_id)
+    assert len(table.recent) == 90
+    table.bulk_load(scanned.items())
+
+    assert not table.recent
+    assert all(table.get(inode) == doc_id for inode, doc_id in newer.items())
+    assert all(table.get(inode) is None for inode in deleted)
+    assert all(table.get(inode) == doc_id for inode, doc_id in added.items())
+    assert all(table.get(inode) == doc_id for inode, doc_id in list(scanned.items())[60:])
+    assert len(table) == 40 + 40 + 30
+
+def test_failed_scan_goes_back_to_merging():
+    table = inode_table.InodeTable(merge_threshold=16)
+    table.begin_bulk_load()
+    for inode, doc_id in random_inodes(20).items():
+        table.set(inode, doc_id)
+    assert len(table.recent) == 20
+    table.end_bulk_load()
+    assert not table.recent
+    assert len(table.inodes) == 20
@@ -0,0 +1,104 @@
+# Test latency histograms, per-op iroh call counts and the stats output
+import pytest
+import asyncio
+import instrumentation
+
+@pytest.fixture(autouse=True)
+def fresh_stats():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+    instrumentation.caches.clear()
+
+def test_histogram_percentiles():
+    histogram = instrumentation.LatencyHistogram()
+    for _ in range(99):
+        histogram.observe(0.000010)
+    histogram.observe(0.5)
+    assert histogram.count == 100
+    # Percentiles are reported as the upper bound of their bucket
+    assert 0.000010 <= histogram.percentile(0.50) < 0.000020
+    assert histogram.percentile(0.999) >= 0.5
+    assert histogram.max == 0.5
+
+@pytest.mark.asyncio
+async def test_timed_records_latency_and_iroh_calls():
+    @instrumentation.timed("lookup")
+    async def lookup():
+        instrumentation.count_iroh_call("doc.get_exact")
+        instrumentation.count_iroh_call("doc.get_exact")
+        await asyncio.sleep(0)
+
+    for _ in range(3):
+        await lookup()
+    stats = instrumentation.ops["lookup"]
+    assert stats.latency.count == 3
+    assert stats.iroh_calls == {"doc.get_exact": 6}
+
+@pytest.mark.asyncio
+async def test_nested_ops_roll_up():
+    @instrumentation.timed("getattr")
+    async def getattr():
+        instrumentation.count_iroh_call("doc.get_many")
+
+    @instrumentation.timed("lookup")
+    async def lookup():
+        instrumentation.count_iroh_call("doc.get_exact")
+        await getattr()
+
+    await lookup()
+    assert instrumentation.ops["getattr"].iroh_calls == {"doc.get_many": 1}
+    assert instrumentation.ops["lookup"].iroh_calls == {"doc.get_exact": 1, "doc.get_many": 1}
+
+@pytest.mark.asyncio
+async def test_errors_are_counted():
+    @instrumentation.timed("unlink")
+    async def unlink():
+        raise FileNotFoundError()
+
+    with pytest.raises(FileNotFoundError):
+        await unlink()
+    assert instrumentation.ops["unlink"].errors == 1
+    assert instrumentation.ops["unlink"].latency.count == 1
+
+@pytest.mark.asyncio
+async def test_disabled_records_nothing():
+    instrumentation.disable()
+
+    @instrumentation.timed("read")
+    async def read():
+        instrumentation.count_iroh_call("blobs.read_at")
+        return b"data"
+
+    assert await read() == b"data"
+    assert instrumentation.ops == {}
+
+def test_render_text_and_prometheus():
+    instrumentation.op_stats("readdir").latency.observe(0.002)
+    instrumentation.op_stats("readdir").iroh_calls["doc.get_many"] = 2
+    instrumentation.register_cache("documents", lambda: (3, 1))
+    # A cache that can't report yet is left out rather than breaking the output
+    instrumentation.register_cache("broken", lambda: None.hits)
+    instrumentation.register_counter("blob_evictions", lambda: 5)
+
+    text = instrumentation.render_text()
+    assert "readdir" in text
+    assert "75.0%" in text
+    assert "broken" not in text
+    assert "blob_evictions" in text
+
+    prometheus = instrumentation.render_prometheus()
+    assert 'recurso_op_latency_seconds_count{op="readdir"} 1' in prometheus
+    assert 'recurso_op_latency_seconds_bucket{op="readdir",le="+Inf"} 1' in prometheus
+    assert 'recurso_iroh_calls_total{op="readdir",call="doc.get_many"} 2' in prometheus
+    assert 'recurso_cache_requests_total{cache="documents",result="hit"} 3' in prometheus
+    assert 'recurso_events_total{event="blob_evictions"} 5' in prometheus
+
+def test_write_prometheus(tmp_path):
+    instrumentation.op_stats("getattr").latency.observe(0.001)
+    path = str(tmp_path / "recurso.prom")
+    instrumentation.write_prometheus(path)
+    with open(path) as f:
+        assert 'op="getattr"' in f.read()
@@ -0,0 +1,54 @@
+# Test the packed (v1) metadata record and reading older v0 documents
+import pytest
+import asyncio
+import stat
+import recurso
+
+def test_metadata_record_roundtrip():
+    metadata = recurso.Metadata(stat.S_IFREG | 0o644, 0xFFFFFFFFFFFFFFFF, 1000, 1000, 5, 1, 2, 3)
+    packed = metadata.pack()
+    assert len(packed) == recurso.METADATA_RECORD.size
+
+    unpacked = recurso.Metadata.unpack(packed)
+    for field in recurso.Metadata.__slots__:
+        assert getattr(unpacked, field) == getattr(metadata, field)
+
+@pytest.mark.asyncio
+async def test_create_metadata_document_is_v1():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    metadata_doc_id, st_ino = await recurso.create_metadata_document("test.txt", "file", root_directory_doc_id, inode_map_doc_id, 42)
+    assert await recurso.get_by_key(metadata_doc_id, "version") == "v1"
+    assert await recurso.get_by_key(metadata_doc_id, "st_ino") is None
+
+    metadata = await recurso.get_metadata(metadata_doc_id)
+    assert metadata.st_ino == st_ino
+    assert metadata.st_size == 42
+
+async def test_migrate_v0_metadata_document():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    # Build a metadata document the way v0 did, one decimal key per field
+    doc = await recurso.node.docs().create()
+    metadata_doc_id = doc.id()
+    await doc.set_bytes(recurso.author, b"type", b"metadata")
+    await doc.set_bytes(recurso.author, b"version", b"v0")
+    for field, value in zip(recurso.Metadata.__slots__, (stat.S_IFREG | 0o644, 1234, 0, 0, 99, 1, 2, 3)):
+        await doc.set_bytes(recurso.author, bytes(field, "utf-8"), bytes(str(value), "utf-8"))
+
+    # v0 documents are still readable
+    metadata = await recurso.get_metadata(metadata_doc_id)
+    assert metadata.st_ino == 1234
+    assert metadata.st_size == 99
+
+    # And read the same after migrating in place
+    assert await recurso.migrate_metadata_document(metadata_doc_id)
+    assert await recurso.get_by_key(metadata_doc_id, "version") == "v1"
+    assert await recurso.get_by_key(metadata_doc_id, "st_size") is None
+    metadata = await recurso.get_metadata(metadata_doc_id)
+    assert metadata.st_ino == 1234
+    assert metadata.st_size == 99
@@ -0,0 +1,29 @@
+# Test that a persistent node reuses its documents across restarts
+import pytest
+import asyncio
+import recurso
+
+@pytest.mark.asyncio
+async def test_persistent_node_reuses_documents(tmp_path):
+    await recurso.setup_iroh_node(data_dir=str(tmp_path))
+    first = await recurso.create_root_document()
+    await recurso.node.node().shutdown(False)
+
+    # Same data dir, so the same root, directory, inode map and ticket docs
+    await recurso.setup_iroh_node(data_dir=str(tmp_path))
+    second = await recurso.create_root_document()
+    assert second == first
+
+    # And the content is still there without any sync
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = second
+    assert await recurso.get_by_key(root_doc_id, "type") == "root"
+    metadata = await recurso.find_and_fetch_metadata_for_doc_id(root_directory_doc_id)
+    assert await recurso.get_by_key(inode_map_doc_id, str(metadata.st_ino)) == root_directory_doc_id
+
+@pytest.mark.asyncio
+async def test_memory_node_does_not_register_ticket_doc():
+    # A memory node's node ID changes every start, so its key would only pile up
+    await recurso.setup_iroh_node()
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+    root_doc = await recurso.open_document(root_doc_id)
+    assert await recurso.get_all_keys_by_prefix(root_doc, "tickets_") == []
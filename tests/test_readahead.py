@@ -0,0 +1,60 @@
+# Test sequential detection, window growth and cancellation in readahead
+import pytest
+import asyncio
+import readahead
+
+# Serves ranges of a bytes object and records every read it was asked for
+class FakeReader:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.reads = []
+
+    async def read(self, offset, length):
+        self.reads.append((offset, length))
+        await asyncio.sleep(0)
+        return self.data[offset:offset + length]
+
+DATA = bytes(range(256)) * 4096
+
+@pytest.mark.asyncio
+async def test_sequential_reads_are_prefetched():
+    reader = FakeReader(DATA)
+    ahead = readahead.Readahead(reader, min_window=4096, max_window=65536)
+    offset = 0
+    while offset < len(DATA):
+        data = await ahead.read(offset, 1024)
+        assert data == DATA[offset:offset + 1024]
+        offset += len(data)
+    assert offset == len(DATA)
+    # Two direct reads to spot the pattern, the rest came from ever larger prefetches
+    assert reader.reads[:2] == [(0, 1024), (1024, 1024)]
+    prefetches = [length for _, length in reader.reads[2:]]
+    assert prefetches[:4] == [4096, 8192, 16384, 32768]
+    assert max(prefetches) == 65536
+    assert len(reader.reads) < len(DATA) // 1024 // 10
+
+@pytest.mark.asyncio
+async def test_random_access_cancels_prefetch():
+    reader = FakeReader(DATA)
+    ahead = readahead.Readahead(reader, min_window=4096, max_window=65536)
+    await ahead.read(0, 1024)
+    await ahead.read(1024, 1024)
+    assert ahead.segments
+    task = ahead.segments[0].task
+    assert await ahead.read(500000, 1024) == DATA[500000:501024]
+    assert task.cancelled() or task.done()
+    assert not ahead.segments
+    assert ahead.window == 4096
+    # A single read elsewhere doesn't start prefetching again
+    await ahead.read(900000, 1024)
+    assert not ahead.segments
+
+@pytest.mark.asyncio
+async def test_reads_past_the_end():
+    reader = FakeReader(b"hello world")
+    ahead = readahead.Readahead(reader, min_window=4)
+    assert await ahead.read(0, 5) == b"hello"
+    assert await ahead.read(5, 100) == b" world"
+    assert await ahead.read(11, 100) == b""
+    ahead.close()
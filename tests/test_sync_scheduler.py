@@ -0,0 +1,128 @@
+# Test the sync scheduler's ordering, concurrency limit and retries
+import pytest
+import asyncio
+import sync_scheduler
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    scheduler = sync_scheduler.SyncScheduler(concurrency=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def job(name):
+        await gate.wait()
+        order.append(name)
+
+    # The first job holds the only worker while the rest queue up behind it
+    await scheduler.submit("first", lambda: job("first"))
+    await asyncio.sleep(0)
+    await scheduler.submit("big-blob", lambda: job("big-blob"), sync_scheduler.PRIORITY_BLOB, size=1 << 30)
+    await scheduler.submit("small-blob", lambda: job("small-blob"), sync_scheduler.PRIORITY_BLOB, size=1)
+    await scheduler.submit("document", lambda: job("document"), sync_scheduler.PRIORITY_DOCUMENT)
+    await scheduler.submit("metadata", lambda: job("metadata"), sync_scheduler.PRIORITY_METADATA)
+    # Something is waiting on the big blob, so it jumps the queue
+    await scheduler.bump("big-blob")
+    gate.set()
+    await scheduler.wait_idle()
+    scheduler.stop()
+
+    assert order == ["first", "big-blob", "metadata", "document", "small-blob"]
+    assert scheduler.progress()["completed"] == 5
+
+@pytest.mark.asyncio
+async def test_concurrency_bounded():
+    scheduler = sync_scheduler.SyncScheduler(concurrency=4)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for i in range(20):
+        await scheduler.submit(i, job)
+    await scheduler.wait_idle()
+    scheduler.stop()
+
+    assert peak == 4
+    assert scheduler.progress()["completed"] == 20
+
+@pytest.mark.asyncio
+async def test_retry_with_backoff():
+    scheduler = sync_scheduler.SyncScheduler(concurrency=2, max_attempts=3, backoff=0.01)
+    attempts = {"flaky": 0, "broken": 0}
+
+    async def flaky():
+        attempts["flaky"] += 1
+        if attempts["flaky"] < 3:
+            raise ConnectionError("peer went away")
+        return "synced"
+
+    async def broken():
+        attempts["broken"] += 1
+        raise ConnectionError("peer went away")
+
+    flaky_result = await scheduler.submit("flaky", flaky)
+    broken_result = await scheduler.submit("broken", broken)
+    await scheduler.wait_idle()
+    scheduler.stop()
+
+    assert await flaky_result == "synced"
+    with pytest.raises(ConnectionError):
+        await broken_result
+    assert attempts == {"flaky": 3, "broken": 3}
+    progress = scheduler.progress()
+    assert progress["completed"] == 1
+    assert progress["failed"] == 1
+    assert progress["retried"] == 4
+
+@pytest.mark.asyncio
+async def test_duplicate_submit_runs_once():
+    scheduler = sync_scheduler.SyncScheduler(concurrency=2)
+    runs = []
+
+    async def job():
+        runs.append(1)
+
+    first = await scheduler.submit("doc", job)
+    second = await scheduler.submit("doc", job)
+    assert first is second
+    await scheduler.wait_idle()
+    scheduler.stop()
+    assert len(runs) == 1
+
+@pytest.mark.asyncio
+async def test_resubmit_uses_newest_fn():
+    scheduler = sync_scheduler.SyncScheduler(concurrency=1)
+    runs = []
+    gate = asyncio.Event()
+
+    async def job(ticket):
+        runs.append(ticket)
+        await gate.wait()
+        return ticket
+
+    # Replaced while queued behind "busy", only the newest ticket runs
+    await scheduler.submit("busy", lambda: job("busy"))
+    await asyncio.sleep(0)
+    queued = await scheduler.submit("blob", lambda: job("old"))
+    await scheduler.submit("blob", lambda: job("new"))
+    gate.set()
+    await scheduler.wait_idle()
+    assert runs == ["busy", "new"]
+    assert await queued == "new"
+
+    # Replaced while running, it runs again with the newest ticket
+    gate.clear()
+    runs.clear()
+    running = await scheduler.submit("blob", lambda: job("first"))
+    await asyncio.sleep(0)
+    await scheduler.submit("blob", lambda: job("second"))
+    gate.set()
+    await scheduler.wait_idle()
+    scheduler.stop()
+    assert runs == ["first", "second"]
+    assert await running == "second"
@@ -0,0 +1,43 @@
+# Test that share tickets are only made when a document is asked for
+import pytest
+import asyncio
+import recurso
+
+@pytest.mark.asyncio
+async def test_tickets_published_on_request():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+    tickets_doc = await recurso.open_document(ticket_doc_id)
+
+    # Creating files doesn't add anything to the ticket document
+    blob_hash = await recurso.add_blob_bytes(b"never gonna give you up")
+    file_doc_id = await recurso.create_file_document("test.txt", 23, blob_hash, inode_map_doc_id, ticket_doc_id)
+    assert len(await recurso.get_all_keys_by_prefix(tickets_doc, "inode_")) == 0
+    # Only the registry is shared up front
+    assert await recurso.get_by_key(ticket_doc_id, recurso.TICKET_REGISTRY_KEY) is not None
+
+    # Once asked for, the file, its metadata and its blob are published
+    assert await recurso.ticket_registry.publish(file_doc_id)
+    for suffix in ["-", "_metadata", "_blob"]:
+        assert await recurso.get_by_key(ticket_doc_id, recurso.ticket_key(file_doc_id, suffix)) is not None
+    assert recurso.ticket_registry.generated == 1
+
+    # Asking again reuses the tickets we already made
+    assert await recurso.ticket_registry.publish(file_doc_id)
+    assert recurso.ticket_registry.hits == 1
+
+    # Directories publish their children document too
+    assert await recurso.ticket_registry.publish(root_directory_doc_id)
+    assert await recurso.get_by_key(ticket_doc_id, recurso.ticket_key(root_directory_doc_id, "_children")) is not None
+
+def test_parse_ticket_key():
+    doc_id = "rheibcmkl4jn63iolncyffoxyhoe327unn5wndwvmvkb5dmnxsjq"
+    for suffix in recurso.TICKET_SUFFIXES:
+        key = recurso.ticket_key(doc_id, suffix)
+        assert recurso.parse_ticket_key(key) == (doc_id, suffix)
+        assert recurso.parse_ticket_key(key.encode()) == (doc_id, suffix)
+    # Other shapes are left alone rather than scheduled
+    assert recurso.parse_ticket_key("inode_" + doc_id) is None
+    assert recurso.parse_ticket_key("inode_-") is None
+    assert recurso.parse_ticket_key(recurso.TICKET_REGISTRY_KEY) is None
@@ -0,0 +1,77 @@
+# Test the watch pipeline's coalescing, backpressure and delivery order
+import pytest
+import asyncio
+import watch_pipeline
+
+@pytest.mark.asyncio
+async def test_events_delivered_in_order():
+    pipeline = watch_pipeline.WatchPipeline()
+    seen = []
+    pipeline.watch("doc", lambda doc_id, payload: seen.append((doc_id, payload)))
+    for i in range(10):
+        await pipeline.put("doc", "key-{}".format(i), i)
+    await pipeline.drain()
+    pipeline.stop()
+    assert seen == [("doc", i) for i in range(10)]
+
+@pytest.mark.asyncio
+async def test_same_key_coalesces():
+    pipeline = watch_pipeline.WatchPipeline()
+    seen = []
+    pipeline.watch("doc", lambda doc_id, payload: seen.append(payload))
+    # Nothing is dispatched until we yield, so all of these queue up together
+    await pipeline.put("doc", "a", 1)
+    await pipeline.put("doc", "b", 1)
+    await pipeline.put("doc", "a", 2)
+    await pipeline.put("doc", "a", 3)
+    await pipeline.put("doc", None, "x")
+    await pipeline.put("doc", None, "y")
+    await pipeline.drain()
+    pipeline.stop()
+    # The last value for "a" is delivered in the place of the first
+    assert seen == [3, 1, "x", "y"]
+    assert pipeline.stats()["coalesced"] == 2
+
+@pytest.mark.asyncio
+async def test_full_queue_blocks_producer():
+    pipeline = watch_pipeline.WatchPipeline(max_pending_per_doc=4)
+    gate = asyncio.Event()
+    seen = []
+
+    async def handler(doc_id, payload):
+        await gate.wait()
+        seen.append(payload)
+
+    pipeline.watch("doc", handler)
+
+    async def produce():
+        for i in range(20):
+            await pipeline.put("doc", i, i)
+
+    producer = asyncio.create_task(produce())
+    await asyncio.sleep(0.01)
+    # One event is being handled and the queue is full, so the producer is waiting
+    assert not producer.done()
+    assert pipeline.pending() == 4
+    gate.set()
+    await producer
+    await pipeline.drain()
+    pipeline.stop()
+    assert seen == list(range(20))
+    assert pipeline.stats()["blocked"] > 0
+
+@pytest.mark.asyncio
+async def test_docs_served_round_robin():
+    pipeline = watch_pipeline.WatchPipeline()
+    seen = []
+    for doc_id in ["busy", "quiet"]:
+        pipeline.watch(doc_id, lambda doc_id, payload: seen.append(doc_id))
+    for i in range(5):
+        await pipeline.put("busy", i, i)
+    await pipeline.put("quiet", 0, 0)
+    # Events for documents nobody watches are dropped
+    await pipeline.put("unwatched", 0, 0)
+    await pipeline.drain()
+    pipeline.stop()
+    assert seen[:2] == ["busy", "quiet"]
+    assert seen.count("busy") == 5
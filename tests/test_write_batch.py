@@ -0,0 +1,27 @@
+# Test that batched writes land in their documents
+import pytest
+import asyncio
+import recurso
+
+@pytest.mark.asyncio
+async def test_write_batch_commit():
+    await recurso.setup_iroh_node()
+
+    root_doc_id, root_directory_doc_id, inode_map_doc_id, ticket_doc_id = await recurso.create_root_document()
+
+    children_doc_id = await recurso.create_children_document(inode_map_doc_id)
+    batch = recurso.WriteBatch(concurrency=2)
+    batch.set(children_doc_id, "updated", "1")
+    # Setting a key twice keeps the last value
+    batch.set(children_doc_id, "updated", "2")
+    for name in ["never", "gonna", "give"]:
+        batch.set(children_doc_id, await recurso.encode_filename(name, "file"), b"rheibcmkl4jn63iolncyffoxyhoe327unn5wndwvmvkb5dmnxsjq")
+    batch.set(await recurso.open_document(ticket_doc_id), b"test", b"value")
+    assert len(batch) == 5
+
+    assert await batch.commit() == 5
+    assert len(batch) == 0
+    assert await recurso.get_by_key(children_doc_id, "updated") == "2"
+    assert await recurso.get_by_key(ticket_doc_id, "test") == "value"
+    # Children keys written through a batch still keep the entry count
+    assert await recurso.get_child_count(children_doc_id) == 3
@@ -0,0 +1,102 @@
+# Test buffering of writes before they are committed as a blob
+import pytest
+import asyncio
+import random
+import chunker
+import recurso
+
+def test_write_buffer_in_memory():
+    write_buffer = recurso.WriteBuffer(spill_threshold=1024)
+    write_buffer.write(0, b"hello")
+    write_buffer.write(5, b" world")
+    # Overwrite in place
+    write_buffer.write(0, b"J")
+    assert write_buffer.file is None
+    assert write_buffer.size == 11
+    assert write_buffer.read(0, 100) == b"Jello world"
+    assert write_buffer.dirty
+
+def test_write_buffer_fills_holes():
+    write_buffer = recurso.WriteBuffer(spill_threshold=1024)
+    write_buffer.write(4, b"x")
+    assert write_buffer.read(0, 5) == b"\0\0\0\0x"
+
+def test_write_buffer_spills_to_disk():
+    write_buffer = recurso.WriteBuffer(spill_threshold=8)
+    write_buffer.write(0, b"12345")
+    assert write_buffer.file is None
+    write_buffer.write(5, b"67890")
+    assert write_buffer.file is not None
+    assert write_buffer.read(0, 10) == b"1234567890"
+    assert write_buffer.read(8, 10) == b"90"
+    write_buffer.close()
+
+def test_write_buffer_truncate():
+    write_buffer = recurso.WriteBuffer(spill_threshold=1024)
+    write_buffer.write(0, b"hello world")
+    write_buffer.truncate(5)
+    assert write_buffer.read(0, 100) == b"hello"
+    write_buffer.truncate(7)
+    assert write_buffer.read(0, 100) == b"hello\0\0"
+
+@pytest.mark.asyncio
+async def test_write_buffer_commit():
+    await recurso.setup_iroh_node()
+
+    for spill_threshold in [1024, 4]:
+        write_buffer = recurso.WriteBuffer(spill_threshold=spill_threshold)
+        write_buffer.write(0, b"hello recurso\n")
+        blob_hash, size, blob_format = await write_buffer.commit()
+        assert size == 14
+        assert blob_format == recurso.BLOB_FORMAT_RAW
+        assert not write_buffer.dirty
+        assert await recurso.get_blob(str(blob_hash)) == b"hello recurso\n"
+        write_buffer.close()
+
+async def test_write_buffer_commit_chunked():
+    await recurso.setup_iroh_node()
+
+    data = bytes(range(256)) * 8192
+    for spill_threshold in [len(data) * 2, 1024]:
+        write_buffer = recurso.WriteBuffer(spill_threshold=spill_threshold, chunk_threshold=1024)
+        write_buffer.write(0, data)
+        blob_hash, size, blob_format = await write_buffer.commit()
+        assert blob_format == recurso.BLOB_FORMAT_HASHSEQ
+
+        # Ranged reads, including ones that span chunk boundaries
+        reader = recurso.make_blob_reader(blob_hash, size, blob_format)
+        assert await reader.read(0, size) == data
+        assert await reader.read(300000, 1000000) == data[300000:1300000]
+        assert await reader.read(size - 10, 100) == data[-10:]
+        write_buffer.close()
+
+async def test_write_buffer_recommit_only_rechunks_changes(monkeypatch):
+    await recurso.setup_iroh_node()
+    monkeypatch.setattr(recurso, "file_chunker", chunker.Chunker(min_size=1024, avg_size=4096, max_size=16384))
+
+    data = bytearray(random.Random(1).randbytes(300000))
+    write_buffer = recurso.WriteBuffer(chunk_threshold=1024)
+    write_buffer.write(0, data)
+    blob_hash, size, blob_format = await write_buffer.commit()
+    first = dict(zip(write_buffer.chunk_offsets, write_buffer.chunk_hashes))
+    write_buffer.close()
+
+    # A one byte edit in the middle of the file, starting from the committed blob
+    write_buffer = recurso.WriteBuffer(chunk_threshold=1024)
+    await write_buffer.load(recurso.make_blob_reader(blob_hash, size, blob_format))
+    write_buffer.write(150000, b"x")
+    data[150000:150001] = b"x"
+    blob_hash, size, blob_format = await write_buffer.commit()
+
+    # Same cut points as chunking from scratch, and every chunk but the edited ones is unchanged
+    offsets = []
+    offset = 0
+    for chunk in recurso.file_chunker.chunks(bytes(data)):
+        offsets.append(offset)
+        offset += len(chunk)
+    assert write_buffer.chunk_offsets == offsets
+    changed = [offset for offset, chunk_hash in zip(write_buffer.chunk_offsets, write_buffer.chunk_hashes) if first.get(offset) != chunk_hash]
+    assert 0 < len(changed) <= 3
+    reader = recurso.make_blob_reader(blob_hash, size, blob_format)
+    assert await reader.read(0, size) == bytes(data)
+    write_buffer.close()
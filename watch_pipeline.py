@@ -0,0 +1,140 @@
+# Delivers document change events to their handlers from a single dispatcher task.
+# Each watched document gets a bounded queue: producers wait when it is full,
+# and an event for a key that is still queued replaces the queued one rather
+# than taking another slot, so a burst of writes to one key is handled once.
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Hashable, Optional
+
+MAX_PENDING_PER_DOC = 1024
+
+class DocQueue:
+    __slots__ = ("doc_id", "handler", "pending", "space", "scheduled")
+
+    def __init__(self, doc_id, handler):
+        self.doc_id = doc_id
+        self.handler = handler
+        # key -> (payload, time first queued), in arrival order
+        self.pending = OrderedDict()
+        self.space = asyncio.Event()
+        self.space.set()
+        # Whether the queue is in the dispatcher's ready list
+        self.scheduled = False
+
+class WatchPipeline:
+    def __init__(self, max_pending_per_doc: int = MAX_PENDING_PER_DOC):
+        self.max_pending_per_doc = max_pending_per_doc
+        self.queues = {}
+        # Queues with events waiting, served round robin so one busy document can't starve the rest
+        self.ready = deque()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        # Keys for events that must never be merged with another
+        self.unique = itertools.count()
+        self.received = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.blocked = 0
+        self.busy = False
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def watch(self, doc_id, handler: Callable[[Any, Any], Any]):
+        # handler(doc_id, payload) is called for every event put for doc_id,
+        # and may be a coroutine function
+        self.queues[doc_id] = DocQueue(doc_id, handler)
+
+    def unwatch(self, doc_id):
+        self.queues.pop(doc_id, None)
+
+    def start(self):
+        if self.dispatcher is None:
+            self.dispatcher = asyncio.create_task(self.dispatch())
+
+    def stop(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+
+    async def put(self, doc_id, key: Optional[Hashable], payload):
+        # Queue payload for doc_id. Events with the same key coalesce while queued,
+        # a key of None never coalesces.
+        queue = self.queues.get(doc_id)
+        if queue is None:
+            return
+        self.start()
+        self.received += 1
+        if key is not None and key in queue.pending:
+            # Newest payload wins, but the event keeps its place (and age) in the queue
+            queue.pending[key] = (payload, queue.pending[key][1])
+            self.coalesced += 1
+            return
+        if len(queue.pending) >= self.max_pending_per_doc:
+            self.blocked += 1
+            while len(queue.pending) >= self.max_pending_per_doc:
+                queue.space.clear()
+                await queue.space.wait()
+            if key is not None and key in queue.pending:
+                queue.pending[key] = (payload, queue.pending[key][1])
+                self.coalesced += 1
+                return
+        if key is None:
+            key = ("unique", next(self.unique))
+        queue.pending[key] = (payload, time.monotonic())
+        if not queue.scheduled:
+            queue.scheduled = True
+            self.ready.append(queue)
+            self.wakeup.set()
+
+    async def dispatch(self):
+        while True:
+            while not self.ready:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            queue = self.ready.popleft()
+            if not queue.pending:
+                queue.scheduled = False
+                continue
+            key, (payload, queued_at) = queue.pending.popitem(last=False)
+            queue.space.set()
+            if queue.pending:
+                self.ready.append(queue)
+            else:
+                queue.scheduled = False
+            lag = time.monotonic() - queued_at
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self.dispatched += 1
+            self.busy = True
+            try:
+                result = queue.handler(queue.doc_id, payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error handling change to doc '{queue.doc_id}': {str(e)}")
+            finally:
+                self.busy = False
+
+    def pending(self):
+        return sum(len(queue.pending) for queue in self.queues.values())
+
+    async def drain(self):
+        # Wait until every queued event has been handled
+        while self.pending() or self.busy:
+            await asyncio.sleep(0.001)
+
+    def stats(self):
+        return {
+            "docs": len(self.queues),
+            "pending": self.pending(),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "dispatched": self.dispatched,
+            "blocked": self.blocked,
+            "lag_avg": self.lag_total / self.dispatched if self.dispatched else 0.0,
+            "lag_max": self.lag_max,
+        }